@@ -216,10 +216,168 @@ else:
     }
     MEDIA_URL = "/media/"
 
+# ---------------------------------------------------------------------
+# Derivative job queue
+# ---------------------------------------------------------------------
+# Jobs are durable rows; the web process drains them in a background thread
+# unless PHOTO_DERIVATIVE_INLINE_WORKER=0, in which case only
+# `manage.py run_derivative_worker` processes them.
+PHOTO_DERIVATIVE_INLINE_WORKER = (
+    os.getenv("PHOTO_DERIVATIVE_INLINE_WORKER", "1") == "1"
+)
+PHOTO_DERIVATIVE_MAX_ATTEMPTS = int(
+    os.getenv("PHOTO_DERIVATIVE_MAX_ATTEMPTS", "5")
+)
+PHOTO_DERIVATIVE_RETRY_BACKOFF_SECONDS = int(
+    os.getenv("PHOTO_DERIVATIVE_RETRY_BACKOFF_SECONDS", "30")
+)
+PHOTO_DERIVATIVE_LEASE_SECONDS = int(
+    os.getenv("PHOTO_DERIVATIVE_LEASE_SECONDS", "900")
+)
+# "serial" renders in the draining thread; "thread" and "process" render up
+# to PHOTO_DERIVATIVE_CONCURRENCY photos at once (0 means one per CPU).
+# Process workers are replaced after PHOTO_DERIVATIVE_MAX_TASKS_PER_CHILD
+# renders to return fragmented Pillow memory to the OS.
+PHOTO_DERIVATIVE_EXECUTOR = os.getenv("PHOTO_DERIVATIVE_EXECUTOR", "serial")
+PHOTO_DERIVATIVE_CONCURRENCY = int(
+    os.getenv("PHOTO_DERIVATIVE_CONCURRENCY", "0")
+)
+PHOTO_DERIVATIVE_MAX_TASKS_PER_CHILD = int(
+    os.getenv("PHOTO_DERIVATIVE_MAX_TASKS_PER_CHILD", "50")
+)
+
+# Responsive widths stored for every photo (see PhotoRendition); widths at or
+# above an original's own width are skipped.
+PHOTO_RENDITION_WIDTHS = [
+    int(width)
+    for width in os.getenv(
+        "PHOTO_RENDITION_WIDTHS",
+        "320,640,960,1280,1920,2560",
+    ).split(",")
+    if width.strip()
+]
+# Encodings stored for each ladder width; formats this Pillow build cannot
+# encode are skipped. Clients get the best one their Accept header allows.
+PHOTO_RENDITION_FORMATS = [
+    image_format.strip().lower()
+    for image_format in os.getenv(
+        "PHOTO_RENDITION_FORMATS",
+        "jpeg,webp,avif",
+    ).split(",")
+    if image_format.strip()
+]
+# Boxes the on-demand /img/<id>/<w>x<h>.<fmt> endpoint will render ("Wx0"
+# fits the width only). Rendered variants live in a local LRU directory
+# capped at PHOTO_VARIANT_CACHE_MAX_BYTES.
+PHOTO_VARIANT_SIZES = [
+    size
+    for size in os.getenv(
+        "PHOTO_VARIANT_SIZES",
+        "320x0,640x0,800x0,960x0,1280x0,1600x1600,1920x0,2560x0",
+    ).split(",")
+    if size.strip()
+]
+PHOTO_VARIANT_CACHE_DIR = os.getenv(
+    "PHOTO_VARIANT_CACHE_DIR",
+    str(BASE_DIR / "cache" / "variants"),
+)
+PHOTO_VARIANT_CACHE_MAX_BYTES = int(
+    os.getenv("PHOTO_VARIANT_CACHE_MAX_BYTES", str(512 * 1024 * 1024))
+)
+# Staff upload progress stream (Server-Sent Events). Streams end after
+# PHOTO_PROGRESS_STREAM_SECONDS so they never pin a worker thread; the
+# browser reconnects after PHOTO_PROGRESS_RETRY_MS.
+PHOTO_PROGRESS_STREAM_SECONDS = int(
+    os.getenv("PHOTO_PROGRESS_STREAM_SECONDS", "55")
+)
+PHOTO_PROGRESS_POLL_SECONDS = float(
+    os.getenv("PHOTO_PROGRESS_POLL_SECONDS", "1")
+)
+PHOTO_PROGRESS_RETRY_MS = 3000
+PHOTO_PROGRESS_MAX_BATCH = 500
+# Rendered /api/photos/ bodies live in the default cache (per process unless
+# CACHES points at a shared backend) for PHOTO_API_CACHE_SECONDS. They are
+# keyed on the query and replaced, in the background, whenever the catalog
+# version moves.
+PHOTO_API_CACHE_SECONDS = int(os.getenv("PHOTO_API_CACHE_SECONDS", str(24 * 60 * 60)))
+# For this long after a change the previous body is still served while the
+# new one renders; later first hits after a quiet spell render in-request.
+PHOTO_API_CACHE_STALE_SECONDS = int(
+    os.getenv("PHOTO_API_CACHE_STALE_SECONDS", "300")
+)
+# /api/photos/?count=1 totals are cached per filter for this long.
+PHOTO_API_COUNT_CACHE_SECONDS = int(
+    os.getenv("PHOTO_API_COUNT_CACHE_SECONDS", "60")
+)
+# Uploads whose dHash is within this many bits of an existing photo are
+# reported as possible near-duplicates (exact duplicates are skipped).
+PHOTO_NEAR_DUPLICATE_DISTANCE = int(
+    os.getenv("PHOTO_NEAR_DUPLICATE_DISTANCE", "6")
+)
+# Uploads are answered with 503 + Retry-After once this many derivative jobs
+# are waiting.
+PHOTO_DERIVATIVE_MAX_BACKLOG = int(
+    os.getenv("PHOTO_DERIVATIVE_MAX_BACKLOG", "200")
+)
+
+# ---------------------------------------------------------------------
+# Image processing memory admission
+# ---------------------------------------------------------------------
+# Decodes are admitted while their estimated peak rasters fit this budget
+# (bytes, per process). Upload optimization waits at most
+# IMAGE_PROCESSING_ADMISSION_TIMEOUT seconds before answering 503.
+IMAGE_PROCESSING_MEMORY_BUDGET = int(
+    os.getenv("IMAGE_PROCESSING_MEMORY_BUDGET", str(192 * 1024 * 1024))
+)
+IMAGE_PROCESSING_ADMISSION_TIMEOUT = float(
+    os.getenv("IMAGE_PROCESSING_ADMISSION_TIMEOUT", "10")
+)
+IMAGE_PROCESSING_RETRY_AFTER = int(
+    os.getenv("IMAGE_PROCESSING_RETRY_AFTER", "30")
+)
+
 # Reject unexpectedly large requests before application code handles them.
-DATA_UPLOAD_MAX_MEMORY_SIZE = 300 * 1024 * 1024
+# File data does not count towards DATA_UPLOAD_MAX_MEMORY_SIZE; photo
+# uploads stream through StreamingImageUploadHandler, which keeps at most
+# PHOTO_UPLOAD_MEMORY_CEILING of a request's files in memory and spools the
+# rest to FILE_UPLOAD_TEMP_DIR.
+DATA_UPLOAD_MAX_MEMORY_SIZE = int(
+    os.getenv("DATA_UPLOAD_MAX_MEMORY_SIZE", str(5 * 1024 * 1024))
+)
 DATA_UPLOAD_MAX_NUMBER_FILES = 25
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5 * 1024 * 1024
+PHOTO_UPLOAD_MEMORY_CEILING = int(
+    os.getenv("PHOTO_UPLOAD_MEMORY_CEILING", str(16 * 1024 * 1024))
+)
+# Originals of one upload batch are written to storage this many at a time.
+PHOTO_UPLOAD_STORAGE_CONCURRENCY = int(
+    os.getenv("PHOTO_UPLOAD_STORAGE_CONCURRENCY", "4")
+)
+# Resumable uploads (/api/uploads/) spool chunks to local disk under
+# PHOTO_UPLOAD_SESSION_DIR, so a session must be resumed against the same
+# instance. Each PATCH carries at most PHOTO_UPLOAD_CHUNK_MAX_BYTES;
+# sessions and their idempotency keys expire after
+# PHOTO_UPLOAD_SESSION_TTL_SECONDS without activity.
+PHOTO_UPLOAD_SESSION_DIR = os.getenv(
+    "PHOTO_UPLOAD_SESSION_DIR",
+    str(BASE_DIR / "cache" / "uploads"),
+)
+PHOTO_UPLOAD_CHUNK_MAX_BYTES = int(
+    os.getenv("PHOTO_UPLOAD_CHUNK_MAX_BYTES", str(8 * 1024 * 1024))
+)
+PHOTO_UPLOAD_SESSION_TTL_SECONDS = int(
+    os.getenv("PHOTO_UPLOAD_SESSION_TTL_SECONDS", str(24 * 60 * 60))
+)
+# Finalize claims a session before storing its original; a claim older
+# than this was left by a crashed request and can be taken over.
+PHOTO_UPLOAD_FINALIZE_LEASE_SECONDS = int(
+    os.getenv("PHOTO_UPLOAD_FINALIZE_LEASE_SECONDS", "300")
+)
+# With S3 storage, /api/uploads/direct/ hands out presigned PUT/POST targets
+# so originals go straight to the bucket; they expire after this long.
+PHOTO_DIRECT_UPLOAD_EXPIRES_SECONDS = int(
+    os.getenv("PHOTO_DIRECT_UPLOAD_EXPIRES_SECONDS", "900")
+)
 
 # ---------------------------------------------------------------------
 # CORS (set your frontend origins)
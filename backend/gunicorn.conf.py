@@ -6,3 +6,13 @@ graceful_timeout = 30
 # runs in a background thread, so additional worker processes only duplicate
 # the application's memory footprint.
 workers = 1
+# Threads let the staff progress stream (Server-Sent Events) stay open
+# without blocking other requests in the single worker.
+threads = 4
+
+
+def post_worker_init(worker):
+    # Resume derivative jobs left queued or leased by a previous process.
+    from portfolio.models import start_inline_derivative_worker
+
+    start_inline_derivative_worker()
@@ -1,8 +1,10 @@
 from django.contrib import admin
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from django.utils.html import format_html
 
 from .forms import PhotoForm
-from .models import Label, Photo
+from .models import DerivativeJob, Label, Photo
 
 
 @admin.register(Label)
@@ -37,3 +39,66 @@ class PhotoAdmin(admin.ModelAdmin):
                 obj.thumbnail_url,
             )
         return "-"
+
+
+@admin.register(DerivativeJob)
+class DerivativeJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "id",
+        "photo",
+        "status",
+        "attempts",
+        "run_after",
+        "duration_ms",
+        "locked_by",
+    )
+    list_filter = ("status",)
+    list_select_related = ("photo",)
+    readonly_fields = ("started_at", "finished_at", "duration_ms", "last_error")
+    actions = ["requeue"]
+
+    @admin.action(description="Requeue selected jobs")
+    def requeue(self, request, queryset):
+        """
+        Requeue dead jobs, at most one per photo. Photos that already have a
+        queued or running job are skipped: a second active job would break
+        the one-active-job constraint.
+        """
+        dead = (
+            queryset.filter(status=DerivativeJob.Status.DEAD)
+            .exclude(
+                photo__derivative_jobs__status__in=[
+                    DerivativeJob.Status.QUEUED,
+                    DerivativeJob.Status.RUNNING,
+                ]
+            )
+            .order_by("photo_id", "-created_at", "-id")
+            .values_list("id", "photo_id")
+        )
+        job_ids = {}
+        for job_id, photo_id in dead:
+            job_ids.setdefault(photo_id, job_id)
+
+        requeued = 0
+        for job_id in job_ids.values():
+            try:
+                # A worker or upload may queue the photo meanwhile.
+                with transaction.atomic():
+                    requeued += DerivativeJob.objects.filter(
+                        pk=job_id, status=DerivativeJob.Status.DEAD
+                    ).update(
+                        status=DerivativeJob.Status.QUEUED,
+                        attempts=0,
+                        run_after=timezone.now(),
+                    )
+            except IntegrityError:
+                pass
+
+        skipped = queryset.count() - requeued
+        message = f"Requeued {requeued} job{'s' if requeued != 1 else ''}."
+        if skipped:
+            message += (
+                f" Skipped {skipped}: not dead, or the photo already has a "
+                "queued or running job."
+            )
+        self.message_user(request, message)
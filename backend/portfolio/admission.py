@@ -0,0 +1,122 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+# Pillow's in-memory bytes per pixel. Three-band modes are padded to four.
+_BYTES_PER_PIXEL = {
+    "1": 1,
+    "L": 1,
+    "P": 1,
+    "I;16": 2,
+    "I;16B": 2,
+    "I;16L": 2,
+    "I;16N": 2,
+}
+_JPEG_DRAFT_SCALES = (8, 4, 2, 1)
+
+
+class ImageProcessingBusy(Exception):
+    """Raised when image work cannot be admitted within its wait budget."""
+
+    def __init__(self, message="Image processing is busy.", retry_after=None):
+        super().__init__(message)
+        self.retry_after = (
+            retry_after
+            if retry_after is not None
+            else settings.IMAGE_PROCESSING_RETRY_AFTER
+        )
+
+
+def raster_bytes(size, mode):
+    width, height = size
+    return width * height * _BYTES_PER_PIXEL.get(mode, 4)
+
+
+def jpeg_draft_size(size, target):
+    """Mirror the scale Image.draft picks for a (target, target) request."""
+    width, height = size
+    ratio = min(width // target, height // target) if target else 1
+    scale = next(scale for scale in _JPEG_DRAFT_SCALES if scale <= max(ratio, 1))
+    return math.ceil(width / scale), math.ceil(height / scale)
+
+
+def fitted_size(size, max_side):
+    width, height = size
+    longest = max(width, height, 1)
+    if longest <= max_side:
+        return size
+    factor = max_side / longest
+    return max(1, int(width * factor)), max(1, int(height * factor))
+
+
+def estimate_resize_bytes(size, mode, image_format, max_side, copies=3):
+    """
+    Peak raster memory for decoding an image and resizing it to fit
+    max_side: the (draft-reduced) decode, an RGB conversion when needed and a
+    few working copies at the target size. Header values are enough.
+    """
+    decoded_size = size
+    if image_format == "JPEG":
+        decoded_size = jpeg_draft_size(size, max_side)
+    peak = raster_bytes(decoded_size, mode)
+    if mode not in ("RGB", "L"):
+        peak += raster_bytes(decoded_size, "RGB")
+    return peak + raster_bytes(fitted_size(size, max_side), "RGB") * copies
+
+
+def estimate_full_decode_bytes(size, mode, copies=2):
+    """Peak raster memory for work that keeps full-resolution copies."""
+    return raster_bytes(size, mode) + raster_bytes(size, "RGB") * copies
+
+
+class MemoryBudget:
+    """
+    Admit image jobs while their estimated rasters fit a byte budget.
+
+    Reservations larger than the whole budget are clamped to it, so an
+    oversized image still runs, just never alongside anything else.
+    """
+
+    def __init__(self, limit=None):
+        self._limit = limit
+        self._in_use = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):
+        return self._limit or settings.IMAGE_PROCESSING_MEMORY_BUDGET
+
+    @limit.setter
+    def limit(self, value):
+        self._limit = value
+
+    @property
+    def in_use(self):
+        return self._in_use
+
+    @contextmanager
+    def reserve(self, nbytes, timeout=None):
+        nbytes = max(0, min(int(nbytes), self.limit))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._in_use and self._in_use + nbytes > self.limit:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise ImageProcessingBusy(
+                        "Not enough image processing memory is free right now."
+                    )
+                self._condition.wait(remaining)
+            self._in_use += nbytes
+        try:
+            yield nbytes
+        finally:
+            with self._condition:
+                self._in_use -= nbytes
+                self._condition.notify_all()
+
+
+image_memory_budget = MemoryBudget()
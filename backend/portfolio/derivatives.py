@@ -0,0 +1,501 @@
+import base64
+import io
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import ExifTags, Image, ImageOps, features
+
+from .admission import estimate_resize_bytes, image_memory_budget
+from .exif import extract_photo_metadata, header_exif
+from .fingerprints import dhash, sha256_file
+from .palette import extract_palette
+from .thumbhash import image_to_thumbhash
+
+
+THUMB_MAX_W = 800     # grid thumbnail
+THUMB_QUALITY = 70
+PREVIEW_MAX_W = 1600  # detail view
+PREVIEW_QUALITY = 80
+BLUR_W = 24           # tiny LQIP width (data URL)
+
+# Rendition formats: Pillow encoder name, MIME type, file extension and the
+# quality offset from the JPEG setting for roughly equal visual quality.
+RENDITION_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg", "jpg", 0),
+    "webp": ("WEBP", "image/webp", "webp", 0),
+    "avif": ("AVIF", "image/avif", "avif", -20),
+}
+# Best first; negotiation picks the first format the client accepts.
+RENDITION_FORMAT_PREFERENCE = ("avif", "webp", "jpeg")
+
+
+def available_rendition_formats():
+    """Configured rendition formats this Pillow build can encode."""
+    return [
+        image_format
+        for image_format in RENDITION_FORMAT_PREFERENCE
+        if image_format in settings.PHOTO_RENDITION_FORMATS
+        and (image_format == "jpeg" or features.check(image_format))
+    ]
+
+
+def rendition_plan():
+    """
+    (width, format) pairs every photo should have. Non-JPEG formats also get
+    the thumb and preview widths so negotiated thumbnail and preview URLs
+    have an exact counterpart to the stored JPEG derivatives.
+    """
+    widths = set(settings.PHOTO_RENDITION_WIDTHS)
+    plan = []
+    for image_format in available_rendition_formats():
+        format_widths = widths
+        if image_format != "jpeg":
+            format_widths = widths | {THUMB_MAX_W, PREVIEW_MAX_W}
+        plan.extend((width, image_format) for width in sorted(format_widths))
+    return plan
+
+
+def negotiate_image_format(accept_header):
+    """Pick the best available rendition format the Accept header allows."""
+    accepted = set()
+    for item in (accept_header or "").split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            accepted.add(media_type.lower())
+
+    for image_format in available_rendition_formats():
+        if RENDITION_FORMATS[image_format][1] in accepted:
+            return image_format
+    return "jpeg"
+
+
+def make_resized_jpeg(pil_img, max_w, quality):
+    working_image = pil_img
+    owned_images = []
+    try:
+        if working_image.mode not in ("RGB", "L"):
+            working_image = working_image.convert("RGB")
+            owned_images.append(working_image)
+        width, height = working_image.size
+        if width > max_w:
+            resized_image = working_image.resize(
+                (max_w, max(1, int(height * (max_w / float(width))))),
+                Image.Resampling.LANCZOS,
+            )
+            owned_images.append(resized_image)
+            working_image = resized_image
+        with io.BytesIO() as buffer:
+            working_image.save(
+                buffer,
+                format="JPEG",
+                quality=quality,
+                optimize=True,
+                progressive=True,
+            )
+            return buffer.getvalue()
+    finally:
+        for owned_image in owned_images:
+            owned_image.close()
+
+
+def encode_rendition(pil_img, image_format, quality):
+    """Encode an already-resized RGB/L raster in one rendition format."""
+    encoder, _, _, quality_offset = RENDITION_FORMATS[image_format]
+    if image_format == "jpeg":
+        return make_resized_jpeg(pil_img, pil_img.width, quality)
+    options = {"quality": max(1, quality + quality_offset)}
+    if image_format == "webp":
+        options["method"] = 4
+    elif image_format == "avif":
+        options["speed"] = 6
+    with io.BytesIO() as buffer:
+        pil_img.save(buffer, format=encoder, **options)
+        return buffer.getvalue()
+
+
+def build_blur_data_url(pil_img, tiny_w=BLUR_W):
+    working_image = pil_img
+    converted_image = None
+    tiny_image = None
+    try:
+        if working_image.mode not in ("RGB", "L"):
+            converted_image = working_image.convert("RGB")
+            working_image = converted_image
+        width, height = working_image.size
+        new_height = (
+            max(1, int(height * (tiny_w / float(width)))) if width else 1
+        )
+        tiny_image = working_image.resize(
+            (tiny_w, new_height),
+            Image.Resampling.LANCZOS,
+        )
+        with io.BytesIO() as buffer:
+            tiny_image.save(buffer, format="JPEG", quality=25, optimize=True)
+            encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
+            return f"data:image/jpeg;base64,{encoded}"
+    finally:
+        if tiny_image is not None:
+            tiny_image.close()
+        if converted_image is not None:
+            converted_image.close()
+
+
+def _display_size(pil_img):
+    width, height = pil_img.size
+    try:
+        orientation = header_exif(pil_img).get(ExifTags.Base.Orientation, 1)
+    except (AttributeError, OSError, TypeError, ValueError):
+        orientation = 1
+    if orientation in (5, 6, 7, 8):
+        return height, width
+    return width, height
+
+
+def _resize_to_width(pil_img, width, aspect_size=None):
+    # Pyramid levels take their height from the top level's aspect ratio so
+    # rounding does not drift from one level to the next.
+    aspect_width, aspect_height = aspect_size or pil_img.size
+    height = max(1, round(aspect_height * width / aspect_width))
+    return pil_img.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def render_photo_derivatives(
+    storage_name,
+    thumb=True,
+    preview=True,
+    blur=True,
+    renditions=(),
+    fingerprint=False,
+    thumbhash=True,
+    palette=True,
+):
+    """
+    Decode one original from default storage and return encoded derivatives.
+
+    Arguments and the return value are plain picklable data so the call can
+    run in another process: storage names and flags go in, JPEG bytes, the
+    placeholders and EXIF metadata come back. Nothing is written here.
+
+    The original is decoded once, at the largest size any output needs.
+    Ladder renditions, given as (width, format) pairs, are then produced
+    largest first, each resized from the previous level; widths at or above
+    the original's are skipped. All formats of one width are encoded in
+    parallel from the same resized raster.
+
+    With fingerprint, the original's SHA-256 and dHash are returned too,
+    and render_seconds is how long this call took where it ran.
+    """
+    started = time.monotonic()
+    rendered = {
+        "thumb": None,
+        "preview": None,
+        "blur_data_url": "",
+        "thumbhash": "",
+        "palette": [],
+        "renditions": [],
+        "content_sha256": "",
+        "perceptual_hash": None,
+        "source_bytes": 0,
+        "render_seconds": 0.0,
+    }
+    with default_storage.open(storage_name, "rb") as original:
+        try:
+            rendered["source_bytes"] = original.size
+        except (AttributeError, OSError, ValueError):
+            rendered["source_bytes"] = 0
+        if fingerprint:
+            rendered["content_sha256"] = sha256_file(original)
+        with Image.open(original) as source_image:
+            rendered["metadata"] = extract_photo_metadata(source_image)
+
+            display_width, _ = _display_size(source_image)
+            formats_by_width = {}
+            for width, image_format in renditions:
+                if width < display_width:
+                    formats_by_width.setdefault(width, []).append(image_format)
+            widths = sorted(formats_by_width, reverse=True)
+            top_width = max([PREVIEW_MAX_W, *widths])
+            factor = min(1.0, top_width / display_width)
+            decode_size = (
+                max(1, math.ceil(source_image.width * factor)),
+                max(1, math.ceil(source_image.height * factor)),
+            )
+
+            # Image.open has only parsed the header; wait for enough of the
+            # memory budget before any pixels are decoded.
+            estimated_bytes = estimate_resize_bytes(
+                source_image.size,
+                source_image.mode,
+                source_image.format,
+                max(decode_size),
+            )
+            with image_memory_budget.reserve(estimated_bytes):
+                # JPEG draft decoding avoids allocating the full-resolution
+                # raster when only the ladder's top width is needed.
+                source_image.draft("RGB", decode_size)
+                display_image = ImageOps.exif_transpose(source_image)
+                owned_images = [display_image]
+                try:
+                    display_image.load()
+                    if display_image.mode not in ("RGB", "L"):
+                        display_image = display_image.convert("RGB")
+                        owned_images.append(display_image)
+                    if display_image.width > top_width:
+                        display_image = _resize_to_width(display_image, top_width)
+                        owned_images.append(display_image)
+                    if fingerprint:
+                        rendered["perceptual_hash"] = dhash(display_image)
+
+                    if thumb or preview or blur or thumbhash or palette:
+                        preview_base = display_image
+                        if max(display_image.size) > PREVIEW_MAX_W:
+                            preview_base = ImageOps.contain(
+                                display_image,
+                                (PREVIEW_MAX_W, PREVIEW_MAX_W),
+                                Image.Resampling.LANCZOS,
+                            )
+                            owned_images.append(preview_base)
+                        if thumb:
+                            rendered["thumb"] = make_resized_jpeg(
+                                preview_base,
+                                THUMB_MAX_W,
+                                THUMB_QUALITY,
+                            )
+                        if preview:
+                            rendered["preview"] = make_resized_jpeg(
+                                preview_base,
+                                PREVIEW_MAX_W,
+                                PREVIEW_QUALITY,
+                            )
+                        if blur:
+                            rendered["blur_data_url"] = build_blur_data_url(
+                                preview_base
+                            )
+                        if thumbhash:
+                            rendered["thumbhash"] = image_to_thumbhash(
+                                preview_base
+                            )
+                        if palette:
+                            rendered["palette"] = extract_palette(preview_base)
+
+                    level_image = display_image
+                    encodes = []
+                    with ThreadPoolExecutor(
+                        max_workers=len(RENDITION_FORMATS),
+                        thread_name_prefix="photo-encode",
+                    ) as encoder_pool:
+                        for width in widths:
+                            if level_image.width != width:
+                                level_image = _resize_to_width(
+                                    level_image,
+                                    width,
+                                    display_image.size,
+                                )
+                                owned_images.append(level_image)
+                            quality = (
+                                THUMB_QUALITY
+                                if width <= THUMB_MAX_W
+                                else PREVIEW_QUALITY
+                            )
+                            for index, image_format in enumerate(
+                                formats_by_width[width]
+                            ):
+                                # Image.save keeps encoder state on the image
+                                # object, so concurrent encodes need their own.
+                                encode_source = level_image
+                                if index:
+                                    encode_source = level_image.copy()
+                                    owned_images.append(encode_source)
+                                encodes.append(
+                                    (
+                                        level_image.size,
+                                        image_format,
+                                        encoder_pool.submit(
+                                            encode_rendition,
+                                            encode_source,
+                                            image_format,
+                                            quality,
+                                        ),
+                                    )
+                                )
+                    for (width, height), image_format, encoded in encodes:
+                        rendered["renditions"].append(
+                            {
+                                "width": width,
+                                "height": height,
+                                "format": image_format,
+                                "content": encoded.result(),
+                            }
+                        )
+                finally:
+                    for owned_image in owned_images:
+                        if owned_image is not source_image:
+                            owned_image.close()
+    rendered["render_seconds"] = time.monotonic() - started
+    return rendered
+
+
+def render_variant(storage_name, box, image_format, quality, admission_timeout=None):
+    """
+    Decode one original and encode it to fit box, a (width, height) pair
+    where a height of 0 means "any height". Never upscales.
+    """
+    max_w, max_h = box
+    with default_storage.open(storage_name, "rb") as original:
+        with Image.open(original) as source_image:
+            display_width, display_height = _display_size(source_image)
+            factor = min(
+                1.0,
+                max_w / display_width,
+                max_h / display_height if max_h else 1.0,
+            )
+            target_size = (
+                max(1, round(display_width * factor)),
+                max(1, round(display_height * factor)),
+            )
+            estimated_bytes = estimate_resize_bytes(
+                source_image.size,
+                source_image.mode,
+                source_image.format,
+                max(target_size),
+            )
+            with image_memory_budget.reserve(
+                estimated_bytes,
+                timeout=admission_timeout,
+            ):
+                source_image.draft(
+                    "RGB",
+                    (
+                        max(1, math.ceil(source_image.width * factor)),
+                        max(1, math.ceil(source_image.height * factor)),
+                    ),
+                )
+                display_image = ImageOps.exif_transpose(source_image)
+                owned_images = [display_image]
+                try:
+                    display_image.load()
+                    if display_image.mode not in ("RGB", "L"):
+                        display_image = display_image.convert("RGB")
+                        owned_images.append(display_image)
+                    if display_image.size != target_size:
+                        display_image = display_image.resize(
+                            target_size,
+                            Image.Resampling.LANCZOS,
+                        )
+                        owned_images.append(display_image)
+                    return encode_rendition(display_image, image_format, quality)
+                finally:
+                    for owned_image in owned_images:
+                        if owned_image is not source_image:
+                            owned_image.close()
+
+
+class SerialExecutor(Executor):
+    """Run submitted work immediately in the calling thread."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as exc:
+            future.set_exception(exc)
+        return future
+
+
+def _init_derivative_process(settings_module, memory_budget):
+    # Spawned workers start from a bare interpreter and need Django's
+    # settings and storage configuration before rendering anything.
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    import django
+
+    django.setup()
+    # Each child admits work against its share of the parent's budget.
+    image_memory_budget.limit = memory_budget
+
+
+def derivative_concurrency():
+    if settings.PHOTO_DERIVATIVE_EXECUTOR == "serial":
+        return 1
+    return max(1, settings.PHOTO_DERIVATIVE_CONCURRENCY or os.cpu_count() or 1)
+
+
+def _build_derivative_executor(kind, concurrency, max_tasks_per_child):
+    if kind == "serial":
+        return SerialExecutor()
+    if kind == "thread":
+        return ThreadPoolExecutor(
+            max_workers=concurrency,
+            thread_name_prefix="photo-derivative",
+        )
+    if kind == "process":
+        # Recycling children after N renders returns fragmented Pillow heaps
+        # to the OS. max_tasks_per_child requires a non-fork start method.
+        return ProcessPoolExecutor(
+            max_workers=concurrency,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_derivative_process,
+            initargs=(
+                os.environ.get("DJANGO_SETTINGS_MODULE", "backend.settings"),
+                max(1, image_memory_budget.limit // concurrency),
+            ),
+            max_tasks_per_child=max_tasks_per_child or None,
+        )
+    raise ValueError(f"Unknown PHOTO_DERIVATIVE_EXECUTOR {kind!r}")
+
+
+def create_derivative_executor(workers):
+    """
+    A private executor with the given number of renderers, for batch jobs
+    that size their own pool. Uses the configured executor kind, or
+    processes when that is "serial" and more than one worker is wanted.
+    The caller shuts it down.
+    """
+    kind = settings.PHOTO_DERIVATIVE_EXECUTOR
+    if workers <= 1:
+        kind = "serial"
+    elif kind == "serial":
+        kind = "process"
+    return _build_derivative_executor(
+        kind,
+        workers,
+        settings.PHOTO_DERIVATIVE_MAX_TASKS_PER_CHILD,
+    )
+
+
+_executor_lock = threading.Lock()
+_executor = None
+_executor_config = None
+
+
+def get_derivative_executor():
+    """
+    Return the process-wide executor for PHOTO_DERIVATIVE_EXECUTOR, rebuilding
+    it when the executor settings change.
+    """
+    global _executor, _executor_config
+
+    config = (
+        settings.PHOTO_DERIVATIVE_EXECUTOR,
+        derivative_concurrency(),
+        settings.PHOTO_DERIVATIVE_MAX_TASKS_PER_CHILD,
+    )
+    with _executor_lock:
+        if _executor is None or _executor_config != config:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = _build_derivative_executor(*config)
+            _executor_config = config
+        return _executor
@@ -0,0 +1,88 @@
+import mimetypes
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils.crypto import get_random_string
+
+from .forms import MAX_UPLOAD_BYTES
+from .models import Photo, photo_upload_to
+
+
+DIRECT_UPLOAD_CONTENT_TYPES = {"image/jpeg", "image/png", "image/webp"}
+
+
+class DirectUploadUnavailable(Exception):
+    """The configured storage cannot issue presigned upload targets."""
+
+
+def direct_upload_supported(storage=None):
+    # django-storages S3Boto3Storage (AWS, MinIO and other S3 endpoints)
+    return hasattr(storage or default_storage, "bucket")
+
+
+def direct_upload_content_type(filename):
+    content_type, _ = mimetypes.guess_type(filename)
+    return content_type if content_type in DIRECT_UPLOAD_CONTENT_TYPES else None
+
+
+def direct_upload_name(filename, label=None):
+    """
+    Storage name for a direct upload, under the same photo_upload_to layout
+    as form uploads. S3 storage overwrites by default, so the name gets the
+    random suffix Django would add on a collision up front.
+    """
+    root, ext = os.path.splitext(filename)
+    return photo_upload_to(
+        Photo(label=label), f"{root}_{get_random_string(7)}{ext}"
+    )
+
+
+def presigned_upload_targets(name, content_type, length, storage=None):
+    """
+    Presigned PUT and POST targets that let a browser write name straight
+    to the bucket, valid for PHOTO_DIRECT_UPLOAD_EXPIRES_SECONDS. Both pin
+    the content type and size the session was opened with.
+    """
+    storage = storage or default_storage
+    if not direct_upload_supported(storage):
+        raise DirectUploadUnavailable(
+            "Direct uploads need S3 storage; use the resumable upload API."
+        )
+    key = storage._normalize_name(name)
+    bucket = storage.bucket.name
+    client = storage.bucket.meta.client
+    expires = settings.PHOTO_DIRECT_UPLOAD_EXPIRES_SECONDS
+    # Match what storage.save() would set (AWS_S3_OBJECT_PARAMETERS).
+    cache_control = getattr(storage, "object_parameters", {}).get("CacheControl")
+
+    put_params = {
+        "Bucket": bucket,
+        "Key": key,
+        "ContentType": content_type,
+        "ContentLength": length,
+    }
+    headers = {"Content-Type": content_type}
+    if cache_control:
+        put_params["CacheControl"] = cache_control
+        headers["Cache-Control"] = cache_control
+    put_url = client.generate_presigned_url(
+        "put_object", Params=put_params, ExpiresIn=expires
+    )
+
+    fields = dict(headers)
+    post = client.generate_presigned_post(
+        bucket,
+        key,
+        Fields=fields,
+        Conditions=[
+            *({field: value} for field, value in fields.items()),
+            ["content-length-range", 1, min(length, MAX_UPLOAD_BYTES)],
+        ],
+        ExpiresIn=expires,
+    )
+    return {
+        "put": {"method": "PUT", "url": put_url, "headers": headers},
+        "post": {"method": "POST", "url": post["url"], "fields": post["fields"]},
+        "expires_in": expires,
+    }
@@ -0,0 +1,450 @@
+import logging
+import struct
+from datetime import datetime
+from fractions import Fraction
+
+from django.utils import timezone
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+
+
+# EXIF/TIFF tag ids, resolved numerically instead of through ExifTags names.
+TAG_ORIENTATION = 0x0112
+TAG_DATETIME = 0x0132
+TAG_EXPOSURE_TIME = 0x829A
+TAG_F_NUMBER = 0x829D
+TAG_EXIF_IFD = 0x8769
+TAG_ISO_SPEED_RATINGS = 0x8827  # also PhotographicSensitivity
+TAG_STANDARD_OUTPUT_SENSITIVITY = 0x8831
+TAG_RECOMMENDED_EXPOSURE_INDEX = 0x8832
+TAG_ISO_SPEED = 0x8833
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_OFFSET_TIME_ORIGINAL = 0x9011
+TAG_SHUTTER_SPEED_VALUE = 0x9201
+TAG_APERTURE_VALUE = 0x9202
+TAG_FOCAL_LENGTH = 0x920A
+TAG_PIXEL_X_DIMENSION = 0xA002
+TAG_PIXEL_Y_DIMENSION = 0xA003
+TAG_LENS_MODEL = 0xA434
+
+ISO_TAGS = (
+    TAG_ISO_SPEED_RATINGS,
+    TAG_ISO_SPEED,
+    TAG_STANDARD_OUTPUT_SENSITIVITY,
+    TAG_RECOMMENDED_EXPOSURE_INDEX,
+)
+METADATA_TAGS = frozenset(
+    {
+        TAG_ORIENTATION,
+        TAG_DATETIME,
+        TAG_EXPOSURE_TIME,
+        TAG_F_NUMBER,
+        *ISO_TAGS,
+        TAG_DATETIME_ORIGINAL,
+        TAG_OFFSET_TIME_ORIGINAL,
+        TAG_SHUTTER_SPEED_VALUE,
+        TAG_APERTURE_VALUE,
+        TAG_FOCAL_LENGTH,
+        TAG_PIXEL_X_DIMENSION,
+        TAG_PIXEL_Y_DIMENSION,
+        TAG_LENS_MODEL,
+    }
+)
+
+CAMERA_SETTING_FIELDS = ("aperture", "iso", "shutter_speed")
+# Every Photo column filled from image metadata.
+METADATA_FIELDS = (
+    *CAMERA_SETTING_FIELDS,
+    "f_number",
+    "iso_speed",
+    "exposure_seconds",
+    "focal_length_mm",
+    "lens_model",
+    "captured_at",
+    "width",
+    "height",
+)
+LENS_MODEL_MAX_LENGTH = 100
+
+# TIFF field types: (struct code, bytes per value).
+_TIFF_TYPES = {
+    1: ("B", 1),
+    2: ("s", 1),
+    3: ("H", 2),
+    4: ("L", 4),
+    5: ("L", 8),
+    7: ("s", 1),
+    9: ("l", 4),
+    10: ("l", 8),
+}
+# JPEG start-of-frame markers carry the frame size; C4, C8 and CC do not.
+_JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_JPEG_HEADER_LIMIT = 1024 * 1024
+
+
+def empty_metadata():
+    metadata = dict.fromkeys(METADATA_FIELDS)
+    metadata.update(aperture="", iso="", shutter_speed="", lens_model="")
+    return metadata
+
+
+def _tiff_value(data, endian, field_type, count, value_offset, entry_offset):
+    code, width = _TIFF_TYPES[field_type]
+    total = width * count
+    start = entry_offset + 8 if total <= 4 else value_offset
+    if start + total > len(data):
+        return None
+    if field_type in (2, 7):
+        raw = data[start:start + total]
+        return raw.split(b"\0", 1)[0].decode("utf-8", "replace").strip()
+    if field_type in (5, 10):
+        parts = struct.unpack_from(f"{endian}{2 * count}{code}", data, start)
+        values = tuple(zip(parts[::2], parts[1::2]))
+    else:
+        values = struct.unpack_from(f"{endian}{count}{code}", data, start)
+    return values[0] if count == 1 else values
+
+
+def _read_ifd(data, endian, offset, wanted, tags):
+    """Copy wanted tags of one IFD into tags; return the Exif IFD offset."""
+    exif_ifd = None
+    (entry_count,) = struct.unpack_from(f"{endian}H", data, offset)
+    for index in range(entry_count):
+        entry_offset = offset + 2 + index * 12
+        if entry_offset + 12 > len(data):
+            break
+        tag, field_type, count, value_offset = struct.unpack_from(
+            f"{endian}HHLL", data, entry_offset
+        )
+        if tag == TAG_EXIF_IFD:
+            exif_ifd = value_offset
+        elif tag in wanted and field_type in _TIFF_TYPES and count:
+            value = _tiff_value(
+                data, endian, field_type, count, value_offset, entry_offset
+            )
+            if value not in (None, ""):
+                tags[tag] = value
+    return exif_ifd
+
+
+def parse_exif_tags(data, wanted=METADATA_TAGS):
+    """
+    Resolve wanted tag ids from raw TIFF-structured EXIF bytes in one pass
+    over IFD0 and the Exif sub-IFD; the sub-IFD wins where both have a tag.
+    Rationals come back as (numerator, denominator) tuples.
+    """
+    if data.startswith(b"Exif\0\0"):
+        data = data[6:]
+    if len(data) < 8 or data[:2] not in (b"II", b"MM"):
+        return {}
+    endian = "<" if data[:2] == b"II" else ">"
+    (ifd0,) = struct.unpack_from(f"{endian}L", data, 4)
+    tags = {}
+    try:
+        exif_ifd = _read_ifd(data, endian, ifd0, wanted, tags)
+        if exif_ifd:
+            nested = {}
+            _read_ifd(data, endian, exif_ifd, wanted, nested)
+            tags.update(nested)
+    except struct.error:
+        logger.warning("Truncated EXIF block", exc_info=True)
+    return tags
+
+
+def read_jpeg_header(file_obj):
+    """
+    (EXIF bytes, (width, height)) from a JPEG's marker segments. Reading
+    stops at the frame header, so no entropy-coded data is touched. Returns
+    None for anything that is not a JPEG.
+    """
+    file_obj.seek(0)
+    if file_obj.read(2) != b"\xff\xd8":
+        return None
+    exif_bytes = b""
+    consumed = 2
+    while consumed < _JPEG_HEADER_LIMIT:
+        marker_bytes = file_obj.read(2)
+        if len(marker_bytes) < 2 or marker_bytes[0] != 0xFF:
+            break
+        marker = marker_bytes[1]
+        if marker == 0xFF:
+            file_obj.seek(-1, 1)
+            continue
+        if marker in (0xD9, 0xDA):
+            break
+        (length,) = struct.unpack(">H", file_obj.read(2))
+        if length < 2:
+            break
+        consumed += 2 + length
+        if marker in _JPEG_SOF_MARKERS:
+            frame = file_obj.read(5)
+            height, width = struct.unpack(">HH", frame[1:5])
+            return exif_bytes, (width, height)
+        if marker == 0xE1 and not exif_bytes:
+            payload = file_obj.read(length - 2)
+            if payload.startswith(b"Exif\0\0"):
+                exif_bytes = payload
+            continue
+        file_obj.seek(length - 2, 1)
+    return exif_bytes, None
+
+
+def jpeg_header_extent(data):
+    """
+    How many leading bytes of a JPEG read_jpeg_header needs, judged from a
+    prefix: the end of the frame header when the prefix reaches it, else a
+    lower bound covering the segment the prefix stops inside. None for data
+    that is not a JPEG.
+    """
+    if not data.startswith(b"\xff\xd8"):
+        return None
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return position
+        marker = data[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker in (0xD9, 0xDA):
+            return position
+        (length,) = struct.unpack_from(">H", data, position + 2)
+        if marker in _JPEG_SOF_MARKERS:
+            return position + 9
+        position += 2 + length
+    # Enough for the next marker and its length field as well.
+    return position + 4
+
+
+def header_exif(pil_img):
+    """
+    An opened image's EXIF without decoding pixels. PngImageFile.getexif()
+    loads the whole image to find an eXIf chunk stored after the pixel data;
+    here only the chunks ahead of it count.
+    """
+    if pil_img.format == "PNG":
+        return Image.Image.getexif(pil_img)
+    return pil_img.getexif()
+
+
+def _pillow_exif_tags(pil_img):
+    exif = header_exif(pil_img)
+    if not exif:
+        return {}
+    tags = {tag: value for tag, value in exif.items() if tag in METADATA_TAGS}
+    try:
+        nested = exif.get_ifd(TAG_EXIF_IFD)
+    except (AttributeError, KeyError, TypeError, ValueError):
+        nested = None
+    for tag, value in (nested or {}).items():
+        if tag in METADATA_TAGS and value not in (None, ""):
+            tags[tag] = value
+    return tags
+
+
+def _first_exif_value(tags, *tag_ids):
+    for tag in tag_ids:
+        value = tags.get(tag)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _rational_to_float(value):
+    if value is None:
+        return None
+    if isinstance(value, (tuple, list)) and len(value) == 2:
+        numerator, denominator = value
+        if not denominator:
+            return None
+        return float(numerator) / float(denominator)
+    try:
+        return float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def _format_decimal(value, places=1):
+    return f"{value:.{places}f}".rstrip("0").rstrip(".")
+
+
+def _format_aperture(value):
+    numeric = _rational_to_float(value)
+    if not numeric:
+        return ""
+    return f"f/{_format_decimal(numeric)}"
+
+
+def _format_aperture_value(value):
+    apex = _rational_to_float(value)
+    if apex is None:
+        return ""
+    return _format_aperture(2 ** (apex / 2))
+
+
+def _format_iso(value):
+    if isinstance(value, (tuple, list)):
+        value = next((item for item in value if item), None)
+    numeric = _rational_to_float(value)
+    if not numeric:
+        return ""
+    return str(int(round(numeric)))
+
+
+def _format_shutter_seconds(seconds):
+    if not seconds:
+        return ""
+    if seconds >= 1:
+        return f"{_format_decimal(seconds, 2)}s"
+    fraction = Fraction(seconds).limit_denominator(8000)
+    return f"{fraction.numerator}/{fraction.denominator}"
+
+
+def _format_exposure_time(value):
+    if isinstance(value, (tuple, list)) and len(value) == 2:
+        numerator, denominator = value
+        if numerator and denominator:
+            if numerator < denominator:
+                return f"{int(numerator)}/{int(denominator)}"
+            return _format_shutter_seconds(float(numerator) / float(denominator))
+    return _format_shutter_seconds(_rational_to_float(value))
+
+
+def _format_shutter_speed_value(value):
+    apex = _rational_to_float(value)
+    if apex is None:
+        return ""
+    return _format_shutter_seconds(2 ** (-apex))
+
+
+def _parse_captured_at(value, offset):
+    if not isinstance(value, str):
+        return None
+    try:
+        captured_at = datetime.strptime(value.strip()[:19], "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+    if isinstance(offset, str):
+        try:
+            captured_at = datetime.strptime(
+                f"{value.strip()[:19]}{offset.strip()}", "%Y:%m:%d %H:%M:%S%z"
+            )
+        except ValueError:
+            pass
+    if timezone.is_naive(captured_at):
+        # Cameras without an offset record local time; assume ours.
+        captured_at = timezone.make_aware(captured_at)
+    return captured_at
+
+
+def _positive(value, places=None):
+    numeric = _rational_to_float(value)
+    if not numeric or numeric < 0:
+        return None
+    return round(numeric, places) if places is not None else numeric
+
+
+def metadata_from_tags(tags, size=None):
+    """
+    Photo metadata columns from resolved EXIF tags: the display strings
+    shown today plus numeric values for SQL filtering and sorting. size is
+    the stored (width, height); width and height are swapped for EXIF
+    orientations that rotate the image by 90 degrees.
+    """
+    metadata = empty_metadata()
+    if size is None:
+        width = _first_exif_value(tags, TAG_PIXEL_X_DIMENSION)
+        height = _first_exif_value(tags, TAG_PIXEL_Y_DIMENSION)
+        if isinstance(width, int) and isinstance(height, int):
+            size = (width, height)
+    if size is not None:
+        width, height = size
+        if tags.get(TAG_ORIENTATION) in (5, 6, 7, 8):
+            width, height = height, width
+        metadata["width"], metadata["height"] = width, height
+    if not tags:
+        return metadata
+
+    f_number = _first_exif_value(tags, TAG_F_NUMBER)
+    aperture_value = _first_exif_value(tags, TAG_APERTURE_VALUE)
+    exposure_time = _first_exif_value(tags, TAG_EXPOSURE_TIME)
+    shutter_speed_value = _first_exif_value(tags, TAG_SHUTTER_SPEED_VALUE)
+    iso = _first_exif_value(tags, *ISO_TAGS)
+
+    metadata["aperture"] = _format_aperture(f_number) or _format_aperture_value(
+        aperture_value
+    )
+    metadata["iso"] = _format_iso(iso)
+    metadata["shutter_speed"] = _format_exposure_time(
+        exposure_time
+    ) or _format_shutter_speed_value(shutter_speed_value)
+
+    metadata["f_number"] = _positive(f_number, 2)
+    aperture_apex = _rational_to_float(aperture_value)
+    if metadata["f_number"] is None and aperture_apex is not None:
+        metadata["f_number"] = round(2 ** (aperture_apex / 2), 2)
+    metadata["exposure_seconds"] = _positive(exposure_time)
+    shutter_apex = _rational_to_float(shutter_speed_value)
+    if metadata["exposure_seconds"] is None and shutter_apex is not None:
+        metadata["exposure_seconds"] = 2 ** (-shutter_apex)
+    metadata["iso_speed"] = int(metadata["iso"]) if metadata["iso"] else None
+    metadata["focal_length_mm"] = _positive(
+        _first_exif_value(tags, TAG_FOCAL_LENGTH), 1
+    )
+    lens_model = _first_exif_value(tags, TAG_LENS_MODEL)
+    if isinstance(lens_model, str):
+        metadata["lens_model"] = lens_model.strip("\0 ")[:LENS_MODEL_MAX_LENGTH]
+    metadata["captured_at"] = _parse_captured_at(
+        _first_exif_value(tags, TAG_DATETIME_ORIGINAL, TAG_DATETIME),
+        tags.get(TAG_OFFSET_TIME_ORIGINAL),
+    )
+    return metadata
+
+
+_METADATA_ERRORS = (
+    AttributeError,
+    OSError,
+    OverflowError,
+    TypeError,
+    ValueError,
+    ZeroDivisionError,
+    struct.error,
+)
+
+
+def extract_photo_metadata(pil_img):
+    """Metadata columns from an opened Pillow image's header."""
+    try:
+        return metadata_from_tags(_pillow_exif_tags(pil_img), pil_img.size)
+    except _METADATA_ERRORS:
+        logger.warning("Unable to read metadata from image EXIF", exc_info=True)
+        return metadata_from_tags({}, pil_img.size)
+
+
+def read_photo_metadata(file_obj):
+    """
+    Metadata columns for an image file. JPEGs are parsed straight from their
+    APP1 and frame headers without Pillow; other formats fall back to
+    Pillow's header parser. Pixels are never decoded. The file is rewound.
+    """
+    try:
+        header = read_jpeg_header(file_obj)
+        if header is not None:
+            exif_bytes, size = header
+            return metadata_from_tags(parse_exif_tags(exif_bytes), size)
+        file_obj.seek(0)
+        with Image.open(file_obj) as pil_img:
+            return extract_photo_metadata(pil_img)
+    except _METADATA_ERRORS:
+        logger.warning("Unable to read metadata from image", exc_info=True)
+        return empty_metadata()
+    finally:
+        file_obj.seek(0)
+
+
+def extract_camera_settings(pil_img):
+    """The aperture, ISO and shutter display strings of a Pillow image."""
+    metadata = extract_photo_metadata(pil_img)
+    return {field: metadata[field] for field in CAMERA_SETTING_FIELDS}
@@ -0,0 +1,115 @@
+import hashlib
+
+import numpy as np
+from PIL import Image, ImageOps
+
+
+DHASH_SIZE = 8  # 8x8 gradient bits -> one 64-bit hash
+# Formats whose decoder can draft straight to a thumbnail-sized raster, so
+# a dHash costs next to nothing outside the derivative job.
+DRAFT_DHASH_FORMATS = {"JPEG"}
+_HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def sha256_file(file_obj):
+    """Hex SHA-256 of a file-like object, read in chunks and rewound."""
+    digest = hashlib.sha256()
+    file_obj.seek(0)
+    chunks = (
+        file_obj.chunks(_HASH_CHUNK_BYTES)
+        if hasattr(file_obj, "chunks")
+        else iter(lambda: file_obj.read(_HASH_CHUNK_BYTES), b"")
+    )
+    for chunk in chunks:
+        digest.update(chunk)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+
+def _signed64(value):
+    # Postgres and SQLite store signed 64-bit integers.
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def dhash(pil_img):
+    """
+    64-bit difference hash of an image, as a signed integer: one bit per
+    horizontally adjacent pixel pair of a 9x8 grayscale raster, set where
+    brightness increases to the right.
+    """
+    with pil_img.convert("L").resize(
+        (DHASH_SIZE + 1, DHASH_SIZE),
+        Image.Resampling.BOX,
+    ) as tiny:
+        pixels = np.asarray(tiny, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    value = int(np.packbits(bits.ravel()).view(">u8")[0])
+    return _signed64(value)
+
+
+def draft_dhash(pil_img):
+    """
+    dHash of an opened image decoded at draft scale, or None for formats
+    without draft scaling: those would need a full-size decode, so their
+    dHash is left to the derivative job, which decodes the image anyway.
+    """
+    if pil_img.format not in DRAFT_DHASH_FORMATS:
+        return None
+    pil_img.draft("L", (DHASH_SIZE * 8, DHASH_SIZE * 8))
+    display_image = ImageOps.exif_transpose(pil_img)
+    try:
+        return dhash(display_image)
+    finally:
+        if display_image is not pil_img:
+            display_image.close()
+
+
+def image_dhash(file_obj):
+    """dHash of an image file, or None where draft_dhash defers it."""
+    file_obj.seek(0)
+    try:
+        with Image.open(file_obj) as source_image:
+            return draft_dhash(source_image)
+    finally:
+        file_obj.seek(0)
+
+
+def fingerprint_file(file_obj):
+    """(sha256 hex, dHash or None) for an image file-like object."""
+    return sha256_file(file_obj), image_dhash(file_obj)
+
+
+def hamming_distances(value, hashes):
+    """Bit distances between one signed 64-bit hash and an int64 array."""
+    xor = np.asarray(hashes, dtype=np.int64).view(np.uint64) ^ np.uint64(
+        value & ((1 << 64) - 1)
+    )
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor)
+    return np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+class PerceptualHashIndex:
+    """In-memory nearest-neighbour lookup over (key, dHash) pairs."""
+
+    def __init__(self, entries=()):
+        self._keys = []
+        self._hashes = []
+        for key, value in entries:
+            self.add(key, value)
+
+    def add(self, key, value):
+        if value is None:
+            return
+        self._keys.append(key)
+        self._hashes.append(value)
+
+    def nearest(self, value, max_distance):
+        """The closest key within max_distance bits, or None."""
+        if value is None or not self._hashes:
+            return None
+        distances = hamming_distances(value, self._hashes)
+        best = int(np.argmin(distances))
+        if distances[best] > max_distance:
+            return None
+        return self._keys[best]
@@ -3,10 +3,14 @@ import math
 import os
 
 from django import forms
+from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from PIL import Image, UnidentifiedImageError
 
-from .models import Label, Photo, extract_camera_settings
+from .admission import estimate_resize_bytes, image_memory_budget
+from .exif import extract_photo_metadata, header_exif
+from .ingest import ingest_image
+from .models import Label, Photo
 
 
 MAX_UPLOAD_BYTES = 20 * 1024 * 1024
@@ -14,30 +18,42 @@ MAX_BULK_UPLOAD_BYTES = 300 * 1024 * 1024
 MAX_BULK_UPLOAD_FILES = 25
 MAX_IMAGE_PIXELS = 40_000_000
 ALLOWED_IMAGE_FORMATS = {"JPEG", "PNG", "WEBP"}
-JPEG_UPLOAD_QUALITIES = (90, 85, 80, 75, 70, 65, 60)
+JPEG_UPLOAD_QUALITIES = (60, 65, 70, 75, 80, 85, 90)
+# Pixels in the downsampled copy whose encoded size predicts quality.
+JPEG_SIZE_TRIAL_PIXELS = 256 * 256
+# resize() first shrinks by an integer reduce() down to this multiple of
+# the target size, then resamples the rest with LANCZOS.
+JPEG_UPLOAD_REDUCING_GAP = 3.0
+# Modes LANCZOS resamples directly; others are flattened to RGB first.
+_RESAMPLE_MODES = {"RGB", "RGBA", "L", "LA"}
+
+
+def _check_upload_header(pil_image):
+    if pil_image.format not in ALLOWED_IMAGE_FORMATS:
+        raise forms.ValidationError(
+            "Only JPEG, PNG, and WebP images are accepted."
+        )
+    width, height = pil_image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise forms.ValidationError(
+            "Images must contain no more than 40 megapixels."
+        )
 
 
 def validate_uploaded_image(image):
+    """
+    Validate an upload and attach what was learned as image.ingested, so
+    the view and Photo.save can reuse it instead of reopening the file.
+    The dHash is optional here: formats that would need a full decode get
+    it from the derivative job instead.
+    """
     if image.size > MAX_UPLOAD_BYTES:
         raise forms.ValidationError("Images must be 20 MB or smaller.")
 
     try:
-        image.seek(0)
-        with Image.open(image) as pil_image:
-            if pil_image.format not in ALLOWED_IMAGE_FORMATS:
-                raise forms.ValidationError(
-                    "Only JPEG, PNG, and WebP images are accepted."
-                )
-            width, height = pil_image.size
-            if width * height > MAX_IMAGE_PIXELS:
-                raise forms.ValidationError(
-                    "Images must contain no more than 40 megapixels."
-                )
-            pil_image.verify()
-    except (UnidentifiedImageError, OSError, SyntaxError):
+        image.ingested = ingest_image(image, inspect=_check_upload_header)
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
         raise forms.ValidationError("Upload a valid, non-corrupted image.")
-    finally:
-        image.seek(0)
 
     return image
 
@@ -75,86 +91,185 @@ def _encode_jpeg(pil_image, quality, exif_bytes=b""):
     return output.getvalue()
 
 
+def _predict_jpeg_quality_index(pil_image, target_bytes, exif_bytes=b""):
+    """
+    Index into JPEG_UPLOAD_QUALITIES of the highest quality predicted to fit
+    target_bytes, from encoding downsampled copies instead of the image.
+
+    Encoded size grows slower than pixel count (small copies pack more
+    detail per pixel), so two trial scales first fit bytes ~ pixels **
+    exponent; the larger trial is then searched and extrapolated.
+    """
+    pixels = pil_image.width * pil_image.height
+    factor = int(math.sqrt(pixels / JPEG_SIZE_TRIAL_PIXELS))
+    if factor < 2:
+        return len(JPEG_UPLOAD_QUALITIES) - 1
+    with pil_image.reduce(factor) as trial, trial.reduce(2) as smaller:
+        trial_pixels = trial.width * trial.height
+        reference = JPEG_UPLOAD_QUALITIES[0]
+        exponent = math.log(
+            len(_encode_jpeg(trial, reference)) / len(_encode_jpeg(smaller, reference))
+        ) / math.log(trial_pixels / (smaller.width * smaller.height))
+        growth = (pixels / trial_pixels) ** min(1.0, max(0.5, exponent))
+
+        low, high, best = 0, len(JPEG_UPLOAD_QUALITIES) - 1, 0
+        while low <= high:
+            middle = (low + high) // 2
+            quality = JPEG_UPLOAD_QUALITIES[middle]
+            predicted = len(_encode_jpeg(trial, quality)) * growth + len(exif_bytes)
+            if predicted <= target_bytes:
+                best, low = middle, middle + 1
+            else:
+                high = middle - 1
+    return best
+
+
+def _encode_jpeg_within(pil_image, target_bytes, exif_bytes=b""):
+    """
+    Binary-search JPEG_UPLOAD_QUALITIES for the highest quality whose encode
+    fits target_bytes, probing the predicted quality first. Returns
+    (encoded, None), or (None, size at the lowest quality) when none fits.
+    """
+    low, high = 0, len(JPEG_UPLOAD_QUALITIES) - 1
+    index = _predict_jpeg_quality_index(pil_image, target_bytes, exif_bytes)
+    best = None
+    smallest = None
+    while low <= high:
+        encoded = _encode_jpeg(
+            pil_image,
+            JPEG_UPLOAD_QUALITIES[index],
+            exif_bytes=exif_bytes,
+        )
+        if len(encoded) <= target_bytes:
+            best, low = encoded, index + 1
+        else:
+            smallest, high = len(encoded), index - 1
+        index = (low + high) // 2
+    return best, smallest
+
+
+def _resized_metadata(metadata, source_size, stored_size):
+    # Display dimensions follow the stored pixels; EXIF orientation is kept.
+    if metadata["width"] is None:
+        return metadata
+    width, height = stored_size
+    if (metadata["width"], metadata["height"]) != tuple(source_size):
+        width, height = height, width
+    return {**metadata, "width": width, "height": height}
+
+
 def prepare_uploaded_image_for_storage(image, max_bytes, max_pixels):
+    """
+    Return (upload, metadata, optimized): the upload itself when it is within
+    max_bytes and max_pixels, else a re-encoded JPEG that is.
+
+    The decode goes straight to the pixel budget (JPEG draft scaling, then
+    reduce() ahead of the LANCZOS pass), so full-resolution rasters are not
+    held. Quality is binary-searched from a guess predicted by a small trial
+    encode, and the image is only scaled down further when the minimum
+    quality still does not fit.
+    """
+    ingested = getattr(image, "ingested", None)
+    if (
+        ingested is not None
+        and image.size <= max_bytes
+        and ingested.pixels <= max_pixels
+    ):
+        # Already within limits: the validated header is all we need.
+        return image, ingested.metadata, False
+
     image.seek(0)
-    owned_image = None
+    owned_images = []
     try:
         with Image.open(image) as source_image:
-            camera_settings = extract_camera_settings(source_image)
-            try:
-                exif_bytes = source_image.getexif().tobytes()
-            except (AttributeError, OSError, TypeError, ValueError):
-                exif_bytes = b""
-            width, height = source_image.size
+            if ingested is not None:
+                metadata = ingested.metadata
+                exif_bytes = ingested.exif_bytes
+            else:
+                metadata = extract_photo_metadata(source_image)
+                try:
+                    exif_bytes = header_exif(source_image).tobytes()
+                except (AttributeError, OSError, TypeError, ValueError):
+                    exif_bytes = b""
+            source_size = source_image.size
+            width, height = source_size
             requires_optimization = (
                 image.size > max_bytes or width * height > max_pixels
             )
             if not requires_optimization:
-                return image, camera_settings, False
-
-            working_image = _flatten_for_jpeg(source_image)
-            if working_image is not source_image:
-                owned_image = working_image
-
-            pixel_count = working_image.width * working_image.height
-            if pixel_count > max_pixels:
-                scale = math.sqrt(max_pixels / pixel_count)
-                dimensions = (
-                    max(1, int(working_image.width * scale)),
-                    max(1, int(working_image.height * scale)),
-                )
-                resized_image = working_image.resize(
-                    dimensions,
-                    Image.Resampling.LANCZOS,
-                )
-                if owned_image is not None:
-                    owned_image.close()
-                working_image = resized_image
-                owned_image = resized_image
-
-            margin = min(64 * 1024, max_bytes // 20)
-            target_bytes = max_bytes - margin
-            while True:
-                encoded_image = None
-                for quality in JPEG_UPLOAD_QUALITIES:
-                    encoded_image = _encode_jpeg(
+                return image, metadata, False
+
+            scale = min(1.0, math.sqrt(max_pixels / (width * height)))
+            dimensions = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+            # Only budget-sized rasters are decoded below; still wait for
+            # headroom so concurrent uploads and derivatives cannot OOM.
+            with image_memory_budget.reserve(
+                estimate_resize_bytes(
+                    source_size,
+                    source_image.mode,
+                    source_image.format,
+                    max(dimensions),
+                ),
+                timeout=settings.IMAGE_PROCESSING_ADMISSION_TIMEOUT,
+            ):
+                source_image.draft("RGB", dimensions)
+                working_image = source_image
+                if working_image.mode not in _RESAMPLE_MODES:
+                    working_image = _flatten_for_jpeg(working_image)
+                    owned_images.append(working_image)
+                if working_image.size != dimensions:
+                    working_image = working_image.resize(
+                        dimensions,
+                        Image.Resampling.LANCZOS,
+                        reducing_gap=JPEG_UPLOAD_REDUCING_GAP,
+                    )
+                    owned_images.append(working_image)
+                flattened = _flatten_for_jpeg(working_image)
+                if flattened is not working_image:
+                    working_image = flattened
+                    owned_images.append(working_image)
+
+                margin = min(64 * 1024, max_bytes // 20)
+                target_bytes = max_bytes - margin
+                while True:
+                    encoded_image, smallest = _encode_jpeg_within(
                         working_image,
-                        quality,
+                        target_bytes,
                         exif_bytes=exif_bytes,
                     )
-                    if len(encoded_image) <= target_bytes:
-                        base_name = os.path.splitext(
-                            os.path.basename(image.name)
-                        )[0]
+                    if encoded_image is not None:
+                        base_name = os.path.splitext(os.path.basename(image.name))[0]
                         optimized_upload = SimpleUploadedFile(
                             f"{base_name or 'photo'}.jpg",
                             encoded_image,
                             content_type="image/jpeg",
                         )
-                        return optimized_upload, camera_settings, True
-
-                scale = min(
-                    0.9,
-                    math.sqrt(target_bytes / len(encoded_image)) * 0.95,
-                )
-                dimensions = (
-                    max(1, int(working_image.width * scale)),
-                    max(1, int(working_image.height * scale)),
-                )
-                if dimensions == working_image.size:
-                    raise forms.ValidationError(
-                        "This image could not be optimized for storage."
+                        return (
+                            optimized_upload,
+                            _resized_metadata(
+                                metadata, source_size, working_image.size
+                            ),
+                            True,
+                        )
+
+                    scale = min(0.9, math.sqrt(target_bytes / smallest) * 0.95)
+                    dimensions = (
+                        max(1, int(working_image.width * scale)),
+                        max(1, int(working_image.height * scale)),
                     )
-                resized_image = working_image.resize(
-                    dimensions,
-                    Image.Resampling.LANCZOS,
-                )
-                if owned_image is not None:
-                    owned_image.close()
-                working_image = resized_image
-                owned_image = resized_image
+                    if dimensions == working_image.size:
+                        raise forms.ValidationError(
+                            "This image could not be optimized for storage."
+                        )
+                    working_image = working_image.resize(
+                        dimensions,
+                        Image.Resampling.LANCZOS,
+                        reducing_gap=JPEG_UPLOAD_REDUCING_GAP,
+                    )
+                    owned_images.append(working_image)
     finally:
-        if owned_image is not None:
+        for owned_image in owned_images:
             owned_image.close()
         image.seek(0)
 
@@ -245,7 +360,14 @@ class BulkPhotoUploadForm(forms.Form):
         help_text="Optional shared description for every photo in this upload.",
     )
 
+    def __init__(self, *args, upload_rejection=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Set when StreamingImageUploadHandler stopped reading the request.
+        self.upload_rejection = upload_rejection
+
     def clean_images(self):
+        if self.upload_rejection:
+            raise forms.ValidationError(self.upload_rejection)
         images = self.cleaned_data["images"]
         if not images:
             raise forms.ValidationError("Select at least one image.")
@@ -0,0 +1,105 @@
+from PIL import Image
+
+from .exif import TAG_ORIENTATION, extract_photo_metadata, header_exif
+from .fingerprints import draft_dhash, sha256_file
+
+
+class IngestedImage:
+    """
+    Everything an upload's single read taught us, carried from form
+    validation through the upload view into Photo.save so no later stage
+    has to open the file again just to ask the same questions.
+    """
+
+    def __init__(
+        self,
+        image_format,
+        width,
+        height,
+        mode,
+        metadata,
+        exif_bytes,
+        orientation,
+        has_icc_profile,
+        content_sha256,
+        perceptual_hash,
+        size,
+    ):
+        self.format = image_format
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.metadata = metadata
+        self.exif_bytes = exif_bytes
+        self.orientation = orientation
+        self.has_icc_profile = has_icc_profile
+        self.content_sha256 = content_sha256
+        self.perceptual_hash = perceptual_hash
+        self.size = size
+
+    def __repr__(self):
+        return (
+            f"<IngestedImage {self.format} {self.width}x{self.height} "
+            f"{self.mode} sha256={self.content_sha256[:12]}>"
+        )
+
+    @property
+    def pixels(self):
+        return self.width * self.height
+
+    @property
+    def fingerprints(self):
+        return {
+            "content_sha256": self.content_sha256,
+            "perceptual_hash": self.perceptual_hash,
+        }
+
+
+def ingest_image(file_obj, inspect=None):
+    """
+    Open an uploaded image once and summarise it as an IngestedImage.
+
+    The header gives format, size, mode, EXIF metadata and the ICC flag;
+    inspect, if given, sees the header-only image and may raise to reject it
+    before any pixels are decoded. JPEGs are then decoded at draft scale for
+    the dHash, which reads the whole stream and so catches truncated or
+    corrupt files; other formats are only verify()'d and get no dHash here
+    (perceptual_hash is None) rather than a full-size decode.
+    The SHA-256 is a plain byte read unless the upload handler already
+    hashed the stream (file_obj.content_sha256). The file is rewound.
+    """
+    file_obj.seek(0)
+    try:
+        with Image.open(file_obj) as source_image:
+            if inspect is not None:
+                inspect(source_image)
+            exif = header_exif(source_image)
+            try:
+                exif_bytes = exif.tobytes() if exif else b""
+            except (AttributeError, OSError, TypeError, ValueError):
+                exif_bytes = b""
+            header = {
+                "image_format": source_image.format,
+                "width": source_image.width,
+                "height": source_image.height,
+                "mode": source_image.mode,
+                "metadata": extract_photo_metadata(source_image),
+                "exif_bytes": exif_bytes,
+                "orientation": exif.get(TAG_ORIENTATION, 1) if exif else 1,
+                "has_icc_profile": bool(source_image.info.get("icc_profile")),
+            }
+
+            perceptual_hash = draft_dhash(source_image)
+            if perceptual_hash is None:
+                source_image.verify()
+    finally:
+        file_obj.seek(0)
+
+    return IngestedImage(
+        content_sha256=(
+            getattr(file_obj, "content_sha256", None) or sha256_file(file_obj)
+        ),
+        perceptual_hash=perceptual_hash,
+        size=getattr(file_obj, "size", None),
+        **header,
+    )
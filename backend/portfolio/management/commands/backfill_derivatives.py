@@ -1,26 +1,286 @@
 # photos/management/commands/backfill_derivatives.py
-from django.core.management.base import BaseCommand
-from portfolio.models import Photo
+import hashlib
+import json
+import os
+import signal
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils import timezone
+
+from portfolio.derivatives import create_derivative_executor, derivative_concurrency
+from portfolio.models import (
+    DERIVATIVE_FIELDS,
+    Photo,
+    PhotoRendition,
+    bump_catalog_version,
+    generate_derivatives_concurrently,
+)
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
 
 
 class Command(BaseCommand):
     help = "Generate derivatives and camera settings for existing photos"
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--only-missing",
+            action="store_true",
+            help="Only render derivatives, renditions and fingerprints that "
+            "are missing instead of regenerating everything.",
+        )
+        parser.add_argument(
+            "--since",
+            help="Only photos created on or after this ISO date or datetime.",
+        )
+        parser.add_argument(
+            "--ids",
+            help="Comma-separated photo ids to process.",
+        )
+        parser.add_argument(
+            "--label",
+            help="Only photos in the label with this slug.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Photos rendered in parallel (default: the configured "
+            "derivative concurrency).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=50,
+            help="Photos per batch; each batch is saved with one bulk UPDATE "
+            "and then checkpointed.",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=str(Path(settings.BASE_DIR) / ".backfill_derivatives.json"),
+            help="File recording progress so an interrupted run resumes.",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore an existing checkpoint and start from the first photo.",
+        )
+
     def handle(self, *args, **opts):
-        qs = Photo.objects.all().order_by("id")
-        total = qs.count()
-        for i, p in enumerate(qs, 1):
-            p.generate_derivatives(force=True)
-            p.save(
-                update_fields=[
-                    "thumb",
-                    "preview",
-                    "blur_data_url",
-                    "aperture",
-                    "iso",
-                    "shutter_speed",
-                ]
+        if opts["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+        qs = self._queryset(opts)
+        checkpoint_path = Path(opts["checkpoint"])
+        signature = self._signature(opts)
+        checkpoint = self._load_checkpoint(checkpoint_path, signature, opts["restart"])
+        if checkpoint["last_id"]:
+            self.stdout.write(
+                f"Resuming after photo #{checkpoint['last_id']} "
+                f"({checkpoint['processed']} already processed)."
+            )
+
+        remaining_qs = qs.filter(pk__gt=checkpoint["last_id"])
+        remaining = remaining_qs.count()
+        total = checkpoint["processed"] + remaining
+        force = not opts["only_missing"]
+        workers = opts["workers"] or derivative_concurrency()
+
+        self._stopping = False
+        previous_handlers = {
+            signum: signal.signal(signum, self._request_stop)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+
+        started = time.monotonic()
+        run_processed = 0
+        run_bytes = 0
+        executor = create_derivative_executor(workers)
+        try:
+            last_id = checkpoint["last_id"]
+            while not self._stopping:
+                batch = list(
+                    remaining_qs.filter(pk__gt=last_id)
+                    .order_by("pk")
+                    .prefetch_related(
+                        Prefetch(
+                            "renditions",
+                            queryset=PhotoRendition.objects.only(
+                                "id", "photo_id", "width", "format"
+                            ),
+                        )
+                    )[: opts["batch_size"]]
+                )
+                if not batch:
+                    break
+                last_id = batch[-1].pk
+
+                pending = batch
+                if not force:
+                    pending = [photo for photo in batch if self._needs_work(photo)]
+                batch_bytes = 0
+
+                def count_bytes(photo, rendered):
+                    nonlocal batch_bytes
+                    batch_bytes += rendered.get("source_bytes") or 0
+
+                done = []
+                for photo, error in generate_derivatives_concurrently(
+                    ((photo, force) for photo in pending),
+                    executor=executor,
+                    persist=False,
+                    on_rendered=count_bytes,
+                ):
+                    done.append(photo)
+                    if error is not None:
+                        checkpoint["failed_ids"].append(photo.pk)
+                        self.stderr.write(
+                            self.style.ERROR(f"Photo #{photo.pk} failed: {error}")
+                        )
+                # Whatever rendered is saved, including partial results of
+                # failed photos, in one UPDATE for the whole batch. A batch
+                # with nothing rendered leaves the catalog version alone.
+                if done:
+                    with transaction.atomic():
+                        Photo.objects.bulk_update(done, DERIVATIVE_FIELDS)
+                        bump_catalog_version()
+
+                checkpoint["last_id"] = last_id
+                checkpoint["processed"] += len(batch)
+                self._save_checkpoint(checkpoint_path, checkpoint)
+
+                run_processed += len(batch)
+                run_bytes += batch_bytes
+                self._report_progress(
+                    checkpoint["processed"],
+                    total,
+                    run_processed,
+                    run_bytes,
+                    time.monotonic() - started,
+                    skipped=len(batch) - len(pending),
+                )
+        finally:
+            executor.shutdown(wait=True)
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+        if self._stopping:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Stopped after photo #{checkpoint['last_id']}; run the same "
+                    "command again to resume."
+                )
+            )
+            return
+
+        failed_ids = checkpoint["failed_ids"]
+        if checkpoint_path.exists():
+            checkpoint_path.unlink()
+        summary = f"Processed {checkpoint['processed']} photos."
+        if failed_ids:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{summary} {len(failed_ids)} failed; retry them with "
+                    f"--ids {','.join(str(pk) for pk in failed_ids)}"
+                )
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
+
+    def _queryset(self, opts):
+        qs = Photo.objects.exclude(image="")
+        if opts["ids"]:
+            try:
+                ids = [int(value) for value in opts["ids"].split(",") if value.strip()]
+            except ValueError:
+                raise CommandError("--ids must be comma-separated integers.")
+            qs = qs.filter(pk__in=ids)
+        if opts["label"]:
+            qs = qs.filter(label__slug=opts["label"])
+        if opts["since"]:
+            since = parse_datetime(opts["since"])
+            if since is None:
+                since_date = parse_date(opts["since"])
+                if since_date is None:
+                    raise CommandError("--since must be an ISO date or datetime.")
+                since = datetime.combine(since_date, datetime.min.time())
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            qs = qs.filter(created_at__gte=since)
+        return qs
+
+    @staticmethod
+    def _needs_work(photo):
+        task = photo.derivative_task(force=False)
+        return task is not None and any(
+            (
+                task["thumb"],
+                task["preview"],
+                task["blur"],
+                task["thumbhash"],
+                task["palette"],
+                task["renditions"],
+                task["fingerprint"],
             )
+        )
+
+    @staticmethod
+    def _signature(opts):
+        # A checkpoint only applies to a run over the same selection.
+        selection = {
+            key: opts[key] for key in ("only_missing", "since", "ids", "label")
+        }
+        raw = json.dumps(selection, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+    def _load_checkpoint(self, path, signature, restart):
+        fresh = {"signature": signature, "last_id": 0, "processed": 0, "failed_ids": []}
+        if restart or not path.exists():
+            return fresh
+        try:
+            checkpoint = json.loads(path.read_text())
+        except (OSError, ValueError):
+            self.stderr.write(f"Ignoring unreadable checkpoint {path}.")
+            return fresh
+        if checkpoint.get("signature") != signature:
             self.stdout.write(
-                self.style.SUCCESS(f"[{i}/{total}] Processed Photo #{p.id}")
+                f"Checkpoint {path} belongs to a different selection; starting over."
             )
+            return fresh
+        return {**fresh, **checkpoint}
+
+    @staticmethod
+    def _save_checkpoint(path, checkpoint):
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_text(json.dumps(checkpoint))
+        os.replace(tmp_path, path)
+
+    def _report_progress(self, done, total, run_done, run_bytes, elapsed, skipped):
+        rate = run_done / elapsed if elapsed else 0.0
+        megabytes_per_second = run_bytes / elapsed / (1024 * 1024) if elapsed else 0.0
+        eta = (total - done) / rate if rate else 0
+        percent = done * 100 / total if total else 100.0
+        line = (
+            f"[{done}/{total}] {percent:.1f}%  {rate:.1f} img/s  "
+            f"{megabytes_per_second:.1f} MB/s read  ETA {_format_duration(eta)}"
+        )
+        if skipped:
+            line += f"  ({skipped} already complete)"
+        self.stdout.write(line)
+
+    def _request_stop(self, signum, frame):
+        # Finish and checkpoint the batch in hand.
+        self._stopping = True
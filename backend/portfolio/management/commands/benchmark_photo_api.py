@@ -0,0 +1,184 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from portfolio.models import Label, Photo, PhotoRendition
+from portfolio.palette import HUE_BUCKET_NAMES
+from portfolio.renderers import FastJSONRenderer, orjson
+from portfolio.serializer import PhotoRowSerializer, PhotoSerializer
+from portfolio.views import PhotoList
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure /api/photos/ serialization throughput (rows per second) of "
+        "PhotoSerializer with JSONRenderer against the values() row "
+        "serializer with the orjson renderer, and check both bodies match"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=PhotoList.MAX_LIMIT,
+            help=f"Rows per page (default: {PhotoList.MAX_LIMIT}).",
+        )
+        parser.add_argument(
+            "--rounds",
+            type=int,
+            default=20,
+            help="Timed rounds per path; the median is reported (default: 20).",
+        )
+        parser.add_argument(
+            "--label",
+            help="Only photos in the label with this slug.",
+        )
+        parser.add_argument(
+            "--format",
+            default="jpeg",
+            choices=["jpeg", "webp", "avif"],
+            help="Negotiated rendition format (default: jpeg).",
+        )
+        parser.add_argument(
+            "--blur",
+            action="store_true",
+            help="Include blur_data_url, as ?blur=1 does.",
+        )
+        parser.add_argument(
+            "--fields",
+            help="Comma-separated fields, as ?fields= selects them.",
+        )
+        parser.add_argument(
+            "--host",
+            help="Host the absolute URLs are built for (default: the first "
+            "ALLOWED_HOSTS entry).",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Add this many sample photos with renditions for the run; "
+            "they are rolled back afterwards.",
+        )
+
+    def handle(self, *args, **opts):
+        for option in ("limit", "rounds"):
+            if opts[option] < 1:
+                raise CommandError(f"--{option} must be at least 1.")
+        if opts["seed"] < 0:
+            raise CommandError("--seed cannot be negative.")
+
+        with transaction.atomic():
+            if opts["seed"]:
+                self._seed(opts["seed"])
+            self._benchmark(opts)
+            transaction.set_rollback(True)
+
+    def _benchmark(self, opts):
+        query = {"limit": opts["limit"]}
+        if opts["label"]:
+            query["label"] = opts["label"]
+        if opts["blur"]:
+            query["blur"] = "1"
+        if opts["fields"]:
+            query["fields"] = opts["fields"]
+        host = opts["host"] or next(
+            (host.lstrip(".") for host in settings.ALLOWED_HOSTS if host != "*"),
+            "localhost",
+        )
+        request = Request(
+            RequestFactory().get("/api/photos/", query, secure=True, HTTP_HOST=host)
+        )
+        view = PhotoList()
+        try:
+            fields = view.selected_fields(request)
+        except ParseError as error:
+            raise CommandError(str(error))
+        context = {
+            "request": request,
+            "fields": fields,
+            "image_format": opts["format"],
+        }
+
+        def serializer_body():
+            items = list(view.get_queryset(request)[: opts["limit"]])
+            data = PhotoSerializer(items, many=True, context=context).data
+            return len(items), JSONRenderer().render({"results": data})
+
+        def row_body():
+            rows = list(view.get_row_queryset(request)[: opts["limit"]])
+            data = PhotoRowSerializer(rows, context=context).data
+            return len(rows), FastJSONRenderer().render({"results": data})
+
+        rows, expected = serializer_body()
+        if not rows:
+            raise CommandError("No photos to serialize; try --seed.")
+        if row_body()[1] != expected:
+            raise CommandError("The two paths rendered different JSON.")
+
+        encoder = "orjson" if orjson is not None else "json (orjson missing)"
+        self.stdout.write(
+            f"{rows} rows per page, {len(expected)} bytes, "
+            f"{opts['rounds']} rounds"
+        )
+        before = self._rows_per_second(serializer_body, opts["rounds"])
+        after = self._rows_per_second(row_body, opts["rounds"])
+        self.stdout.write(f"PhotoSerializer + JSONRenderer: {before:,.0f} rows/s")
+        self.stdout.write(
+            f"PhotoRowSerializer + {encoder}: {after:,.0f} rows/s"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Speed-up: {after / before:.1f}x"))
+
+    @staticmethod
+    def _rows_per_second(render, rounds):
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            rows, _ = render()
+            timings.append(time.perf_counter() - started)
+        return rows / statistics.median(timings)
+
+    @staticmethod
+    def _seed(count):
+        label, _ = Label.objects.get_or_create(
+            slug="benchmark", defaults={"title": "Benchmark"}
+        )
+        photos = Photo.objects.bulk_create(
+            Photo(
+                title=f"Benchmark photo {index}",
+                description="Sample row for benchmark_photo_api.",
+                image=f"photos/benchmark/{index}.jpg",
+                thumb=f"photos/benchmark/thumbs/{index}.jpg",
+                preview=f"photos/benchmark/previews/{index}.jpg",
+                thumbhash="1QcSHQRnh493V4dIh4eXh1h4kJUI",
+                dominant_color="#336699",
+                palette="#336699,#ccbb88,#112233",
+                hue_bucket=index % len(HUE_BUCKET_NAMES),
+                aperture="f/2.8",
+                iso="200",
+                shutter_speed="1/250",
+                label=label,
+                order=index,
+            )
+            for index in range(count)
+        )
+        PhotoRendition.objects.bulk_create(
+            PhotoRendition(
+                photo=photo,
+                width=width,
+                height=width * 2 // 3,
+                format=image_format,
+                size=width * 40,
+                file=f"photos/benchmark/{photo.pk}-{width}w.{image_format}",
+            )
+            for photo in photos
+            for image_format in ("jpeg", "webp")
+            for width in (480, 800, 1200, 1600)
+        )
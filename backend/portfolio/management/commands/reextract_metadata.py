@@ -0,0 +1,132 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from portfolio.exif import METADATA_FIELDS
+from portfolio.models import Photo, bump_catalog_version
+from portfolio.storage_ranges import PrefixReader
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-read EXIF metadata for existing photos from the first kilobytes "
+        "of each original instead of downloading it"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--ids",
+            help="Comma-separated photo ids to process.",
+        )
+        parser.add_argument(
+            "--label",
+            help="Only photos in the label with this slug.",
+        )
+        parser.add_argument(
+            "--only-missing",
+            action="store_true",
+            help="Only photos whose numeric metadata was never extracted.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=8,
+            help="Concurrent range reads (default: 8).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=200,
+            help="Photos per batch; each batch is saved with one bulk UPDATE.",
+        )
+        parser.add_argument(
+            "--prefix-kb",
+            type=int,
+            default=64,
+            help="Bytes read first from each original, in KB; reads widen "
+            "only when the EXIF header is larger (default: 64).",
+        )
+
+    def handle(self, *args, **opts):
+        for option in ("workers", "batch_size", "prefix_kb"):
+            if opts[option] < 1:
+                flag = option.replace("_", "-")
+                raise CommandError(f"--{flag} must be at least 1.")
+
+        qs = (
+            self._queryset(opts)
+            .only("id", "image", *METADATA_FIELDS)
+            .order_by("pk")
+        )
+        reader = PrefixReader()
+        prefix_bytes = opts["prefix_kb"] * 1024
+        started = time.monotonic()
+        processed = 0
+        failed_ids = []
+
+        def extract(photo):
+            try:
+                metadata = reader.read_metadata(photo.image.name, prefix_bytes)
+            except Exception as error:
+                return photo, None, error
+            return photo, metadata, None
+
+        with ThreadPoolExecutor(max_workers=opts["workers"]) as pool:
+            last_id = 0
+            while True:
+                batch = list(qs.filter(pk__gt=last_id)[: opts["batch_size"]])
+                if not batch:
+                    break
+                last_id = batch[-1].pk
+
+                updated = []
+                for photo, metadata, error in pool.map(extract, batch):
+                    if error is not None:
+                        failed_ids.append(photo.pk)
+                        self.stderr.write(
+                            self.style.ERROR(f"Photo #{photo.pk} failed: {error}")
+                        )
+                        continue
+                    for field, value in metadata.items():
+                        setattr(photo, field, value)
+                    updated.append(photo)
+                with transaction.atomic():
+                    Photo.objects.bulk_update(updated, METADATA_FIELDS)
+                    bump_catalog_version()
+
+                processed += len(batch)
+                self.stdout.write(
+                    f"[{processed}] {reader.bytes_read / 1024:.0f} KB read"
+                    f"  {processed / (time.monotonic() - started):.1f} img/s"
+                )
+
+        summary = (
+            f"Re-extracted metadata for {processed - len(failed_ids)} photos, "
+            f"reading {reader.bytes_read / 1024:.0f} KB."
+        )
+        if failed_ids:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"{summary} {len(failed_ids)} failed; retry them with "
+                    f"--ids {','.join(str(pk) for pk in failed_ids)}"
+                )
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS(summary))
+
+    @staticmethod
+    def _queryset(opts):
+        qs = Photo.objects.exclude(image="")
+        if opts["ids"]:
+            try:
+                ids = [int(value) for value in opts["ids"].split(",") if value.strip()]
+            except ValueError:
+                raise CommandError("--ids must be comma-separated integers.")
+            qs = qs.filter(pk__in=ids)
+        if opts["label"]:
+            qs = qs.filter(label__slug=opts["label"])
+        if opts["only_missing"]:
+            qs = qs.filter(width__isnull=True)
+        return qs
@@ -0,0 +1,77 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from portfolio.derivatives import derivative_concurrency
+from portfolio.models import (
+    claim_derivative_jobs,
+    derivative_worker_id,
+    run_derivative_jobs,
+)
+
+
+class Command(BaseCommand):
+    help = "Process queued photo derivative jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit when no due jobs remain instead of polling.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5.0,
+            help="Seconds to wait between polls when the queue is empty.",
+        )
+        parser.add_argument(
+            "--max-jobs",
+            type=int,
+            default=None,
+            help="Exit after processing this many jobs.",
+        )
+
+    def handle(self, *args, once, poll_interval, max_jobs, **opts):
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        worker_id = derivative_worker_id()
+        processed = 0
+        self.stdout.write(f"Derivative worker {worker_id} started")
+
+        while not self._stopping and (max_jobs is None or processed < max_jobs):
+            limit = derivative_concurrency()
+            if max_jobs is not None:
+                limit = min(limit, max_jobs - processed)
+            jobs = claim_derivative_jobs(worker_id, limit)
+            if not jobs:
+                if once:
+                    break
+                time.sleep(poll_interval)
+                continue
+
+            run_derivative_jobs(jobs)
+            processed += len(jobs)
+            for job in jobs:
+                self._report(job)
+
+        self.stdout.write(f"Processed {processed} jobs.")
+
+    def _report(self, job):
+        line = (
+            f"Job #{job.pk} photo #{job.photo_id} {job.status} "
+            f"after attempt {job.attempts} in {job.duration_ms} ms"
+        )
+        if job.status == job.Status.DONE:
+            self.stdout.write(self.style.SUCCESS(line))
+        elif job.status == job.Status.DEAD:
+            self.stdout.write(self.style.ERROR(line))
+        else:
+            self.stdout.write(self.style.WARNING(line))
+
+    def _request_stop(self, signum, frame):
+        # Finish the job in hand; its lease would otherwise have to expire.
+        self._stopping = True
@@ -4,8 +4,9 @@ from django.conf import settings
 from django.core.files import File
 from django.core.files.storage import default_storage
 from django.core.management.base import BaseCommand
+from django.db import transaction
 
-from portfolio.models import Photo
+from portfolio.models import Photo, bump_catalog_version
 
 
 class Command(BaseCommand):
@@ -83,7 +84,9 @@ class Command(BaseCommand):
                     field_name: getattr(photo, field_name).name
                     for field_name in fields
                 }
-                Photo.objects.filter(pk=photo.pk).update(**updates)
+                with transaction.atomic():
+                    Photo.objects.filter(pk=photo.pk).update(**updates)
+                    bump_catalog_version()
                 updated_records += 1
 
         self.stdout.write(self.style.SUCCESS(f"Uploaded files: {uploaded}"))
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:29
+
+import django.db.models.deletion
+import portfolio.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0011_derivativejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('width', models.PositiveSmallIntegerField()),
+                ('height', models.PositiveSmallIntegerField()),
+                ('size', models.PositiveIntegerField(help_text='Encoded size in bytes.')),
+                ('file', models.ImageField(max_length=255, upload_to=portfolio.models.photo_rendition_upload_to)),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='portfolio.photo')),
+            ],
+            options={
+                'ordering': ['width'],
+                'constraints': [models.UniqueConstraint(fields=('photo', 'width'), name='portfolio_unique_rendition_width')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0012_photorendition'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='photorendition',
+            name='portfolio_unique_rendition_width',
+        ),
+        migrations.AddField(
+            model_name='photorendition',
+            name='format',
+            field=models.CharField(choices=[('jpeg', 'JPEG'), ('webp', 'WEBP'), ('avif', 'AVIF')], default='jpeg', max_length=5),
+        ),
+        migrations.AddConstraint(
+            model_name='photorendition',
+            constraint=models.UniqueConstraint(fields=('photo', 'width', 'format'), name='portfolio_unique_rendition_width_format'),
+        ),
+    ]
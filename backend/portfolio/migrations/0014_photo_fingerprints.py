@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0013_photorendition_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='content_sha256',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='perceptual_hash',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
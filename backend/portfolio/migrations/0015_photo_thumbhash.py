@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0014_photo_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='thumbhash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
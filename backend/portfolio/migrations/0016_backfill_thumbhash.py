@@ -0,0 +1,54 @@
+import logging
+
+from django.core.files.storage import default_storage
+from django.db import migrations
+from PIL import Image
+
+
+logger = logging.getLogger(__name__)
+BATCH_SIZE = 200
+
+
+def backfill_thumbhash(apps, schema_editor):
+    # Hashes come from the stored ~800px thumbs; originals are never read.
+    # Photos whose thumb cannot be read keep an empty hash and get one from
+    # their next derivative run (backfill_derivatives --only-missing).
+    from portfolio.thumbhash import image_to_thumbhash
+
+    Photo = apps.get_model("portfolio", "Photo")
+    pending = (
+        Photo.objects.filter(thumbhash="")
+        .exclude(thumb="")
+        .exclude(thumb__isnull=True)
+        .only("id", "thumb")
+        .order_by("id")
+    )
+    batch = []
+    for photo in pending.iterator(chunk_size=BATCH_SIZE):
+        try:
+            with default_storage.open(photo.thumb.name, "rb") as thumb_file:
+                with Image.open(thumb_file) as thumb:
+                    thumb.draft("RGB", (100, 100))
+                    photo.thumbhash = image_to_thumbhash(thumb)
+        except Exception:
+            logger.warning("Skipping ThumbHash for photo %s", photo.pk, exc_info=True)
+            continue
+        batch.append(photo)
+        if len(batch) >= BATCH_SIZE:
+            Photo.objects.bulk_update(batch, ["thumbhash"])
+            batch = []
+    if batch:
+        Photo.objects.bulk_update(batch, ["thumbhash"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("portfolio", "0015_photo_thumbhash"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            backfill_thumbhash,
+            reverse_code=migrations.RunPython.noop,
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0016_backfill_thumbhash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='dominant_color',
+            field=models.CharField(blank=True, default='', max_length=7),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='hue_bucket',
+            field=models.PositiveSmallIntegerField(blank=True, choices=[(0, 'red'), (1, 'orange'), (2, 'yellow'), (3, 'chartreuse'), (4, 'green'), (5, 'spring'), (6, 'cyan'), (7, 'azure'), (8, 'blue'), (9, 'violet'), (10, 'magenta'), (11, 'rose'), (12, 'neutral')], null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='palette',
+            field=models.CharField(blank=True, default='', max_length=39),
+        ),
+        migrations.AddIndex(
+            model_name='photo',
+            index=models.Index(fields=['hue_bucket', '-order'], name='portfolio_p_hue_buc_43a424_idx'),
+        ),
+    ]
@@ -1,31 +1,47 @@
 from django.conf import settings
-from django.db import close_old_connections, models
+from django.db import close_old_connections, connection, models, transaction
+from django.db.models import F, Q
+from django.urls import reverse
 from django.utils.text import slugify
 from django.utils import timezone
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 
 # NEW: imports for derivative generation
-import base64
-import io
 import logging
 import os
+import socket
 import threading
-from fractions import Fraction
+import time
+import traceback
+import uuid
+from concurrent.futures import as_completed
+from datetime import timedelta
 from urllib.parse import urlsplit, urlunsplit
-from PIL import ExifTags, Image, ImageOps
 
+from .derivatives import (
+    PREVIEW_MAX_W,
+    RENDITION_FORMATS,
+    THUMB_MAX_W,
+    derivative_concurrency,
+    get_derivative_executor,
+    render_photo_derivatives,
+    rendition_plan,
+)
+from .exif import (
+    LENS_MODEL_MAX_LENGTH,
+    METADATA_FIELDS,
+    empty_metadata,
+    read_photo_metadata,
+)
+from .fingerprints import fingerprint_file
+from .palette import HUE_BUCKET_NAMES, hue_bucket
+from .variants import variant_extension, variant_sizes, variant_version
 
-logger = logging.getLogger(__name__)
 
-THUMB_MAX_W = 800     # grid thumbnail
-THUMB_QUALITY = 70
-PREVIEW_MAX_W = 1600  # detail view
-PREVIEW_QUALITY = 80
-BLUR_W = 24           # tiny LQIP width (data URL)
-DERIVATIVE_GENERATION_LOCK = threading.Lock()
+logger = logging.getLogger(__name__)
 
 
 def cloudinary_variant_url(url, max_width):
@@ -43,140 +59,6 @@ def cloudinary_variant_url(url, max_width):
     return urlunsplit(parsed._replace(path=path))
 
 
-def _exif_sources(exif):
-    sources = []
-    try:
-        nested_exif = exif.get_ifd(ExifTags.IFD.Exif)
-    except (AttributeError, KeyError, TypeError, ValueError):
-        nested_exif = None
-    if nested_exif:
-        sources.append(nested_exif)
-    sources.append(exif)
-    return sources
-
-
-def _first_exif_value(exif_sources, *tag_names):
-    for exif in exif_sources:
-        for tag_id, value in exif.items():
-            if ExifTags.TAGS.get(tag_id) in tag_names and value not in (None, ""):
-                return value
-    return None
-
-
-def _rational_to_float(value):
-    if value is None:
-        return None
-    if isinstance(value, (tuple, list)) and len(value) == 2:
-        numerator, denominator = value
-        if not denominator:
-            return None
-        return float(numerator) / float(denominator)
-    try:
-        return float(value)
-    except (TypeError, ValueError, ZeroDivisionError):
-        return None
-
-
-def _format_decimal(value, places=1):
-    return f"{value:.{places}f}".rstrip("0").rstrip(".")
-
-
-def _format_aperture(value):
-    numeric = _rational_to_float(value)
-    if not numeric:
-        return ""
-    return f"f/{_format_decimal(numeric)}"
-
-
-def _format_aperture_value(value):
-    apex = _rational_to_float(value)
-    if apex is None:
-        return ""
-    return _format_aperture(2 ** (apex / 2))
-
-
-def _format_iso(value):
-    if isinstance(value, (tuple, list)):
-        value = next((item for item in value if item), None)
-    numeric = _rational_to_float(value)
-    if not numeric:
-        return ""
-    return str(int(round(numeric)))
-
-
-def _format_shutter_seconds(seconds):
-    if not seconds:
-        return ""
-    if seconds >= 1:
-        return f"{_format_decimal(seconds, 2)}s"
-    fraction = Fraction(seconds).limit_denominator(8000)
-    return f"{fraction.numerator}/{fraction.denominator}"
-
-
-def _format_exposure_time(value):
-    if isinstance(value, (tuple, list)) and len(value) == 2:
-        numerator, denominator = value
-        if numerator and denominator:
-            if numerator < denominator:
-                return f"{int(numerator)}/{int(denominator)}"
-            return _format_shutter_seconds(float(numerator) / float(denominator))
-    return _format_shutter_seconds(_rational_to_float(value))
-
-
-def _format_shutter_speed_value(value):
-    apex = _rational_to_float(value)
-    if apex is None:
-        return ""
-    return _format_shutter_seconds(2 ** (-apex))
-
-
-def extract_camera_settings(pil_img):
-    try:
-        exif = pil_img.getexif()
-        if not exif:
-            return {"aperture": "", "iso": "", "shutter_speed": ""}
-
-        exif_sources = _exif_sources(exif)
-        exposure_time = _first_exif_value(exif_sources, "ExposureTime")
-        shutter_speed_value = _first_exif_value(
-            exif_sources,
-            "ShutterSpeedValue",
-        )
-        aperture = _format_aperture(
-            _first_exif_value(exif_sources, "FNumber")
-        ) or _format_aperture_value(
-            _first_exif_value(exif_sources, "ApertureValue")
-        )
-
-        return {
-            "aperture": aperture,
-            "iso": _format_iso(
-                _first_exif_value(
-                    exif_sources,
-                    "ISOSpeedRatings",
-                    "PhotographicSensitivity",
-                    "ISOSpeed",
-                    "StandardOutputSensitivity",
-                    "RecommendedExposureIndex",
-                )
-            ),
-            "shutter_speed": (
-                _format_exposure_time(exposure_time)
-                or _format_shutter_speed_value(shutter_speed_value)
-            ),
-        }
-    except (
-        AttributeError,
-        OSError,
-        OverflowError,
-        TypeError,
-        ValueError,
-        ZeroDivisionError,
-    ):
-        logger.warning("Unable to read camera settings from image EXIF", exc_info=True)
-        return {"aperture": "", "iso": "", "shutter_speed": ""}
-
-
 def photo_upload_to(instance, filename):
     """
     Store new uploads under photos/<label-slug>/<YYYY>/<MM>/<filename>
@@ -204,6 +86,19 @@ def photo_preview_upload_to(instance, filename):
     return f"photos/{date:%Y/%m}/previews/{name}.jpg"
 
 
+def photo_rendition_upload_to(instance, filename):
+    date = timezone.now()
+    name, _ = os.path.splitext(os.path.basename(filename))
+    extension = RENDITION_FORMATS[instance.format][2]
+    photo = instance.photo
+    if getattr(photo, "label_id", None) and photo.label:
+        return (
+            f"photos/{photo.label.slug}/{date:%Y/%m}/renditions/"
+            f"{name}.{extension}"
+        )
+    return f"photos/{date:%Y/%m}/renditions/{name}.{extension}"
+
+
 class Label(models.Model):
     title = models.CharField(max_length=120, unique=True)
     slug = models.SlugField(max_length=140, unique=True)
@@ -234,10 +129,33 @@ class Photo(models.Model):
 
     # NEW: optional tiny base64 placeholder for blur-up
     blur_data_url = models.TextField(blank=True, default="")
+    # Compact placeholder (base64 ThumbHash, ~25 bytes) served by default.
+    thumbhash = models.CharField(max_length=64, blank=True, default="")
+    # "#rrggbb" colours from the preview raster; palette is comma-separated,
+    # most common first. hue_bucket indexes the dominant colour's hue.
+    dominant_color = models.CharField(max_length=7, blank=True, default="")
+    palette = models.CharField(max_length=39, blank=True, default="")
+    hue_bucket = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        choices=[(index, name) for index, name in enumerate(HUE_BUCKET_NAMES)],
+    )
 
     aperture = models.CharField(max_length=20, blank=True, default="")
     iso = models.CharField(max_length=20, blank=True, default="")
     shutter_speed = models.CharField(max_length=30, blank=True, default="")
+    # Numeric EXIF values behind the strings above, for indexed filtering
+    # and sorting. width/height are the displayed (orientation-applied) size.
+    f_number = models.FloatField(null=True, blank=True, db_index=True)
+    iso_speed = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    exposure_seconds = models.FloatField(null=True, blank=True, db_index=True)
+    focal_length_mm = models.FloatField(null=True, blank=True, db_index=True)
+    lens_model = models.CharField(
+        max_length=LENS_MODEL_MAX_LENGTH, blank=True, default=""
+    )
+    captured_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
 
     # optional grouping
     label = models.ForeignKey(
@@ -251,11 +169,18 @@ class Photo(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     order = models.IntegerField(default=0)
 
+    # Upload fingerprints: exact bytes and a 64-bit dHash for near matches.
+    content_sha256 = models.CharField(
+        max_length=64, blank=True, default="", db_index=True
+    )
+    perceptual_hash = models.BigIntegerField(null=True, blank=True, db_index=True)
+
     class Meta:
         # default list order; we keep newest/highest order first
         ordering = ["-order", "-id"]
         indexes = [
             models.Index(fields=["label", "-order"]),
+            models.Index(fields=["hue_bucket", "-order"]),
         ]
 
     def __str__(self):
@@ -279,7 +204,7 @@ class Photo(models.Model):
         original_url = self._field_url(self.image)
         if settings.USE_CLOUDINARY:
             return cloudinary_variant_url(original_url, THUMB_MAX_W)
-        return original_url
+        return self.variant_url(THUMB_MAX_W) or original_url
 
     @property
     def preview_url(self):
@@ -290,139 +215,176 @@ class Photo(models.Model):
         original_url = self._field_url(self.image)
         if settings.USE_CLOUDINARY:
             return cloudinary_variant_url(original_url, PREVIEW_MAX_W)
-        return original_url
+        return self.variant_url(PREVIEW_MAX_W, PREVIEW_MAX_W) or original_url
+
+    def variant_url(self, width, height=0, image_format="jpeg"):
+        """
+        On-demand rendering URL for an allow-listed box, or "" when the box
+        is not served. The version query changes with the original, so the
+        response can be cached as immutable.
+        """
+        if not self.pk or not self.image:
+            return ""
+        if (width, height) not in variant_sizes():
+            return ""
+        path = reverse(
+            "photo_variant",
+            kwargs={
+                "photo_id": self.pk,
+                "width": width,
+                "height": height,
+                "extension": variant_extension(image_format),
+            },
+        )
+        return f"{path}?v={variant_version(self.image.name)}"
 
     # ---------- Derivative helpers ----------
-    def _make_resized_jpeg(self, pil_img, max_w, quality):
-        working_image = pil_img
-        owned_images = []
-        try:
-            if working_image.mode not in ("RGB", "L"):
-                working_image = working_image.convert("RGB")
-                owned_images.append(working_image)
-            width, height = working_image.size
-            if width > max_w:
-                resized_image = working_image.resize(
-                    (max_w, max(1, int(height * (max_w / float(width))))),
-                    Image.Resampling.LANCZOS,
-                )
-                owned_images.append(resized_image)
-                working_image = resized_image
-            with io.BytesIO() as buffer:
-                working_image.save(
-                    buffer,
-                    format="JPEG",
-                    quality=quality,
-                    optimize=True,
-                    progressive=True,
-                )
-                return buffer.getvalue()
-        finally:
-            for owned_image in owned_images:
-                owned_image.close()
+    def derivative_task(self, force=False):
+        """
+        Describe the derivative work still needed as keyword arguments for
+        render_photo_derivatives, or None when there is nothing to render.
+        """
+        if not self.image or settings.USE_CLOUDINARY:
+            return None
+        renditions = rendition_plan()
+        if not force and self.pk:
+            if "renditions" in getattr(self, "_prefetched_objects_cache", {}):
+                existing = {(r.width, r.format) for r in self.renditions.all()}
+            else:
+                existing = set(self.renditions.values_list("width", "format"))
+            renditions = [pair for pair in renditions if pair not in existing]
+        return {
+            "storage_name": self.image.name,
+            "thumb": force or not self.thumb,
+            "preview": force or not self.preview,
+            "blur": force or not self.blur_data_url,
+            "thumbhash": force or not self.thumbhash,
+            "palette": force or not self.dominant_color,
+            "renditions": renditions,
+            "fingerprint": (
+                force or not self.content_sha256 or self.perceptual_hash is None
+            ),
+        }
 
-    def _build_blur_data_url(self, pil_img, tiny_w=BLUR_W):
-        working_image = pil_img
-        converted_image = None
-        tiny_image = None
-        try:
-            if working_image.mode not in ("RGB", "L"):
-                converted_image = working_image.convert("RGB")
-                working_image = converted_image
-            width, height = working_image.size
-            new_height = (
-                max(1, int(height * (tiny_w / float(width)))) if width else 1
+    def store_rendered_derivatives(self, rendered, force=False):
+        """Write rendered derivative bytes to storage and set the fields."""
+        base_name = os.path.basename(self.image.name)
+
+        if rendered["thumb"] is not None:
+            self.thumb.save(
+                os.path.basename(photo_thumb_upload_to(self, base_name)),
+                ContentFile(rendered["thumb"]),
+                save=False,
             )
-            tiny_image = working_image.resize(
-                (tiny_w, new_height),
-                Image.Resampling.LANCZOS,
+
+        if rendered["preview"] is not None:
+            self.preview.save(
+                os.path.basename(photo_preview_upload_to(self, base_name)),
+                ContentFile(rendered["preview"]),
+                save=False,
             )
-            with io.BytesIO() as buffer:
-                tiny_image.save(buffer, format="JPEG", quality=25, optimize=True)
-                encoded = base64.b64encode(buffer.getvalue()).decode("ascii")
-                return f"data:image/jpeg;base64,{encoded}"
-        finally:
-            if tiny_image is not None:
-                tiny_image.close()
-            if converted_image is not None:
-                converted_image.close()
+
+        if rendered["blur_data_url"]:
+            self.blur_data_url = rendered["blur_data_url"]
+
+        if rendered["thumbhash"]:
+            self.thumbhash = rendered["thumbhash"]
+
+        if rendered["palette"]:
+            self.dominant_color = rendered["palette"][0]
+            self.palette = ",".join(rendered["palette"])
+            self.hue_bucket = hue_bucket(self.dominant_color)
+
+        if rendered["renditions"]:
+            self.store_renditions(rendered["renditions"])
+
+        for field, value in rendered["metadata"].items():
+            if force or not getattr(self, field):
+                setattr(self, field, value)
+
+        if rendered.get("content_sha256"):
+            self.content_sha256 = rendered["content_sha256"]
+            self.perceptual_hash = rendered["perceptual_hash"]
+
+    def store_renditions(self, renditions):
+        """Save rendered ladder entries, replacing rows for the same width/format."""
+        base_name = os.path.splitext(os.path.basename(self.image.name))[0]
+        stored = []
+        for rendition in renditions:
+            row = PhotoRendition(
+                photo=self,
+                width=rendition["width"],
+                height=rendition["height"],
+                format=rendition["format"],
+                size=len(rendition["content"]),
+            )
+            row.file.save(
+                f"{base_name}-{rendition['width']}w",
+                ContentFile(rendition["content"]),
+                save=False,
+            )
+            stored.append(row)
+
+        if not stored:
+            return
+        same_slot = Q()
+        for row in stored:
+            same_slot |= Q(width=row.width, format=row.format)
+        replaced = PhotoRendition.objects.filter(same_slot, photo=self)
+        replaced_names = list(replaced.values_list("file", flat=True))
+        with transaction.atomic():
+            replaced.delete()
+            PhotoRendition.objects.bulk_create(stored)
+            bump_catalog_version()
+        delete_storage_files(replaced_names)
+
+    def storage_names(self):
+        """Every stored file that belongs to this photo."""
+        names = [
+            field.name
+            for field in (self.image, self.thumb, self.preview)
+            if field and field.name
+        ]
+        if self.pk:
+            names.extend(rendition.file.name for rendition in self.renditions.all())
+        return names
 
     def generate_derivatives(self, force=False):
         """
-        Create thumbnail (~800w), preview (~1600w), and blur_data_url.
+        Render whatever derivative_task reports missing (thumb, preview,
+        placeholders, palette, renditions, fingerprints) in this thread and
+        store it on the instance; the caller saves DERIVATIVE_FIELDS. Only
+        Photo.save uses this, when derivatives are not deferred; uploads
+        queue a DerivativeJob (schedule_photo_derivative_generation) instead.
         Safe to call multiple times; controlled by 'force'.
         """
-        if not self.image or settings.USE_CLOUDINARY:
+        task = self.derivative_task(force)
+        if task is None:
             return
+        self.store_rendered_derivatives(render_photo_derivatives(**task), force)
 
-        with DERIVATIVE_GENERATION_LOCK:
-            self.image.open()
-            try:
-                with Image.open(self.image) as source_image:
-                    camera_settings = extract_camera_settings(source_image)
-
-                    # JPEG draft decoding avoids allocating the full-resolution
-                    # raster when only 1600px derivatives are needed.
-                    source_image.draft(
-                        "RGB",
-                        (PREVIEW_MAX_W, PREVIEW_MAX_W),
-                    )
-                    source_image.thumbnail(
-                        (PREVIEW_MAX_W, PREVIEW_MAX_W),
-                        Image.Resampling.LANCZOS,
-                    )
-                    display_image = ImageOps.exif_transpose(source_image)
-                    try:
-                        display_image.load()
-                        base_name = os.path.basename(self.image.name)
-
-                        if force or not self.thumb:
-                            thumb_bytes = self._make_resized_jpeg(
-                                display_image,
-                                THUMB_MAX_W,
-                                THUMB_QUALITY,
-                            )
-                            self.thumb.save(
-                                os.path.basename(
-                                    photo_thumb_upload_to(self, base_name)
-                                ),
-                                ContentFile(thumb_bytes),
-                                save=False,
-                            )
-
-                        if force or not self.preview:
-                            preview_bytes = self._make_resized_jpeg(
-                                display_image,
-                                PREVIEW_MAX_W,
-                                PREVIEW_QUALITY,
-                            )
-                            self.preview.save(
-                                os.path.basename(
-                                    photo_preview_upload_to(self, base_name)
-                                ),
-                                ContentFile(preview_bytes),
-                                save=False,
-                            )
-
-                        if force or not self.blur_data_url:
-                            self.blur_data_url = self._build_blur_data_url(
-                                display_image
-                            )
-                    finally:
-                        if display_image is not source_image:
-                            display_image.close()
-
-                    for field, value in camera_settings.items():
-                        if force or not getattr(self, field):
-                            setattr(self, field, value)
-            finally:
-                self.image.close()
+    def apply_ingested(self, ingested, metadata=True):
+        """
+        Fill fingerprints, and metadata unless derivative generation will
+        read it again, from the upload's IngestedImage. Values the caller
+        already set (e.g. for a resized Cloudinary copy) are kept. Uploads
+        validated without a dHash leave perceptual_hash None; derivative_task
+        then asks the derivative job for it.
+        """
+        if not self.content_sha256:
+            self.content_sha256 = ingested.content_sha256
+            self.perceptual_hash = ingested.perceptual_hash
+        if metadata:
+            for field, value in ingested.metadata.items():
+                if getattr(self, field) in (None, ""):
+                    setattr(self, field, value)
 
     def save(self, *args, **kwargs):
         """
         - On first save, set per-label order.
         - Save EXIF with the original.
         - Generate derivatives immediately unless the caller explicitly defers them.
+        - Reuse an upload's IngestedImage (photo._ingested) instead of reopening it.
         """
         is_create = not self.pk
         defer_derivatives = (
@@ -446,18 +408,27 @@ class Photo(models.Model):
             self.thumb = None
             self.preview = None
             self.blur_data_url = ""
-            self.aperture = ""
-            self.iso = ""
-            self.shutter_speed = ""
+            self.thumbhash = ""
+            self.dominant_color = ""
+            self.palette = ""
+            self.hue_bucket = None
+            for field, value in empty_metadata().items():
+                setattr(self, field, value)
+            self.content_sha256 = ""
+            self.perceptual_hash = None
             update_fields = kwargs.get("update_fields")
             if update_fields is not None:
                 kwargs["update_fields"] = set(update_fields) | {
                     "thumb",
                     "preview",
                     "blur_data_url",
-                    "aperture",
-                    "iso",
-                    "shutter_speed",
+                    "thumbhash",
+                    "dominant_color",
+                    "palette",
+                    "hue_bucket",
+                    *METADATA_FIELDS,
+                    "content_sha256",
+                    "perceptual_hash",
                 }
 
         if is_create:
@@ -465,13 +436,21 @@ class Photo(models.Model):
             max_order = qs.aggregate(models.Max("order"))["order__max"]
             self.order = (max_order or 0) + 1
 
-        if defer_derivatives and self.image and (is_create or image_changed):
+        ingested = getattr(self, "_ingested", None)
+        if ingested is not None and (is_create or image_changed):
+            # The upload was already read once during validation.
+            self.apply_ingested(ingested, metadata=defer_derivatives)
+        elif defer_derivatives and self.image and (is_create or image_changed):
             self.image.open()
             try:
-                with Image.open(self.image) as pil:
-                    for field, value in extract_camera_settings(pil).items():
-                        if value or not getattr(self, field):
-                            setattr(self, field, value)
+                for field, value in read_photo_metadata(self.image).items():
+                    if value or not getattr(self, field):
+                        setattr(self, field, value)
+                # Callers that deduplicate uploads pass the fingerprints in.
+                if not self.content_sha256:
+                    self.content_sha256, self.perceptual_hash = fingerprint_file(
+                        self.image
+                    )
             finally:
                 self.image.seek(0)
 
@@ -492,71 +471,638 @@ class Photo(models.Model):
                 ):
                     file_field.delete(save=False)
 
+            stale_renditions = PhotoRendition.objects.filter(photo=self)
+            stale_names = list(stale_renditions.values_list("file", flat=True))
+            stale_renditions.delete()
+            delete_storage_files(stale_names)
+
         # If the original exists, generate derivatives.
         if self.image and not defer_derivatives:
             self.generate_derivatives()
-            super().save(
-                update_fields=[
-                    "thumb",
-                    "preview",
-                    "blur_data_url",
-                    "aperture",
-                    "iso",
-                    "shutter_speed",
-                ]
-            )
+            super().save(update_fields=DERIVATIVE_FIELDS)
 
 
-def generate_photo_derivatives(photo_ids):
-    close_old_connections()
-    try:
-        for photo_id in photo_ids:
-            try:
-                photo = Photo.objects.get(pk=photo_id)
-            except Photo.DoesNotExist:
-                continue
+class PhotoRendition(models.Model):
+    """One stored width of a photo's responsive ladder."""
+
+    photo = models.ForeignKey(
+        Photo,
+        on_delete=models.CASCADE,
+        related_name="renditions",
+    )
+    width = models.PositiveSmallIntegerField()
+    height = models.PositiveSmallIntegerField()
+    format = models.CharField(
+        max_length=5,
+        choices=[(name, name.upper()) for name in RENDITION_FORMATS],
+        default="jpeg",
+    )
+    size = models.PositiveIntegerField(help_text="Encoded size in bytes.")
+    file = models.ImageField(upload_to=photo_rendition_upload_to, max_length=255)
+
+    class Meta:
+        ordering = ["width"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["photo", "width", "format"],
+                name="portfolio_unique_rendition_width_format",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.photo_id} @ {self.width}w {self.format}"
+
+    @property
+    def content_type(self):
+        return RENDITION_FORMATS[self.format][1]
+
+
+class DerivativeJob(models.Model):
+    """
+    Durable unit of derivative work for one photo.
+
+    A photo has at most one queued or running job, so any number of web
+    processes and workers can share the table without generating the same
+    derivatives twice. Running jobs hold a lease; a job whose worker died is
+    claimable again once the lease expires.
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = "queued", "Queued"
+        RUNNING = "running", "Running"
+        DONE = "done", "Done"
+        DEAD = "dead", "Dead"
+
+    photo = models.ForeignKey(
+        Photo,
+        on_delete=models.CASCADE,
+        related_name="derivative_jobs",
+    )
+    force = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=10,
+        choices=Status.choices,
+        default=Status.QUEUED,
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=120, blank=True, default="")
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration_ms = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["run_after", "id"]
+        indexes = [
+            models.Index(fields=["status", "run_after"]),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["photo"],
+                condition=Q(status__in=["queued", "running"]),
+                name="portfolio_one_active_derivative_job",
+            ),
+        ]
 
+    def __str__(self):
+        return f"Derivatives for photo #{self.photo_id} ({self.status})"
+
+
+class UploadSession(models.Model):
+    """
+    One original arriving through the resumable upload API.
+
+    Bytes are PATCHed in chunks at explicit offsets and appended to a spool
+    file (see portfolio.resumable) until finalize turns them into a Photo.
+    Direct uploads set storage_name instead: the browser writes the object
+    to S3 with a presigned request and finalize reads it back from there.
+    Creation and finalization are keyed by (owner, idempotency_key), so a
+    client can retry either step without creating a second session or photo.
+    """
+
+    class Status(models.TextChoices):
+        OPEN = "open", "Open"
+        FINALIZING = "finalizing", "Finalizing"
+        FINALIZED = "finalized", "Finalized"
+        FAILED = "failed", "Failed"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="upload_sessions",
+    )
+    idempotency_key = models.CharField(max_length=128)
+    filename = models.CharField(max_length=255)
+    length = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    storage_name = models.CharField(max_length=255, blank=True, default="")
+    label = models.ForeignKey(
+        Label,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+    )
+    title_prefix = models.CharField(max_length=80, blank=True, default="")
+    description = models.TextField(blank=True, default="")
+    status = models.CharField(
+        max_length=10,
+        choices=Status.choices,
+        default=Status.OPEN,
+    )
+    photo = models.ForeignKey(
+        Photo,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+    )
+    duplicate = models.BooleanField(default=False)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["created_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["owner", "idempotency_key"],
+                name="portfolio_unique_upload_idempotency_key",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.length}, {self.status})"
+
+
+class CatalogVersion(models.Model):
+    """
+    Single row whose version goes up with every change to what the public
+    photo API shows (photos, labels, renditions). Clients revalidate against
+    it, so an unchanged catalog is answered without querying photos.
+    """
+
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Catalog version {self.version}"
+
+
+def catalog_version():
+    """(version, updated_at) of the catalog; (0, None) before any change."""
+    row = CatalogVersion.objects.filter(pk=1).values_list(
+        "version", "updated_at"
+    ).first()
+    return row or (0, None)
+
+
+def bump_catalog_version():
+    """
+    Advance the catalog version. Runs inside the caller's transaction, so
+    the new version becomes visible together with the change it describes.
+    Signals cover save() and delete(); code that writes with bulk_create,
+    bulk_update or update() calls this itself.
+    """
+    updated = CatalogVersion.objects.filter(pk=1).update(
+        version=F("version") + 1,
+        updated_at=timezone.now(),
+    )
+    if not updated:
+        CatalogVersion.objects.get_or_create(pk=1, defaults={"version": 1})
+
+
+# Photo columns written by derivative generation.
+DERIVATIVE_FIELDS = [
+    "thumb",
+    "preview",
+    "blur_data_url",
+    "thumbhash",
+    "dominant_color",
+    "palette",
+    "hue_bucket",
+    *METADATA_FIELDS,
+    "content_sha256",
+    "perceptual_hash",
+]
+
+
+def _persist_derivative_fields(photo):
+    updates = {}
+    if photo.thumb and photo.thumb.name:
+        updates["thumb"] = photo.thumb.name
+    if photo.preview and photo.preview.name:
+        updates["preview"] = photo.preview.name
+    if photo.blur_data_url:
+        updates["blur_data_url"] = photo.blur_data_url
+    if photo.thumbhash:
+        updates["thumbhash"] = photo.thumbhash
+    if photo.dominant_color:
+        updates["dominant_color"] = photo.dominant_color
+        updates["palette"] = photo.palette
+        updates["hue_bucket"] = photo.hue_bucket
+    for field in (*METADATA_FIELDS, "content_sha256"):
+        value = getattr(photo, field)
+        if value:
+            updates[field] = value
+    if photo.perceptual_hash is not None:
+        updates["perceptual_hash"] = photo.perceptual_hash
+    if updates:
+        with transaction.atomic():
+            Photo.objects.filter(pk=photo.pk).update(**updates)
+            bump_catalog_version()
+
+
+def generate_derivatives_concurrently(
+    photos_with_force,
+    executor=None,
+    persist=True,
+    on_rendered=None,
+    on_started=None,
+):
+    """
+    Render (photo, force) pairs on the configured derivative executor and
+    store each result as it completes. Only storage names and flags are sent
+    to the executor; encoded bytes come back and are written from this
+    process. Yields (photo, error) pairs, where error is None on success.
+    Whatever was stored before a failure is still persisted, unless persist
+    is False, in which case the caller saves DERIVATIVE_FIELDS itself.
+    on_started(photo) is called as each photo's render is submitted, and
+    on_rendered(photo, rendered) with each render result.
+    """
+    executor = executor or get_derivative_executor()
+    futures = {}
+    for photo, force in photos_with_force:
+        if on_started is not None:
+            on_started(photo)
+        task = photo.derivative_task(force)
+        if task is None:
+            yield photo, None
+            continue
+        future = executor.submit(render_photo_derivatives, **task)
+        futures[future] = (photo, force)
+
+    for future in as_completed(futures):
+        photo, force = futures[future]
+        error = None
+        try:
+            rendered = future.result()
+            if on_rendered is not None:
+                on_rendered(photo, rendered)
+            photo.store_rendered_derivatives(rendered, force)
+        except Exception as exc:
+            error = exc
+        if persist:
             try:
-                photo.generate_derivatives()
-            except Exception:
-                logger.exception("Unable to generate derivatives for photo %s", photo_id)
-            updates = {}
-            if photo.thumb and photo.thumb.name:
-                updates["thumb"] = photo.thumb.name
-            if photo.preview and photo.preview.name:
-                updates["preview"] = photo.preview.name
-            if photo.blur_data_url:
-                updates["blur_data_url"] = photo.blur_data_url
-            for field in ("aperture", "iso", "shutter_speed"):
-                value = getattr(photo, field)
-                if value:
-                    updates[field] = value
-            if updates:
-                try:
-                    Photo.objects.filter(pk=photo_id).update(**updates)
-                except Exception:
-                    logger.exception(
-                        "Unable to persist derivatives for photo %s",
-                        photo_id,
-                    )
+                _persist_derivative_fields(photo)
+            except Exception as exc:
+                error = error or exc
+        yield photo, error
+
+
+def generate_photo_derivatives(photo_ids, force=False):
+    close_old_connections()
+    try:
+        ids = tuple(dict.fromkeys(photo_ids))
+        photos = Photo.objects.in_bulk(ids)
+        for photo, error in generate_derivatives_concurrently(
+            (photos[photo_id], force) for photo_id in ids if photo_id in photos
+        ):
+            if error is not None:
+                logger.error(
+                    "Unable to generate derivatives for photo %s",
+                    photo.pk,
+                    exc_info=error,
+                )
     finally:
         close_old_connections()
 
 
-def schedule_photo_derivative_generation(photo_ids):
+def derivative_worker_id():
+    return (
+        f"{socket.gethostname()}:{os.getpid()}:"
+        f"{threading.current_thread().name}"
+    )[:120]
+
+
+def enqueue_photo_derivatives(photo_ids, force=False):
+    """
+    Queue derivative jobs. Photos that already have an active job are skipped
+    by the partial unique constraint instead of being queued twice.
+    """
     ids = tuple(dict.fromkeys(photo_id for photo_id in photo_ids if photo_id))
     if not ids:
+        return ids
+
+    DerivativeJob.objects.bulk_create(
+        [DerivativeJob(photo_id=photo_id, force=force) for photo_id in ids],
+        ignore_conflicts=True,
+    )
+    return ids
+
+
+def derivative_backlog_saturated():
+    """True when more derivative work is queued than should be accepted."""
+    return (
+        DerivativeJob.objects.filter(
+            status__in=[DerivativeJob.Status.QUEUED, DerivativeJob.Status.RUNNING]
+        )[: settings.PHOTO_DERIVATIVE_MAX_BACKLOG].count()
+        >= settings.PHOTO_DERIVATIVE_MAX_BACKLOG
+    )
+
+
+# Per-photo processing state, derived from the photo's most recent job.
+PROCESSING_QUEUED = "queued"
+PROCESSING_RUNNING = "running"
+PROCESSING_DONE = "done"
+PROCESSING_FAILED = "failed"
+PROCESSING_TERMINAL_STATES = {PROCESSING_DONE, PROCESSING_FAILED}
+
+
+def photo_processing_states(photo_ids):
+    """
+    Map photo id -> processing state for the photos' latest derivative jobs.
+
+    Each state is a dict with "state" (queued/running/done/failed),
+    "attempts", "started_at", "finished_at" and "duration_ms". Photos that
+    never had a job are left out; they have nothing to wait for.
+    """
+    photo_ids = list(photo_ids)
+    if not photo_ids:
+        return {}
+    jobs = (
+        DerivativeJob.objects.filter(photo_id__in=photo_ids)
+        .order_by("photo_id", "-created_at", "-id")
+        .values(
+            "photo_id",
+            "status",
+            "attempts",
+            "started_at",
+            "finished_at",
+            "duration_ms",
+        )
+    )
+    states = {}
+    for job in jobs:
+        if job["photo_id"] in states:
+            continue
+        state = {
+            DerivativeJob.Status.QUEUED: PROCESSING_QUEUED,
+            DerivativeJob.Status.RUNNING: PROCESSING_RUNNING,
+            DerivativeJob.Status.DONE: PROCESSING_DONE,
+            DerivativeJob.Status.DEAD: PROCESSING_FAILED,
+        }[job["status"]]
+        states[job["photo_id"]] = {
+            "state": state,
+            "attempts": job["attempts"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+            "duration_ms": job["duration_ms"],
+        }
+    return states
+
+
+def _claimable_derivative_jobs(now):
+    return DerivativeJob.objects.filter(
+        Q(status=DerivativeJob.Status.QUEUED, run_after__lte=now)
+        | Q(status=DerivativeJob.Status.RUNNING, locked_until__lt=now)
+    )
+
+
+def claim_derivative_job(worker_id=None):
+    """
+    Atomically move the next due job to RUNNING under a lease.
+
+    Postgres uses SELECT ... FOR UPDATE SKIP LOCKED so concurrent workers never
+    wait on each other. SQLite has no row locks; there the claim is a
+    conditional UPDATE that only one writer can win.
+    """
+    worker_id = worker_id or derivative_worker_id()
+    now = timezone.now()
+    claim = {
+        "status": DerivativeJob.Status.RUNNING,
+        "locked_by": worker_id,
+        "locked_until": now
+        + timedelta(seconds=settings.PHOTO_DERIVATIVE_LEASE_SECONDS),
+        "started_at": now,
+        "finished_at": None,
+        "duration_ms": None,
+    }
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = (
+                _claimable_derivative_jobs(now)
+                .select_for_update(skip_locked=True)
+                .order_by("run_after", "id")
+                .first()
+            )
+            if job is None:
+                return None
+            for field, value in claim.items():
+                setattr(job, field, value)
+            job.attempts += 1
+            job.save(update_fields=[*claim, "attempts"])
+            return job
+
+    candidate_ids = list(
+        _claimable_derivative_jobs(now)
+        .order_by("run_after", "id")
+        .values_list("id", flat=True)[:10]
+    )
+    for job_id in candidate_ids:
+        claimed = (
+            _claimable_derivative_jobs(now)
+            .filter(pk=job_id)
+            .update(attempts=F("attempts") + 1, **claim)
+        )
+        if claimed:
+            return DerivativeJob.objects.get(pk=job_id)
+    return None
+
+
+def claim_derivative_jobs(worker_id=None, limit=1):
+    worker_id = worker_id or derivative_worker_id()
+    jobs = []
+    while len(jobs) < limit:
+        job = claim_derivative_job(worker_id)
+        if job is None:
+            break
+        jobs.append(job)
+    return jobs
+
+
+def _record_derivative_job_outcome(job, started, error):
+    outcome = {"last_error": ""}
+    if error is not None:
+        outcome["last_error"] = "".join(traceback.format_exception(error))
+        if job.attempts >= settings.PHOTO_DERIVATIVE_MAX_ATTEMPTS:
+            outcome["status"] = DerivativeJob.Status.DEAD
+            logger.error(
+                "Derivative job %s for photo %s failed permanently",
+                job.pk,
+                job.photo_id,
+                exc_info=error,
+            )
+        else:
+            outcome["status"] = DerivativeJob.Status.QUEUED
+            outcome["run_after"] = timezone.now() + timedelta(
+                seconds=settings.PHOTO_DERIVATIVE_RETRY_BACKOFF_SECONDS
+                * 2 ** (job.attempts - 1)
+            )
+            logger.warning(
+                "Derivative job %s for photo %s failed (attempt %s); retrying",
+                job.pk,
+                job.photo_id,
+                job.attempts,
+                exc_info=error,
+            )
+    else:
+        outcome["status"] = DerivativeJob.Status.DONE
+
+    outcome.update(
+        locked_by="",
+        locked_until=None,
+        finished_at=timezone.now(),
+        duration_ms=int((time.monotonic() - started) * 1000),
+    )
+    # Only the lease holder may record the outcome; a worker whose lease
+    # expired and was reclaimed must not overwrite the new owner's state.
+    DerivativeJob.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        **outcome
+    )
+    for field, value in outcome.items():
+        setattr(job, field, value)
+    logger.info(
+        "Derivative job %s for photo %s %s in %s ms",
+        job.pk,
+        job.photo_id,
+        job.status,
+        job.duration_ms,
+    )
+
+
+def run_derivative_jobs(jobs):
+    """
+    Execute claimed jobs concurrently and record each outcome. Failures are
+    retried with exponential backoff until PHOTO_DERIVATIVE_MAX_ATTEMPTS,
+    after which the job is dead-lettered with its last traceback.
+    """
+    jobs_by_photo = {job.photo_id: job for job in jobs}
+    photos = Photo.objects.in_bulk(jobs_by_photo)
+    for photo_id in jobs_by_photo.keys() - photos.keys():
+        # The photo was deleted after the job was claimed.
+        _record_derivative_job_outcome(
+            jobs_by_photo[photo_id], time.monotonic(), None
+        )
+
+    # A batch renders concurrently but is stored one result at a time, so
+    # each job is timed by its own render (measured where it ran) plus its
+    # own store. A failed render counts from its submission.
+    started = {}
+
+    def on_started(photo):
+        started[photo.pk] = time.monotonic()
+
+    def on_rendered(photo, rendered):
+        started[photo.pk] = time.monotonic() - rendered["render_seconds"]
+
+    for photo, error in generate_derivatives_concurrently(
+        (
+            (photo, jobs_by_photo[photo_id].force)
+            for photo_id, photo in photos.items()
+        ),
+        on_started=on_started,
+        on_rendered=on_rendered,
+    ):
+        _record_derivative_job_outcome(
+            jobs_by_photo[photo.pk], started[photo.pk], error
+        )
+    return jobs
+
+
+def run_derivative_job(job):
+    return run_derivative_jobs([job])[0]
+
+
+def process_derivative_jobs(worker_id=None, max_jobs=None):
+    """Claim and run due jobs until the queue is empty. Returns the job count."""
+    worker_id = worker_id or derivative_worker_id()
+    processed = 0
+    close_old_connections()
+    try:
+        while max_jobs is None or processed < max_jobs:
+            limit = derivative_concurrency()
+            if max_jobs is not None:
+                limit = min(limit, max_jobs - processed)
+            jobs = claim_derivative_jobs(worker_id, limit)
+            if not jobs:
+                break
+            run_derivative_jobs(jobs)
+            processed += len(jobs)
+    finally:
+        close_old_connections()
+    return processed
+
+
+_inline_worker_lock = threading.Lock()
+_inline_worker_wakeup = threading.Event()
+
+
+def _run_inline_derivative_worker():
+    # One drain thread per process keeps memory bounded; a wakeup that arrives
+    # while it runs makes it take another pass instead of starting a second one.
+    while _inline_worker_wakeup.is_set():
+        if not _inline_worker_lock.acquire(blocking=False):
+            return
+        try:
+            _inline_worker_wakeup.clear()
+            process_derivative_jobs()
+        except Exception:
+            logger.exception("Inline derivative worker stopped unexpectedly")
+        finally:
+            _inline_worker_lock.release()
+
+
+def start_inline_derivative_worker():
+    if not settings.PHOTO_DERIVATIVE_INLINE_WORKER:
         return
 
+    _inline_worker_wakeup.set()
     derivative_thread = threading.Thread(
-        target=generate_photo_derivatives,
-        args=(ids,),
+        target=_run_inline_derivative_worker,
         name="photo-derivative-generation",
         daemon=True,
     )
     derivative_thread.start()
 
 
+def schedule_photo_derivative_generation(photo_ids, force=False):
+    ids = enqueue_photo_derivatives(photo_ids, force=force)
+    if not ids:
+        return
+
+    transaction.on_commit(start_inline_derivative_worker)
+
+
+@receiver([post_save, post_delete], sender=Label)
+@receiver([post_save, post_delete], sender=Photo)
+@receiver([post_save, post_delete], sender=PhotoRendition)
+def bump_catalog_version_on_change(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(pre_delete, sender=Photo)
+def collect_storage_names_before_delete(sender, instance, **kwargs):
+    # Renditions are cascade-deleted before the photo's post_delete runs.
+    if not getattr(instance, "_defer_storage_cleanup", False):
+        instance._storage_names = instance.storage_names()
+
+
 @receiver(post_delete, sender=Photo)
 def delete_file_from_storage_on_delete(sender, instance, **kwargs):
     """Remove files from configured storage when a Photo row is deleted."""
@@ -564,9 +1110,7 @@ def delete_file_from_storage_on_delete(sender, instance, **kwargs):
         return
 
     delete_storage_files(
-        field.name
-        for field in (instance.image, instance.thumb, instance.preview)
-        if field and field.name
+        getattr(instance, "_storage_names", None) or instance.storage_names()
     )
 
 
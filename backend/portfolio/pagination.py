@@ -0,0 +1,92 @@
+import base64
+import binascii
+import json
+from collections import namedtuple
+
+from django.db.models import F, Q
+
+
+# One column of a keyset ordering. Only nullable columns set nulls_last.
+SortKey = namedtuple("SortKey", "field descending nulls_last", defaults=(False,))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def order_by_expressions(keys):
+    return [
+        F(key.field).desc(nulls_last=key.nulls_last or None)
+        if key.descending
+        else F(key.field).asc(nulls_last=key.nulls_last or None)
+        for key in keys
+    ]
+
+
+def encode_cursor(sort, row, keys, backwards=False):
+    """
+    Opaque cursor for the position of row (a model instance or a values()
+    dict) in the ordering keys. Following a backwards cursor returns the
+    page before that row instead of after it.
+    """
+    if isinstance(row, dict):
+        values = [row[key.field] for key in keys]
+    else:
+        values = [getattr(row, key.field) for key in keys]
+    payload = {"s": sort, "v": values}
+    if backwards:
+        payload["b"] = 1
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def decode_cursor(token, sort, keys):
+    """Return (values, backwards) for a cursor issued for the same sort."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+        values = payload["v"]
+        valid = (
+            payload["s"] == sort
+            and isinstance(values, list)
+            and len(values) == len(keys)
+            and all(
+                isinstance(value, int) or (value is None and key.nulls_last)
+                for key, value in zip(keys, values)
+            )
+        )
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        valid = False
+    if not valid:
+        raise InvalidCursor("Invalid cursor.")
+    return values, bool(payload.get("b"))
+
+
+def _beyond(key, value, after):
+    """Rows strictly after (or before) value in key's own direction."""
+    if value is None:
+        # Nulls sort last: nothing follows them, every non-null precedes them.
+        return Q(pk__in=[]) if after else Q(**{f"{key.field}__isnull": False})
+    lookup = "lt" if key.descending == after else "gt"
+    condition = Q(**{f"{key.field}__{lookup}": value})
+    if key.nulls_last and after:
+        condition |= Q(**{f"{key.field}__isnull": True})
+    return condition
+
+
+def _equal(key, value):
+    if value is None:
+        return Q(**{f"{key.field}__isnull": True})
+    return Q(**{key.field: value})
+
+
+def keyset_filter(keys, values, after=True):
+    """
+    Rows that sort strictly after (or before) the row with these key values,
+    as (k1 > v1) OR (k1 = v1 AND (k2 > v2 OR ...)), which the composite
+    (label, -order) style indexes can seek into.
+    """
+    condition = _beyond(keys[-1], values[-1], after)
+    for key, value in zip(reversed(keys[:-1]), reversed(values[:-1])):
+        condition = _beyond(key, value, after) | (_equal(key, value) & condition)
+    return condition
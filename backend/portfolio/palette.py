@@ -0,0 +1,97 @@
+import colorsys
+
+import numpy as np
+from PIL import Image
+
+
+PALETTE_SIZE = 5
+PALETTE_SAMPLE_SIDE = 64  # k-means runs on at most 64x64 pixels
+KMEANS_ITERATIONS = 12
+
+# Twelve 30-degree hue buckets centred on red, plus one for greys.
+HUE_BUCKET_NAMES = (
+    "red",
+    "orange",
+    "yellow",
+    "chartreuse",
+    "green",
+    "spring",
+    "cyan",
+    "azure",
+    "blue",
+    "violet",
+    "magenta",
+    "rose",
+    "neutral",
+)
+NEUTRAL_HUE_BUCKET = HUE_BUCKET_NAMES.index("neutral")
+NEUTRAL_MAX_SATURATION = 0.15
+NEUTRAL_MAX_VALUE = 0.12
+
+
+def _kmeans(pixels, k):
+    """
+    Cluster (n, 3) float pixels into at most k centres. Seeded k-means++
+    keeps results reproducible for the same raster.
+    """
+    rng = np.random.default_rng(0)
+    k = min(k, len(np.unique(pixels, axis=0)))
+    centres = np.empty((k, 3))
+    centres[0] = pixels[rng.integers(len(pixels))]
+    closest = ((pixels - centres[0]) ** 2).sum(axis=1)
+    for index in range(1, k):
+        centres[index] = pixels[rng.choice(len(pixels), p=closest / closest.sum())]
+        closest = np.minimum(closest, ((pixels - centres[index]) ** 2).sum(axis=1))
+
+    for _ in range(KMEANS_ITERATIONS):
+        distances = ((pixels[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2)
+        labels = distances.argmin(axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.zeros_like(centres)
+        np.add.at(sums, labels, pixels)
+        occupied = counts > 0
+        updated = centres.copy()
+        updated[occupied] = sums[occupied] / counts[occupied, None]
+        if np.allclose(updated, centres):
+            break
+        centres = updated
+
+    labels = ((pixels[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+    counts = np.bincount(labels, minlength=k)
+    order = np.argsort(-counts, kind="stable")
+    return centres[order][counts[order] > 0]
+
+
+def _hex(colour):
+    red, green, blue = (int(round(channel)) for channel in colour)
+    return f"#{red:02x}{green:02x}{blue:02x}"
+
+
+def extract_palette(pil_img, size=PALETTE_SIZE):
+    """Hex colours of an image's main clusters, most common first."""
+    width, height = pil_img.size
+    factor = min(1.0, PALETTE_SAMPLE_SIDE / max(width, height, 1))
+    sample_size = (max(1, round(width * factor)), max(1, round(height * factor)))
+    with pil_img.resize(sample_size, Image.Resampling.BOX) as sample:
+        with sample.convert("RGB") as rgb:
+            pixels = np.asarray(rgb, dtype=np.float64).reshape(-1, 3)
+    return [_hex(colour) for colour in _kmeans(pixels, size)]
+
+
+def hue_bucket(hex_colour):
+    """Bucket index for a "#rrggbb" colour (see HUE_BUCKET_NAMES)."""
+    red, green, blue = (int(hex_colour[i:i + 2], 16) / 255 for i in (1, 3, 5))
+    hue, saturation, value = colorsys.rgb_to_hsv(red, green, blue)
+    if saturation < NEUTRAL_MAX_SATURATION or value < NEUTRAL_MAX_VALUE:
+        return NEUTRAL_HUE_BUCKET
+    return int((hue * 360 + 15) // 30) % 12
+
+
+def parse_hue_bucket(value):
+    """A bucket index from a name or number, or None if it is not one."""
+    value = (value or "").strip().lower()
+    if value in HUE_BUCKET_NAMES:
+        return HUE_BUCKET_NAMES.index(value)
+    if value.isdigit() and int(value) < len(HUE_BUCKET_NAMES):
+        return int(value)
+    return None
@@ -0,0 +1,164 @@
+import gzip
+import hashlib
+import logging
+import threading
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .variants import SingleFlight
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is offered without it
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+# Bodies are compressed once per catalog version, so both use high levels;
+# Brotli's 10-11 cost seconds on a 200-row page for ~10% fewer bytes.
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+# Like GZipMiddleware, smaller bodies are not worth compressing.
+COMPRESS_MIN_BYTES = 200
+
+api_response_flights = SingleFlight()
+_rebuilding = set()
+_rebuilding_lock = threading.Lock()
+
+
+def api_response_cache_key(request, image_format):
+    """
+    Cache key for one rendered photo API body: the path (API version) and
+    full query string (label, limit, cursor/offset, sort, hue, blur, count,
+    fields, ...) plus everything else the body depends on, the host and
+    scheme its absolute URLs are built from and the negotiated image
+    format. The catalog version is stored in the entry instead, so an
+    outdated body can still be served while a fresh one is rendered.
+    """
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    varies = "|".join(
+        [
+            request.scheme,
+            request.get_host(),
+            request.accepted_renderer.format,
+            image_format,
+            request.path,
+            query,
+        ]
+    )
+    return "photo-api-body:" + hashlib.sha256(varies.encode()).hexdigest()
+
+
+def content_encodings():
+    """Content codings bodies are stored in, best first."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate_content_encoding(accept_encoding):
+    """
+    Pick the best stored content coding Accept-Encoding allows. "*" only
+    stands for codings the header does not list itself, so "br;q=0, *"
+    still refuses br.
+    """
+    qualities = {}
+    for item in (accept_encoding or "").split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+
+    for coding in content_encodings():
+        if qualities.get(coding, qualities.get("*", 0.0)) > 0:
+            return coding
+    return "identity"
+
+
+def compress_api_response(body):
+    """
+    The body keyed by content coding: "identity" plus every stored coding
+    that makes it smaller.
+    """
+    bodies = {"identity": body}
+    if len(body) < COMPRESS_MIN_BYTES:
+        return bodies
+    for coding in content_encodings():
+        if coding == "br":
+            compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+        else:
+            compressed = gzip.compress(body, GZIP_LEVEL, mtime=0)
+        if len(compressed) < len(body):
+            bodies[coding] = compressed
+    return bodies
+
+
+def cached_api_response(key, version, build, stale_for=None):
+    """
+    Return (version, bodies) for key, where build() renders the body for
+    version, the current catalog version, and bodies holds it per content
+    coding (see compress_api_response), so each version is compressed once.
+
+    A body for the current version is served as is. An outdated one is
+    still served (stale-while-revalidate) while a background thread renders
+    its replacement, so visitors do not wait on the rebuild after an edit,
+    as long as the catalog changed at most PHOTO_API_CACHE_STALE_SECONDS ago
+    (stale_for). Older entries and cold keys render in the request.
+    Concurrent renders of the same key and version share one build.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        if entry["version"] == version:
+            return version, entry["bodies"]
+        if (
+            stale_for is not None
+            and stale_for <= settings.PHOTO_API_CACHE_STALE_SECONDS
+        ):
+            schedule_api_response_rebuild(key, version, build)
+            return entry["version"], entry["bodies"]
+    return version, rebuild_api_response(key, version, build)
+
+
+def rebuild_api_response(key, version, build):
+    def fill():
+        bodies = compress_api_response(build())
+        cache.set(
+            key,
+            {"version": version, "bodies": bodies},
+            settings.PHOTO_API_CACHE_SECONDS,
+        )
+        return bodies
+
+    return api_response_flights.do((key, version), fill)
+
+
+def schedule_api_response_rebuild(key, version, build):
+    with _rebuilding_lock:
+        if key in _rebuilding:
+            return
+        _rebuilding.add(key)
+
+    def rebuild():
+        try:
+            rebuild_api_response(key, version, build)
+        except Exception:
+            logger.exception("Unable to refresh cached photo API response")
+        finally:
+            with _rebuilding_lock:
+                _rebuilding.discard(key)
+            connection.close()
+
+    threading.Thread(
+        target=rebuild,
+        name="photo-api-revalidate",
+        daemon=True,
+    ).start()
@@ -0,0 +1,75 @@
+import logging
+import os
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import UploadSession, delete_storage_files
+
+
+logger = logging.getLogger(__name__)
+
+_COPY_BYTES = 64 * 1024
+
+
+def session_spool_path(session):
+    return Path(settings.PHOTO_UPLOAD_SESSION_DIR) / f"{session.pk}.part"
+
+
+def append_chunk(session, offset, stream, length):
+    """
+    Write up to length bytes from stream at offset of the session's spool
+    file and return the new offset. The caller holds the session's row lock
+    and has checked offset against session.offset.
+
+    Anything past offset is dropped first: those bytes belong to a PATCH
+    that was never acknowledged. A chunk cut short by the client keeps what
+    did arrive, and the next PATCH resumes from there.
+    """
+    path = session_spool_path(session)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "r+b" if path.exists() else "wb") as spool:
+        spool.truncate(offset)
+        spool.seek(offset)
+        remaining = length
+        while remaining:
+            block = stream.read(min(_COPY_BYTES, remaining))
+            if not block:
+                break
+            spool.write(block)
+            remaining -= len(block)
+    return offset + length - remaining
+
+
+def discard_spool(session):
+    try:
+        os.remove(session_spool_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def prune_upload_sessions(now=None):
+    """
+    Delete sessions untouched for PHOTO_UPLOAD_SESSION_TTL_SECONDS, with
+    their spool files and any direct-upload objects that were never
+    finalized. Finalized sessions are kept that long too, which is how long
+    an idempotency key can be replayed.
+    """
+    cutoff = (now or timezone.now()) - timedelta(
+        seconds=settings.PHOTO_UPLOAD_SESSION_TTL_SECONDS
+    )
+    expired = list(UploadSession.objects.filter(updated_at__lt=cutoff))
+    for session in expired:
+        discard_spool(session)
+    delete_storage_files(
+        session.storage_name
+        for session in expired
+        if session.storage_name
+        and session.status != UploadSession.Status.FINALIZED
+    )
+    if expired:
+        UploadSession.objects.filter(pk__in=[s.pk for s in expired]).delete()
+        logger.info("Pruned %s expired upload sessions", len(expired))
+    return len(expired)
@@ -1,11 +1,20 @@
 # serializers.py
+import re
+from collections import namedtuple
+
+from django.conf import settings
+from django.utils.encoding import iri_to_uri
 from rest_framework import serializers
-from .models import Photo
+from .derivatives import PREVIEW_MAX_W, THUMB_MAX_W
+from .models import Photo, PhotoRendition, cloudinary_variant_url
 
 class PhotoSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
     thumbnail_url = serializers.SerializerMethodField()
     preview_url = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+    palette = serializers.SerializerMethodField()
+    hue = serializers.CharField(source="get_hue_bucket_display", read_only=True)
     label_title = serializers.CharField(source="label.title", read_only=True)
     label_slug = serializers.CharField(source="label.slug", read_only=True)
     label_order = serializers.IntegerField(source="label.order", read_only=True)
@@ -31,7 +40,12 @@ class PhotoSerializer(serializers.ModelSerializer):
             "image_url",
             "thumbnail_url",
             "preview_url",
+            "srcset",
+            "thumbhash",
             "blur_data_url",
+            "dominant_color",
+            "palette",
+            "hue",
             "label",
             "label_title",
             "label_slug",
@@ -42,6 +56,18 @@ class PhotoSerializer(serializers.ModelSerializer):
             "folder_order",
         ]
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Sparse fieldsets (context "fields", see PhotoList.selected_fields).
+        fields = self.context.get("fields")
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+        # The base64 JPEG placeholder is ~40x the size of the ThumbHash, so
+        # clients have to ask for it (context "include_blur_data_url").
+        elif not self.context.get("include_blur_data_url"):
+            self.fields.pop("blur_data_url", None)
+
     def _abs_url(self, file_field):
         if not file_field:
             return None
@@ -59,8 +85,376 @@ class PhotoSerializer(serializers.ModelSerializer):
     def get_image_url(self, obj):
         return self._abs_url(obj.image)
 
+    def get_palette(self, obj):
+        return obj.palette.split(",") if obj.palette else []
+
+    def _image_format(self):
+        return self.context.get("image_format", "jpeg")
+
+    def _format_renditions(self, obj):
+        if settings.USE_CLOUDINARY or not obj.pk:
+            return []
+        image_format = self._image_format()
+        return sorted(
+            (r for r in obj.renditions.all() if r.format == image_format),
+            key=lambda r: r.width,
+        )
+
+    def _negotiated_derivative_url(self, obj, max_w):
+        """
+        URL of the smallest rendition in the negotiated format that covers
+        the stored JPEG derivative's width, or None to use the JPEG itself.
+        """
+        if self._image_format() == "jpeg":
+            return None
+        renditions = self._format_renditions(obj)
+        if not renditions:
+            return None
+        # Derivatives fit a PREVIEW_MAX_W box; any rendition gives the aspect.
+        aspect = renditions[0].width / renditions[0].height
+        preview_w = int(PREVIEW_MAX_W * min(1.0, aspect))
+        needed_w = min(max_w, preview_w)
+        for rendition in renditions:
+            if rendition.width >= needed_w:
+                return self._abs_url(rendition.file)
+        return None
+
     def get_thumbnail_url(self, obj):
-        return self._abs_url_value(obj.thumbnail_url)
+        return self._negotiated_derivative_url(
+            obj, THUMB_MAX_W
+        ) or self._abs_url_value(obj.thumbnail_url)
 
     def get_preview_url(self, obj):
-        return self._abs_url_value(obj.preview_url)
+        return self._negotiated_derivative_url(
+            obj, PREVIEW_MAX_W
+        ) or self._abs_url_value(obj.preview_url)
+
+    def _variant_srcset(self, obj):
+        image_format = self._image_format()
+        entries = []
+        for width in sorted(settings.PHOTO_RENDITION_WIDTHS):
+            url = obj.variant_url(width, 0, image_format)
+            if url:
+                entries.append(
+                    {
+                        "url": self._abs_url_value(url),
+                        "width": width,
+                        "height": None,
+                        "bytes": None,
+                        "format": image_format,
+                    }
+                )
+        return entries
+
+    def get_srcset(self, obj):
+        """
+        Stored ladder widths in the negotiated format, smallest first, ready
+        for an img srcset. Photos without renditions in that format (older
+        uploads, formats added later) fall back to their JPEG ladder, and
+        photos still waiting for derivatives to on-demand variant URLs.
+        """
+        if settings.USE_CLOUDINARY:
+            original_url = obj._field_url(obj.image)
+            if not original_url:
+                return []
+            return [
+                {
+                    "url": cloudinary_variant_url(original_url, width),
+                    "width": width,
+                    "height": None,
+                    "bytes": None,
+                    "format": "auto",
+                }
+                for width in sorted(settings.PHOTO_RENDITION_WIDTHS)
+            ]
+
+        renditions = self._format_renditions(obj)
+        if not renditions and self._image_format() != "jpeg":
+            renditions = sorted(
+                (r for r in obj.renditions.all() if r.format == "jpeg"),
+                key=lambda r: r.width,
+            )
+        if not renditions and not obj.thumb:
+            # Derivatives have not been generated yet; render on demand.
+            return self._variant_srcset(obj)
+        return [
+            {
+                "url": self._abs_url(rendition.file),
+                "width": rendition.width,
+                "height": rendition.height,
+                "bytes": rendition.size,
+                "format": rendition.format,
+            }
+            for rendition in renditions
+        ]
+
+
+# PhotoSerializer's fields in output order, with the Photo columns each
+# one reads (values() / only() names).
+PHOTO_FIELDS = {
+    "id": ("id",),
+    "title": ("title",),
+    "description": ("description",),
+    "category": ("category",),
+    "created_at": ("created_at",),
+    "order": ("order",),
+    "aperture": ("aperture",),
+    "iso": ("iso",),
+    "shutter_speed": ("shutter_speed",),
+    "image_url": ("image",),
+    "thumbnail_url": ("image", "thumb"),
+    "preview_url": ("image", "preview"),
+    "srcset": ("image", "thumb"),
+    "thumbhash": ("thumbhash",),
+    "blur_data_url": ("blur_data_url",),
+    "dominant_color": ("dominant_color",),
+    "palette": ("palette",),
+    "hue": ("hue_bucket",),
+    "label": ("label",),
+    "label_title": ("label", "label__title"),
+    "label_slug": ("label", "label__slug"),
+    "label_order": ("label", "label__order"),
+    "folder": ("label",),
+    "folder_title": ("label", "label__title"),
+    "folder_slug": ("label", "label__slug"),
+    "folder_order": ("label", "label__order"),
+}
+LEGACY_ALIAS_FIELDS = ("folder", "folder_title", "folder_slug", "folder_order")
+# Fields that need the photo's renditions.
+RENDITION_FIELDS = frozenset(["thumbnail_url", "preview_url", "srcset"])
+
+
+def default_photo_fields(include_blur_data_url=False, legacy_aliases=True):
+    return [
+        name
+        for name in PHOTO_FIELDS
+        if (name != "blur_data_url" or include_blur_data_url)
+        and (legacy_aliases or name not in LEGACY_ALIAS_FIELDS)
+    ]
+
+
+def photo_columns(fields):
+    """Columns to load for these output fields; rows always carry the id."""
+    columns = ["id"]
+    for name in fields:
+        for column in PHOTO_FIELDS[name]:
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+_Rendition = namedtuple("_Rendition", "width height format size file")
+_SKIP = object()
+# Storage names no storage quotes or normalises: word segments joined by
+# single dots and slashes.
+_PLAIN_NAME = re.compile(r"[\w-]+(?:[./][\w-]+)*\Z", re.ASCII)
+_URL_PROBE = "url-probe/photo.jpg"
+
+
+class PhotoRowSerializer:
+    """
+    PhotoSerializer for values() rows from PhotoList: the same keys in the
+    same order with the same values, so the rendered JSON is identical, but
+    without model instances, DRF field lookups or a build_absolute_uri()
+    call per URL. Renditions come from one values_list() query, like the
+    prefetch they replace, and only when a field needs them. Context
+    "fields" narrows the output like PhotoSerializer's. Cloudinary URLs
+    are left to PhotoSerializer.
+
+    Each storage's URL prefix is resolved once, so plain names skip
+    storage.url(), which for S3 runs botocore's presigner every call.
+    """
+
+    def __init__(self, rows, context=None):
+        self.rows = rows
+        self.context = context or {}
+        self.request = self.context.get("request")
+        self.image_format = self.context.get("image_format", "jpeg")
+        fields = self.context.get("fields")
+        if fields is None:
+            fields = default_photo_fields(
+                self.context.get("include_blur_data_url", False)
+            )
+        self.getters = [(name, self._getter(name)) for name in fields]
+        self.with_renditions = not RENDITION_FIELDS.isdisjoint(fields)
+        if self.request is not None:
+            self.scheme_host = f"{self.request.scheme}://{self.request.get_host()}"
+        self.created_at = serializers.DateTimeField()
+        self.hue_names = dict(Photo._meta.get_field("hue_bucket").flatchoices)
+        self.image_storage = Photo._meta.get_field("image").storage
+        self.thumb_storage = Photo._meta.get_field("thumb").storage
+        self.preview_storage = Photo._meta.get_field("preview").storage
+        self.rendition_storage = PhotoRendition._meta.get_field("file").storage
+        self.url_prefixes = {}
+
+    @property
+    def data(self):
+        renditions = self._renditions() if self.with_renditions else {}
+        return [
+            self.to_representation(row, renditions.get(row["id"], ()))
+            for row in self.rows
+        ]
+
+    def _renditions(self):
+        ids = [row["id"] for row in self.rows]
+        if not ids:
+            return {}
+        by_photo = {}
+        for photo_id, *fields in PhotoRendition.objects.filter(
+            photo_id__in=ids
+        ).values_list("photo_id", "width", "height", "format", "size", "file"):
+            by_photo.setdefault(photo_id, []).append(_Rendition(*fields))
+        return by_photo
+
+    def to_representation(self, row, renditions):
+        data = {}
+        for name, getter in self.getters:
+            value = getter(row, renditions)
+            if value is not _SKIP:
+                data[name] = value
+        return data
+
+    def _getter(self, name):
+        getter = getattr(self, f"get_{name}", None)
+        if getter is not None:
+            return getter
+        column = PHOTO_FIELDS[name][-1]
+        if column.startswith("label__"):
+            # DRF skips "label.*" sources entirely for photos without a label.
+            return lambda row, renditions: (
+                _SKIP if row["label"] is None else row[column]
+            )
+        return lambda row, renditions: row[column]
+
+    def get_created_at(self, row, renditions):
+        created_at = row["created_at"]
+        if created_at is None:
+            return None
+        return self.created_at.to_representation(created_at)
+
+    def get_image_url(self, row, renditions):
+        return self._abs_url(self._url(self.image_storage, row["image"]))
+
+    def get_thumbnail_url(self, row, renditions):
+        return self._derivative_url(row, renditions, "thumb", THUMB_MAX_W)
+
+    def get_preview_url(self, row, renditions):
+        return self._derivative_url(row, renditions, "preview", PREVIEW_MAX_W)
+
+    def get_palette(self, row, renditions):
+        return row["palette"].split(",") if row["palette"] else []
+
+    def get_hue(self, row, renditions):
+        # get_hue_bucket_display(): unknown buckets show the raw value.
+        hue_bucket = row["hue_bucket"]
+        if hue_bucket is None:
+            return None
+        return str(self.hue_names.get(hue_bucket, hue_bucket))
+
+    def _url(self, storage, name):
+        if not name:
+            return ""
+        prefix = self._url_prefix(storage)
+        if prefix is not None and _PLAIN_NAME.match(name):
+            return prefix + name
+        return storage.url(name)
+
+    def _url_prefix(self, storage):
+        """What storage.url() puts before a plain name, if it only prefixes."""
+        key = id(storage)
+        if key not in self.url_prefixes:
+            url = storage.url(_URL_PROBE)
+            self.url_prefixes[key] = (
+                url[: -len(_URL_PROBE)] if url.endswith(_URL_PROBE) else None
+            )
+        return self.url_prefixes[key]
+
+    def _abs_url(self, url):
+        if not url:
+            return None
+        if self.request is None:
+            return url
+        # build_absolute_uri()'s own shortcuts, with the scheme and host once.
+        if url.startswith(("https://", "http://")) and not url.startswith(
+            ("https:///", "http:///")
+        ):
+            return iri_to_uri(url)
+        if (
+            url.startswith("/")
+            and not url.startswith("//")
+            and "/./" not in url
+            and "/../" not in url
+        ):
+            return iri_to_uri(self.scheme_host + url)
+        return self.request.build_absolute_uri(url)
+
+    @staticmethod
+    def _variant_url(row, width, height, image_format="jpeg"):
+        # Only photos still waiting for derivatives get here.
+        return Photo(pk=row["id"], image=row["image"]).variant_url(
+            width, height, image_format
+        )
+
+    def _format_renditions(self, renditions, image_format):
+        return sorted(
+            (r for r in renditions if r.format == image_format),
+            key=lambda r: r.width,
+        )
+
+    def _derivative_url(self, row, renditions, field, max_w):
+        """thumbnail_url / preview_url, as Photo's properties build them."""
+        url = self._negotiated_derivative_url(renditions, max_w)
+        if url:
+            return url
+        storage = self.thumb_storage if field == "thumb" else self.preview_storage
+        url = self._url(storage, row[field])
+        if not url:
+            height = PREVIEW_MAX_W if field == "preview" else 0
+            url = self._variant_url(row, max_w, height) or self._url(
+                self.image_storage, row["image"]
+            )
+        return self._abs_url(url)
+
+    def _negotiated_derivative_url(self, renditions, max_w):
+        if self.image_format == "jpeg":
+            return None
+        renditions = self._format_renditions(renditions, self.image_format)
+        if not renditions:
+            return None
+        aspect = renditions[0].width / renditions[0].height
+        preview_w = int(PREVIEW_MAX_W * min(1.0, aspect))
+        needed_w = min(max_w, preview_w)
+        for rendition in renditions:
+            if rendition.width >= needed_w:
+                return self._abs_url(self._url(self.rendition_storage, rendition.file))
+        return None
+
+    def get_srcset(self, row, renditions):
+        formatted = self._format_renditions(renditions, self.image_format)
+        if not formatted and self.image_format != "jpeg":
+            formatted = self._format_renditions(renditions, "jpeg")
+        if not formatted and not row["thumb"]:
+            entries = []
+            for width in sorted(settings.PHOTO_RENDITION_WIDTHS):
+                url = self._variant_url(row, width, 0, self.image_format)
+                if url:
+                    entries.append(
+                        {
+                            "url": self._abs_url(url),
+                            "width": width,
+                            "height": None,
+                            "bytes": None,
+                            "format": self.image_format,
+                        }
+                    )
+            return entries
+        return [
+            {
+                "url": self._abs_url(self._url(self.rendition_storage, r.file)),
+                "width": r.width,
+                "height": r.height,
+                "bytes": r.size,
+                "format": r.format,
+            }
+            for r in formatted
+        ]
@@ -1,23 +1,104 @@
+import base64
+import gzip
+import hashlib
+import importlib
 import io
+import json
+import os
 import shutil
 import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from unittest import skipUnless
 from unittest.mock import patch
 
+import boto3
+
+from django.apps import apps as django_apps
+from django.contrib import admin as django_admin
 from django.contrib.auth import get_user_model
-from django.db import OperationalError
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import OperationalError, connection, models, transaction
+from django.core.files.storage import FileSystemStorage, default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase, override_settings
+from django.core.files.uploadhandler import StopUpload
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from PIL import ExifTags, Image
-
-from .forms import MAX_UPLOAD_BYTES, BulkPhotoUploadForm, PhotoForm
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+try:
+    # Only the S3 round-trip test needs these; moto brings requests along.
+    import requests
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+from .admin import DerivativeJobAdmin
+from .admission import (
+    ImageProcessingBusy,
+    MemoryBudget,
+    estimate_resize_bytes,
+    jpeg_draft_size,
+)
+from .derivatives import (
+    negotiate_image_format,
+    render_photo_derivatives,
+    render_variant,
+)
+from .exif import (
+    extract_camera_settings,
+    extract_photo_metadata,
+    read_photo_metadata,
+)
+from .fingerprints import PerceptualHashIndex
+from .storage_ranges import PrefixReader
+from .renderers import FastJSONRenderer
+from .response_cache import (
+    api_response_cache_key,
+    brotli,
+    cached_api_response,
+    negotiate_content_encoding,
+    rebuild_api_response,
+)
+from .resumable import prune_upload_sessions
+from .palette import HUE_BUCKET_NAMES, extract_palette, hue_bucket
+from .thumbhash import image_to_thumbhash
+from .upload_handlers import StreamingImageUploadHandler
+from .variants import DiskLRUCache, SingleFlight
+from .forms import (
+    JPEG_UPLOAD_QUALITIES,
+    MAX_UPLOAD_BYTES,
+    BulkPhotoUploadForm,
+    PhotoForm,
+    _encode_jpeg,
+    prepare_uploaded_image_for_storage,
+    validate_uploaded_image,
+)
 from .models import (
+    DerivativeJob,
     Label,
     Photo,
+    PhotoRendition,
+    UploadSession,
+    bump_catalog_version,
+    catalog_version,
+    claim_derivative_job,
     cloudinary_variant_url,
-    extract_camera_settings,
     generate_photo_derivatives,
+    photo_processing_states,
+    process_derivative_jobs,
+    schedule_photo_derivative_generation,
 )
+from .serializer import PhotoRowSerializer, PhotoSerializer
+from .views import PhotoList, _normalize_order
 
 
 def image_upload(name="photo.jpg", image_format="JPEG", size=(32, 32), exif=None):
@@ -41,6 +122,15 @@ def image_upload(name="photo.jpg", image_format="JPEG", size=(32, 32), exif=None
     )
 
 
+def gradient_upload(name="gradient.jpg", quality=90, rotate=False):
+    output = io.BytesIO()
+    gradient = Image.linear_gradient("L").resize((320, 240))
+    if rotate:
+        gradient = gradient.transpose(Image.Transpose.ROTATE_90).resize((320, 240))
+    gradient.convert("RGB").save(output, format="JPEG", quality=quality)
+    return SimpleUploadedFile(name, output.getvalue(), content_type="image/jpeg")
+
+
 def noisy_image_upload(name="large-photo.jpg", size=(1000, 800), exif=None):
     output = io.BytesIO()
     save_kwargs = {"quality": 100}
@@ -65,6 +155,7 @@ def noisy_image_upload(name="large-photo.jpg", size=(1000, 800), exif=None):
 class PhotoSecurityTests(TestCase):
     def setUp(self):
         super().setUp()
+        cache.clear()
         self.media_root = tempfile.mkdtemp()
         self.media_override = override_settings(MEDIA_ROOT=self.media_root)
         self.media_override.enable()
@@ -247,6 +338,69 @@ class PhotoSecurityTests(TestCase):
         self.assertEqual(photo.iso, "400")
         self.assertEqual(photo.shutter_speed, "1/250")
 
+    def test_metadata_reader_parses_jpeg_headers_without_pillow(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotated 90 degrees
+        camera_ifd = exif.get_ifd(ExifTags.IFD.Exif)
+        camera_ifd.update(
+            {
+                0x829A: (1, 500),  # ExposureTime
+                0x829D: (18, 10),  # FNumber
+                0x8827: 1600,  # ISOSpeedRatings
+                0x920A: (35, 1),  # FocalLength
+                0xA434: "XF35mmF1.4 R",  # LensModel
+                0x9003: "2024:06:01 18:30:05",  # DateTimeOriginal
+                0x9011: "+02:00",  # OffsetTimeOriginal
+            }
+        )
+        output = io.BytesIO()
+        Image.new("RGB", (60, 40), "white").save(output, format="JPEG", exif=exif)
+
+        with patch("portfolio.exif.Image.open") as pillow_open:
+            metadata = read_photo_metadata(output)
+
+        pillow_open.assert_not_called()
+        self.assertEqual(output.tell(), 0)
+        self.assertEqual(
+            metadata,
+            {
+                "aperture": "f/1.8",
+                "iso": "1600",
+                "shutter_speed": "1/500",
+                "f_number": 1.8,
+                "iso_speed": 1600,
+                "exposure_seconds": 0.002,
+                "focal_length_mm": 35.0,
+                "lens_model": "XF35mmF1.4 R",
+                "captured_at": datetime(2024, 6, 1, 16, 30, 5, tzinfo=dt_timezone.utc),
+                "width": 40,
+                "height": 60,
+            },
+        )
+        with Image.open(output) as pil_image:
+            self.assertEqual(extract_photo_metadata(pil_image), metadata)
+
+    def test_photo_save_stores_numeric_exif_columns(self):
+        for name, iso, f_number in (("low", 100, (40, 10)), ("high", 3200, (14, 10))):
+            Photo.objects.create(
+                title=name,
+                description="",
+                image=image_upload(
+                    f"{name}.jpg",
+                    size=(48, 32),
+                    exif={34855: iso, 33437: f_number, 37386: (50, 1)},
+                ),
+            )
+
+        fast = Photo.objects.get(f_number__lt=2, iso_speed__gte=800)
+        self.assertEqual(fast.title, "high")
+        self.assertEqual((fast.width, fast.height), (48, 32))
+        self.assertEqual(fast.focal_length_mm, 50.0)
+        self.assertEqual(
+            list(Photo.objects.order_by("iso_speed").values_list("title", flat=True)),
+            ["low", "high"],
+        )
+
     def test_photo_save_extracts_modern_camera_setting_fallbacks(self):
         photo = Photo.objects.create(
             title="Modern EXIF",
@@ -273,6 +427,131 @@ class PhotoSecurityTests(TestCase):
         self.assertTrue(form.is_valid(), form.errors)
         self.assertEqual(len(form.cleaned_data["images"]), 2)
 
+    def test_upload_validation_ingests_each_image_once(self):
+        upload = image_upload(
+            "ingest.jpg",
+            size=(40, 30),
+            exif={33437: (28, 10), 34855: 400},
+        )
+
+        with patch("portfolio.ingest.Image.open", wraps=Image.open) as opened:
+            validate_uploaded_image(upload)
+
+        self.assertEqual(opened.call_count, 1)
+        ingested = upload.ingested
+        self.assertEqual(
+            (ingested.format, ingested.width, ingested.height, ingested.mode),
+            ("JPEG", 40, 30, "RGB"),
+        )
+        self.assertEqual(ingested.metadata["aperture"], "f/2.8")
+        self.assertEqual(ingested.metadata["iso"], "400")
+        self.assertFalse(ingested.has_icc_profile)
+        self.assertEqual(len(ingested.content_sha256), 64)
+        self.assertEqual(upload.tell(), 0)
+
+    def test_upload_validation_does_not_decode_png_pixels(self):
+        upload = image_upload("large.png", image_format="PNG", size=(400, 300))
+
+        with patch(
+            "PIL.PngImagePlugin.PngImageFile.load",
+            side_effect=AssertionError("pixels decoded"),
+        ):
+            validate_uploaded_image(upload)
+
+        ingested = upload.ingested
+        self.assertEqual((ingested.format, ingested.width), ("PNG", 400))
+        self.assertIsNone(ingested.perceptual_hash)
+        self.assertEqual(len(ingested.content_sha256), 64)
+
+    def test_upload_validation_rejects_corrupt_png(self):
+        data = bytearray(image_upload("photo.png", image_format="PNG").read())
+        idat = data.index(b"IDAT")
+        data[idat + 6] ^= 0xFF
+
+        with self.assertRaises(ValidationError):
+            validate_uploaded_image(SimpleUploadedFile("photo.png", bytes(data)))
+
+    @patch("portfolio.views.schedule_photo_derivative_generation")
+    def test_bulk_upload_reuses_ingested_image(self, schedule_derivatives):
+        self.login_staff()
+
+        reopened = AssertionError("upload reopened")
+        with patch(
+            "portfolio.models.read_photo_metadata", side_effect=reopened
+        ), patch("portfolio.models.fingerprint_file", side_effect=reopened):
+            response = self.client.post(
+                reverse("upload_photo"),
+                data={"images": [image_upload("once.jpg", exif={34855: 200})]},
+                secure=True,
+            )
+
+        self.assertEqual(response.status_code, 302)
+        photo = Photo.objects.get()
+        self.assertEqual(photo.iso, "200")
+        self.assertEqual(len(photo.content_sha256), 64)
+        self.assertIsNotNone(photo.perceptual_hash)
+
+    @override_settings(PHOTO_UPLOAD_MEMORY_CEILING=4096)
+    def test_upload_handler_hashes_and_spools_past_memory_ceiling(self):
+        request = RequestFactory().post("/upload/")
+        handler = StreamingImageUploadHandler(request)
+        small = image_upload("small.jpg").read()
+        large = noisy_image_upload(size=(200, 150)).read()
+        uploads = []
+        for name, data in (("small.jpg", small), ("large.jpg", large)):
+            handler.new_file("images", name, "image/jpeg", len(data))
+            for start in range(0, len(data), 1024):
+                handler.receive_data_chunk(data[start:start + 1024], start)
+            uploads.append(handler.file_complete(len(data)))
+
+        self.assertIsInstance(uploads[0].file, io.BytesIO)
+        self.assertNotIsInstance(uploads[1].file, io.BytesIO)
+        for upload, data in zip(uploads, (small, large)):
+            self.assertEqual(upload.read(), data)
+            self.assertEqual(upload.content_sha256, hashlib.sha256(data).hexdigest())
+            self.assertEqual(upload.sniffed_format, "JPEG")
+            upload.close()
+
+    def test_upload_handler_stops_reading_non_images(self):
+        request = RequestFactory().post("/upload/")
+        handler = StreamingImageUploadHandler(request)
+        handler.new_file("images", "notes.gif", "image/gif", None)
+
+        with self.assertRaises(StopUpload) as stopped:
+            handler.receive_data_chunk(image_upload("a.gif", "GIF").read(), 0)
+
+        self.assertTrue(stopped.exception.connection_reset)
+        self.assertIn("notes.gif", request.upload_rejection)
+
+    @patch("portfolio.views.schedule_photo_derivative_generation")
+    def test_bulk_upload_reuses_streamed_hash(self, schedule_derivatives):
+        self.login_staff()
+        upload = image_upload("streamed.jpg")
+        expected = hashlib.sha256(upload.read()).hexdigest()
+        upload.seek(0)
+
+        with patch("portfolio.ingest.sha256_file") as sha256_file:
+            response = self.client.post(
+                reverse("upload_photo"), data={"images": [upload]}, secure=True
+            )
+
+        self.assertEqual(response.status_code, 302)
+        sha256_file.assert_not_called()
+        self.assertEqual(Photo.objects.get().content_sha256, expected)
+
+    def test_bulk_upload_reports_rejected_stream(self):
+        self.login_staff()
+
+        response = self.client.post(
+            reverse("upload_photo"),
+            data={"images": [image_upload("first.jpg"), image_upload("b.gif", "GIF")]},
+            secure=True,
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "b.gif: Only JPEG, PNG, and WebP")
+        self.assertFalse(Photo.objects.exists())
+
     @patch("portfolio.views.schedule_photo_derivative_generation")
     def test_staff_can_bulk_upload_photos(self, schedule_derivatives):
         label = Label.objects.create(title="Japan", slug="japan", order=4)
@@ -360,20 +639,116 @@ class PhotoSecurityTests(TestCase):
             self.assertLessEqual(max(thumbnail_image.size), 800)
         photo.thumb.close()
 
+    def test_thumbhash_encodes_average_colour_and_aspect(self):
+        encoded = base64.b64decode(
+            image_to_thumbhash(Image.new("RGB", (200, 100), (40, 120, 200)))
+        )
+
+        self.assertLessEqual(len(encoded), 25)
+        header = encoded[0] | encoded[1] << 8 | encoded[2] << 16
+        luminance = (header & 63) / 63
+        yellow_blue = ((header >> 6) & 63) / 31.5 - 1
+        red_green = ((header >> 12) & 63) / 31.5 - 1
+        blue = luminance - 2 / 3 * yellow_blue
+        red = (3 * luminance - blue + red_green) / 2
+        green = red - red_green
+        for decoded, expected in zip((red, green, blue), (40, 120, 200)):
+            self.assertAlmostEqual(decoded * 255, expected, delta=6)
+        self.assertTrue(encoded[4] >> 7, "landscape flag")
+        self.assertFalse(header >> 23, "no alpha")
+
+    def test_api_serves_thumbhash_and_blur_data_url_on_request(self):
+        photo = Photo(title="Placeholder", description="", image=image_upload())
+        photo._defer_derivatives = True
+        photo.save()
+        generate_photo_derivatives([photo.pk])
+        photo.refresh_from_db()
+        self.assertTrue(photo.thumbhash)
+
+        url = reverse("photo_list_api")
+        default = self.client.get(url, secure=True).json()["results"][0]
+        self.assertEqual(default["thumbhash"], photo.thumbhash)
+        self.assertNotIn("blur_data_url", default)
+
+        opted_in = self.client.get(f"{url}?blur=1", secure=True).json()["results"][0]
+        self.assertEqual(opted_in["blur_data_url"], photo.blur_data_url)
+
+    def test_thumbhash_migration_reads_thumbs_not_originals(self):
+        photo = Photo(title="Legacy", description="", image=image_upload(size=(400, 300)))
+        photo._defer_derivatives = True
+        photo.save()
+        generate_photo_derivatives([photo.pk])
+        photo.refresh_from_db()
+        expected = photo.thumbhash
+        Photo.objects.filter(pk=photo.pk).update(thumbhash="")
+        photo.image.storage.delete(photo.image.name)
+
+        migration = importlib.import_module(
+            "portfolio.migrations.0016_backfill_thumbhash"
+        )
+        migration.backfill_thumbhash(django_apps, None)
+
+        photo.refresh_from_db()
+        self.assertTrue(photo.thumbhash)
+        # The thumb is a downscaled copy, so the hash barely moves.
+        self.assertEqual(photo.thumbhash[:4], expected[:4])
+
+    def test_palette_lists_dominant_colour_first(self):
+        image = Image.new("RGB", (100, 100), (200, 30, 30))
+        image.paste((128, 128, 128), (0, 0, 100, 30))
+
+        palette = extract_palette(image)
+
+        self.assertEqual(len(palette), 2)
+        self.assertEqual(palette[0], "#c81e1e")
+        self.assertEqual(hue_bucket(palette[0]), HUE_BUCKET_NAMES.index("red"))
+        self.assertEqual(hue_bucket(palette[1]), HUE_BUCKET_NAMES.index("neutral"))
+        self.assertEqual(hue_bucket("#1e3cc8"), HUE_BUCKET_NAMES.index("blue"))
+
+    def test_api_filters_and_sorts_by_hue(self):
+        ids = {}
+        for name, colour in (("red", "#c81e1e"), ("blue", "#1e3cc8")):
+            output = io.BytesIO()
+            Image.new("RGB", (64, 48), colour).save(output, format="JPEG")
+            photo = Photo(
+                title=name,
+                description="",
+                image=SimpleUploadedFile(f"{name}.jpg", output.getvalue()),
+            )
+            photo._defer_derivatives = True
+            photo.save()
+            ids[name] = photo.pk
+        generate_photo_derivatives(list(ids.values()))
+
+        url = reverse("photo_list_api")
+        blue = self.client.get(f"{url}?hue=blue", secure=True).json()["results"]
+        self.assertEqual([row["id"] for row in blue], [ids["blue"]])
+        self.assertEqual(blue[0]["hue"], "blue")
+        self.assertEqual(blue[0]["dominant_color"], blue[0]["palette"][0])
+        self.assertEqual(
+            self.client.get(f"{url}?hue=8", secure=True).json()["results"], blue
+        )
+        self.assertEqual(
+            self.client.get(f"{url}?hue=plaid", secure=True).json()["results"], []
+        )
+
+        by_hue = self.client.get(f"{url}?sort=hue", secure=True).json()["results"]
+        self.assertEqual([row["id"] for row in by_hue], [ids["red"], ids["blue"]])
+
     @patch("portfolio.views.schedule_photo_derivative_generation")
     def test_bulk_upload_continues_after_one_file_fails(
         self,
         schedule_derivatives,
     ):
         self.login_staff()
-        original_save = Photo.save
+        original_save = FileSystemStorage.save
 
-        def fail_one_upload(photo, *args, **kwargs):
-            if photo.title == "Broken":
+        def fail_one_upload(storage, name, *args, **kwargs):
+            if "broken" in name:
                 raise OSError("storage unavailable")
-            return original_save(photo, *args, **kwargs)
+            return original_save(storage, name, *args, **kwargs)
 
-        with patch.object(Photo, "save", new=fail_one_upload):
+        with patch.object(FileSystemStorage, "save", new=fail_one_upload):
             response = self.client.post(
                 reverse("upload_photo"),
                 data={
@@ -393,6 +768,166 @@ class PhotoSecurityTests(TestCase):
         self.assertContains(response, "Could not upload 1 file: broken.jpg.")
         schedule_derivatives.assert_called_once()
 
+    @patch("portfolio.views.schedule_photo_derivative_generation")
+    def test_bulk_upload_writes_originals_concurrently_in_one_insert(
+        self,
+        schedule_derivatives,
+    ):
+        self.login_staff()
+        label = Label.objects.create(title="Batch", slug="batch")
+        Photo.objects.bulk_create(
+            [
+                Photo(
+                    title="Existing",
+                    description="",
+                    label=label,
+                    image="photos/a.jpg",
+                    order=1,
+                )
+            ]
+        )
+        original_save = FileSystemStorage.save
+        # Fails unless all three writes are in flight at once.
+        all_writing = threading.Barrier(3, timeout=10)
+
+        def save_together(storage, name, *args, **kwargs):
+            all_writing.wait()
+            return original_save(storage, name, *args, **kwargs)
+
+        def upload(count):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(
+                    reverse("upload_photo"),
+                    data={
+                        "label": label.pk,
+                        "images": [
+                            noisy_image_upload(f"frame-{count}-{index}.jpg", (64, 48))
+                            for index in range(count)
+                        ],
+                    },
+                    secure=True,
+                )
+            return len(queries)
+
+        single_batch_queries = upload(1)
+        with patch.object(FileSystemStorage, "save", new=save_together):
+            triple_batch_queries = upload(3)
+
+        self.assertEqual(triple_batch_queries, single_batch_queries)
+        orders = list(
+            Photo.objects.filter(label=label)
+            .order_by("order")
+            .values_list("title", "order")
+        )
+        self.assertEqual(
+            orders,
+            [
+                ("Existing", 1),
+                ("Frame 1 0", 2),
+                ("Frame 3 0", 3),
+                ("Frame 3 1", 4),
+                ("Frame 3 2", 5),
+            ],
+        )
+
+    @patch("portfolio.views.schedule_photo_derivative_generation")
+    def test_bulk_upload_skips_exact_duplicates(self, schedule_derivatives):
+        self.login_staff()
+        upload_url = reverse("upload_photo")
+        self.client.post(
+            upload_url,
+            data={"images": [gradient_upload("R1-05715-0019.jpg")]},
+            secure=True,
+        )
+        original = Photo.objects.get()
+        self.assertEqual(len(original.content_sha256), 64)
+        self.assertIsNotNone(original.perceptual_hash)
+
+        response = self.client.post(
+            upload_url,
+            data={
+                "images": [
+                    gradient_upload("R1-05715-0019_glTBtSy.jpg"),
+                    gradient_upload("other.jpg", rotate=True),
+                    gradient_upload("other-copy.jpg", rotate=True),
+                ],
+            },
+            secure=True,
+            follow=True,
+        )
+
+        self.assertEqual(Photo.objects.count(), 2)
+        self.assertContains(
+            response,
+            "Skipped 2 duplicate files: R1-05715-0019_glTBtSy.jpg "
+            "(already uploaded as &quot;R1 05715 0019&quot;), other-copy.jpg",
+        )
+        self.assertEqual(len(schedule_derivatives.call_args.args[0]), 1)
+
+    @patch("portfolio.views.schedule_photo_derivative_generation")
+    def test_bulk_upload_reports_near_duplicates(self, schedule_derivatives):
+        self.login_staff()
+        upload_url = reverse("upload_photo")
+        self.client.post(
+            upload_url,
+            data={"images": [gradient_upload("original.jpg", quality=95)]},
+            secure=True,
+        )
+
+        response = self.client.post(
+            upload_url,
+            data={"images": [gradient_upload("recompressed.jpg", quality=60)]},
+            secure=True,
+            follow=True,
+        )
+
+        self.assertEqual(Photo.objects.count(), 2)
+        self.assertContains(
+            response,
+            "Possible near-duplicate: recompressed.jpg looks like &quot;Original&quot;.",
+        )
+
+    def test_fingerprints_are_backfilled_with_derivatives(self):
+        photo = Photo(title="Old", description="", image=gradient_upload("old.jpg"))
+        photo._defer_derivatives = True
+        photo.save()
+        expected = (photo.content_sha256, photo.perceptual_hash)
+        Photo.objects.filter(pk=photo.pk).update(
+            content_sha256="",
+            perceptual_hash=None,
+        )
+
+        generate_photo_derivatives([photo.pk])
+
+        photo.refresh_from_db()
+        self.assertEqual((photo.content_sha256, photo.perceptual_hash), expected)
+
+    def test_png_perceptual_hash_is_left_to_derivative_job(self):
+        upload = image_upload("flat.png", image_format="PNG", size=(64, 48))
+        with patch(
+            "PIL.PngImagePlugin.PngImageFile.load",
+            side_effect=AssertionError("pixels decoded"),
+        ):
+            photo = Photo(title="Flat", description="", image=upload)
+            photo._defer_derivatives = True
+            photo.save()
+
+        self.assertEqual(len(photo.content_sha256), 64)
+        self.assertIsNone(photo.perceptual_hash)
+        self.assertTrue(photo.derivative_task()["fingerprint"])
+
+        generate_photo_derivatives([photo.pk])
+
+        photo.refresh_from_db()
+        self.assertIsNotNone(photo.perceptual_hash)
+
+    def test_perceptual_hash_index_finds_closest_within_distance(self):
+        index = PerceptualHashIndex([("a", 0b1111), ("b", -1)])
+
+        self.assertEqual(index.nearest(0b0111, max_distance=2), "a")
+        self.assertEqual(index.nearest(-2, max_distance=2), "b")
+        self.assertIsNone(index.nearest(1 << 40 | 0xFF00, max_distance=2))
+
     @override_settings(
         USE_CLOUDINARY=True,
         CLOUDINARY_MAX_IMAGE_BYTES=120 * 1024,
@@ -440,6 +975,38 @@ class PhotoSecurityTests(TestCase):
         self.assertContains(response, "Optimized 1 oversized photo for Cloudinary.")
         schedule_derivatives.assert_not_called()
 
+    def test_storage_optimization_binary_searches_quality(self):
+        upload = noisy_image_upload(size=(2400, 1600))
+        max_bytes = 400 * 1024
+        encodes = []
+
+        def counting_encode(pil_image, quality, exif_bytes=b""):
+            encoded = _encode_jpeg(pil_image, quality, exif_bytes)
+            encodes.append((pil_image.size, quality, len(encoded)))
+            return encoded
+
+        with patch("portfolio.forms._encode_jpeg", side_effect=counting_encode):
+            optimized, _, was_optimized = prepare_uploaded_image_for_storage(
+                upload, max_bytes=max_bytes, max_pixels=600_000
+            )
+
+        self.assertTrue(was_optimized)
+        target_bytes = max_bytes - max_bytes // 20
+        self.assertLessEqual(optimized.size, target_bytes)
+        with Image.open(optimized) as stored:
+            self.assertLessEqual(stored.width * stored.height, 600_000)
+            full_size = stored.size
+        full_encodes = [entry for entry in encodes if entry[0] == full_size]
+        self.assertLessEqual(len(full_encodes), 3)
+        # The stored quality is the highest that fits, as a linear scan
+        # over JPEG_UPLOAD_QUALITIES would pick.
+        sizes = {quality: size for _, quality, size in full_encodes}
+        best = max(quality for quality, size in sizes.items() if size <= target_bytes)
+        self.assertEqual(optimized.size, sizes[best])
+        if best != JPEG_UPLOAD_QUALITIES[-1]:
+            higher = JPEG_UPLOAD_QUALITIES[JPEG_UPLOAD_QUALITIES.index(best) + 1]
+            self.assertGreater(sizes[higher], target_bytes)
+
     def test_staff_can_remove_photo_from_folder(self):
         label = Label.objects.create(title="Japan", slug="japan", order=4)
         photo = Photo.objects.create(
@@ -648,3 +1215,1781 @@ class PhotoSecurityTests(TestCase):
             photo.delete()
 
         self.assertFalse(Photo.objects.filter(id=photo_id).exists())
+
+
+class DerivativeJobQueueTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.media_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_override.enable()
+        self.addCleanup(self.media_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+    def deferred_photo(self, title="Queued"):
+        photo = Photo(title=title, description="", image=image_upload(size=(1200, 800)))
+        photo._defer_derivatives = True
+        photo.save()
+        return photo
+
+    def test_schedule_queues_one_active_job_per_photo(self):
+        photo = self.deferred_photo()
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            schedule_photo_derivative_generation([photo.pk, photo.pk])
+            schedule_photo_derivative_generation([photo.pk])
+
+        self.assertEqual(DerivativeJob.objects.filter(photo=photo).count(), 1)
+        self.assertEqual(len(callbacks), 2)
+
+    def test_worker_generates_derivatives_and_records_timing(self):
+        photo = self.deferred_photo()
+        schedule_photo_derivative_generation([photo.pk])
+
+        self.assertEqual(process_derivative_jobs(worker_id="test"), 1)
+
+        job = DerivativeJob.objects.get(photo=photo)
+        photo.refresh_from_db()
+        self.assertEqual(job.status, DerivativeJob.Status.DONE)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.duration_ms)
+        self.assertEqual(job.locked_by, "")
+        self.assertTrue(photo.thumb)
+        self.assertTrue(photo.preview)
+
+    @override_settings(PHOTO_DERIVATIVE_EXECUTOR="thread", PHOTO_DERIVATIVE_CONCURRENCY=2)
+    def test_job_duration_is_its_own_render_time(self):
+        photos = [self.deferred_photo(f"Timed {index}") for index in range(2)]
+        schedule_photo_derivative_generation([photo.pk for photo in photos])
+        render_seconds = {photos[0].image.name: 2.5, photos[1].image.name: 0.0}
+
+        def render(**task):
+            rendered = render_photo_derivatives(**task)
+            rendered["render_seconds"] = render_seconds[task["storage_name"]]
+            return rendered
+
+        with patch("portfolio.models.render_photo_derivatives", side_effect=render):
+            self.assertEqual(process_derivative_jobs(worker_id="test"), 2)
+
+        slow, fast = (
+            DerivativeJob.objects.get(photo=photo).duration_ms for photo in photos
+        )
+        self.assertGreaterEqual(slow, 2500)
+        self.assertLess(slow, 4000)
+        self.assertLess(fast, 1500)
+
+    def test_claimed_job_is_not_claimed_twice(self):
+        photo = self.deferred_photo()
+        schedule_photo_derivative_generation([photo.pk])
+
+        self.assertIsNotNone(claim_derivative_job("first"))
+        self.assertIsNone(claim_derivative_job("second"))
+
+    def test_expired_lease_can_be_reclaimed(self):
+        photo = self.deferred_photo()
+        schedule_photo_derivative_generation([photo.pk])
+        claim_derivative_job("crashed")
+        DerivativeJob.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        job = claim_derivative_job("replacement")
+
+        self.assertEqual(job.locked_by, "replacement")
+        self.assertEqual(job.attempts, 2)
+
+    @override_settings(
+        PHOTO_DERIVATIVE_MAX_ATTEMPTS=2,
+        PHOTO_DERIVATIVE_RETRY_BACKOFF_SECONDS=60,
+    )
+    @patch(
+        "portfolio.models.render_photo_derivatives",
+        side_effect=OSError("storage down"),
+    )
+    def test_failed_job_backs_off_then_dead_letters(self, render):
+        photo = self.deferred_photo()
+        schedule_photo_derivative_generation([photo.pk])
+
+        with self.assertLogs("portfolio.models", level="WARNING"):
+            process_derivative_jobs(worker_id="test")
+        job = DerivativeJob.objects.get(photo=photo)
+        self.assertEqual(job.status, DerivativeJob.Status.QUEUED)
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=50))
+        self.assertIn("storage down", job.last_error)
+
+        DerivativeJob.objects.update(run_after=timezone.now())
+        with self.assertLogs("portfolio.models", level="ERROR"):
+            process_derivative_jobs(worker_id="test")
+        job.refresh_from_db()
+        self.assertEqual(job.status, DerivativeJob.Status.DEAD)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(process_derivative_jobs(worker_id="test"), 0)
+
+    def test_admin_requeue_skips_photos_with_active_jobs(self):
+        edited, failed, retried = Photo.objects.bulk_create(
+            [
+                Photo(title=title, description="", image=f"photos/{title}.jpg")
+                for title in ("edited", "failed", "retried")
+            ]
+        )
+        dead = DerivativeJob.Status.DEAD
+        DerivativeJob.objects.bulk_create(
+            [
+                DerivativeJob(photo=edited, status=dead),
+                DerivativeJob(photo=edited, status=DerivativeJob.Status.QUEUED),
+                DerivativeJob(photo=failed, status=dead),
+                DerivativeJob(photo=retried, status=dead),
+                DerivativeJob(photo=retried, status=dead),
+            ]
+        )
+        model_admin = DerivativeJobAdmin(DerivativeJob, django_admin.site)
+
+        with patch.object(model_admin, "message_user") as message_user:
+            model_admin.requeue(
+                RequestFactory().post("/"), DerivativeJob.objects.all()
+            )
+
+        active = DerivativeJob.objects.filter(status=DerivativeJob.Status.QUEUED)
+        self.assertCountEqual(
+            active.values_list("photo_id", flat=True),
+            [edited.pk, failed.pk, retried.pk],
+        )
+        self.assertEqual(
+            message_user.call_args.args[1],
+            "Requeued 2 jobs. Skipped 3: not dead, or the photo already has "
+            "a queued or running job.",
+        )
+
+    @override_settings(PHOTO_DERIVATIVE_EXECUTOR="thread", PHOTO_DERIVATIVE_CONCURRENCY=3)
+    def test_thread_executor_processes_jobs_in_batches(self):
+        photos = [self.deferred_photo(f"Batch {index}") for index in range(4)]
+        schedule_photo_derivative_generation([photo.pk for photo in photos])
+
+        with patch(
+            "portfolio.models.render_photo_derivatives",
+            wraps=render_photo_derivatives,
+        ) as render:
+            self.assertEqual(process_derivative_jobs(worker_id="test"), 4)
+
+        self.assertEqual(render.call_count, 4)
+        for call in render.call_args_list:
+            self.assertEqual(
+                set(call.kwargs),
+                {
+                    "storage_name",
+                    "thumb",
+                    "preview",
+                    "blur",
+                    "thumbhash",
+                    "palette",
+                    "renditions",
+                    "fingerprint",
+                },
+            )
+        for photo in photos:
+            photo.refresh_from_db()
+            self.assertTrue(photo.thumb)
+        self.assertEqual(
+            DerivativeJob.objects.filter(status=DerivativeJob.Status.DONE).count(),
+            4,
+        )
+
+
+@override_settings(PHOTO_RENDITION_WIDTHS=[320], PHOTO_RENDITION_FORMATS=["jpeg"])
+class ProcessingProgressTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.media_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_override.enable()
+        self.addCleanup(self.media_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+        self.photos = []
+        for index in range(2):
+            photo = Photo(
+                title=f"Progress {index}",
+                description="",
+                image=image_upload(size=(900, 600)),
+            )
+            photo._defer_derivatives = True
+            photo.save()
+            self.photos.append(photo)
+        schedule_photo_derivative_generation([photo.pk for photo in self.photos])
+        process_derivative_jobs(worker_id="test", max_jobs=1)
+
+    def login_staff(self):
+        user = get_user_model().objects.create_user(
+            username="staff",
+            password="test-password-123",
+            is_staff=True,
+        )
+        self.client.force_login(user)
+
+    def stream_events(self):
+        ids = ",".join(str(photo.pk) for photo in self.photos)
+        response = self.client.get(
+            f"{reverse('processing_events')}?ids={ids}",
+            secure=True,
+        )
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join(response.streaming_content).decode()
+        events = []
+        for block in body.split("\n\n"):
+            lines = dict(
+                line.split(": ", 1) for line in block.splitlines() if ": " in line
+            )
+            if "event" in lines:
+                events.append((lines["event"], json.loads(lines["data"])))
+        return events
+
+    def test_states_follow_the_latest_job(self):
+        states = photo_processing_states(photo.pk for photo in self.photos)
+
+        first, second = (states[photo.pk] for photo in self.photos)
+        self.assertEqual({first["state"], second["state"]}, {"done", "queued"})
+        done = first if first["state"] == "done" else second
+        self.assertIsNotNone(done["duration_ms"])
+
+        DerivativeJob.objects.filter(status=DerivativeJob.Status.QUEUED).update(
+            status=DerivativeJob.Status.DEAD
+        )
+        states = photo_processing_states(photo.pk for photo in self.photos)
+        self.assertEqual(
+            {state["state"] for state in states.values()},
+            {"done", "failed"},
+        )
+
+    @override_settings(PHOTO_PROGRESS_STREAM_SECONDS=0)
+    def test_stream_pushes_states_and_completes(self):
+        self.login_staff()
+
+        events = self.stream_events()
+        self.assertEqual(
+            sorted(update["state"] for _, update in events),
+            ["done", "queued"],
+        )
+        self.assertNotIn("complete", [name for name, _ in events])
+
+        process_derivative_jobs(worker_id="test")
+        events = self.stream_events()
+        self.assertEqual(events[-1][0], "complete")
+        for name, update in events[:-1]:
+            self.assertEqual(update["state"], "done")
+            self.assertIn("/thumbs/", update["thumbnail_url"])
+
+    def test_stream_requires_staff(self):
+        response = self.client.get(reverse("processing_events"), secure=True)
+        self.assertEqual(response.status_code, 302)
+
+    def test_manager_marks_cards_still_processing(self):
+        self.login_staff()
+        queued = DerivativeJob.objects.get(status=DerivativeJob.Status.QUEUED)
+
+        response = self.client.get(reverse("photo_list"), secure=True)
+
+        self.assertContains(response, 'data-processing-state="queued"')
+        self.assertEqual(response.context["processing_ids"], str(queued.photo_id))
+
+
+@override_settings(PHOTO_RENDITION_WIDTHS=[320], PHOTO_RENDITION_FORMATS=["jpeg"])
+class BackfillDerivativesCommandTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.media_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_override.enable()
+        self.addCleanup(self.media_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.checkpoint = os.path.join(self.media_root, "checkpoint.json")
+
+        self.label = Label.objects.create(title="Trips", slug="trips")
+        self.photos = []
+        for index in range(3):
+            photo = Photo(
+                title=f"Backfill {index}",
+                description="",
+                image=image_upload(size=(640, 480)),
+                label=self.label if index else None,
+            )
+            photo._defer_derivatives = True
+            photo.save()
+            self.photos.append(photo)
+
+    def backfill(self, *args):
+        output = io.StringIO()
+        with patch(
+            "portfolio.models.render_photo_derivatives",
+            wraps=render_photo_derivatives,
+        ) as render:
+            call_command(
+                "backfill_derivatives",
+                *args,
+                "--checkpoint",
+                self.checkpoint,
+                stdout=output,
+                stderr=io.StringIO(),
+            )
+        return render, output.getvalue()
+
+    def test_only_missing_skips_complete_photos(self):
+        generate_photo_derivatives([self.photos[0].pk])
+
+        render, output = self.backfill("--only-missing", "--batch-size", "2")
+
+        self.assertEqual(render.call_count, 2)
+        self.assertIn("img/s", output)
+        self.assertIn("MB/s read", output)
+        self.assertIn("ETA", output)
+        self.assertIn("Processed 3 photos.", output)
+        for photo in self.photos:
+            photo.refresh_from_db()
+            self.assertTrue(photo.thumb)
+            self.assertEqual(photo.renditions.count(), 1)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+        version = catalog_version()
+        render, _ = self.backfill("--only-missing")
+        render.assert_not_called()
+        self.assertEqual(catalog_version(), version)
+
+    def test_filters_select_photos(self):
+        render, _ = self.backfill("--label", "trips", "--ids", f"{self.photos[1].pk}")
+
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(
+            render.call_args.kwargs["storage_name"],
+            self.photos[1].image.name,
+        )
+
+    def test_interrupted_run_resumes_from_checkpoint(self):
+        original_bulk_update = Photo.objects.bulk_update
+        batches = []
+
+        def interrupt_after_first_batch(objs, fields, **kwargs):
+            batches.append([photo.pk for photo in objs])
+            if len(batches) == 2:
+                raise KeyboardInterrupt
+            return original_bulk_update(objs, fields, **kwargs)
+
+        with patch.object(
+            Photo.objects, "bulk_update", side_effect=interrupt_after_first_batch
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                self.backfill("--batch-size", "1")
+
+        with open(self.checkpoint) as checkpoint:
+            self.assertEqual(json.load(checkpoint)["last_id"], self.photos[0].pk)
+
+        render, output = self.backfill("--batch-size", "1")
+
+        self.assertIn(f"Resuming after photo #{self.photos[0].pk}", output)
+        self.assertEqual(render.call_count, 2)
+        self.assertIn("[3/3]", output)
+
+
+class ReextractMetadataCommandTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.media_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_override.enable()
+        self.addCleanup(self.media_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+    def reextract(self, *args):
+        output = io.StringIO()
+        call_command(
+            "reextract_metadata", *args, stdout=output, stderr=io.StringIO()
+        )
+        return output.getvalue()
+
+    def test_reads_only_the_header_of_each_original(self):
+        photos = [
+            Photo.objects.create(
+                title=f"Remote {index}",
+                description="",
+                image=noisy_image_upload(exif={34855: 200 * (index + 1)}),
+            )
+            for index in range(2)
+        ]
+        Photo.objects.update(iso="", iso_speed=None, width=None, height=None)
+        original_bytes = sum(photo.image.size for photo in photos)
+
+        output = self.reextract("--only-missing", "--prefix-kb", "16")
+
+        self.assertIn("Re-extracted metadata for 2 photos", output)
+        for photo, iso in zip(photos, (200, 400)):
+            photo.refresh_from_db()
+            self.assertEqual((photo.iso, photo.iso_speed), (str(iso), iso))
+            self.assertEqual((photo.width, photo.height), (1000, 800))
+        read_kb = float(output.rsplit("reading ", 1)[1].split(" KB")[0])
+        self.assertLessEqual(read_kb, 32)
+        self.assertLess(read_kb * 1024, original_bytes / 10)
+
+    def test_widens_reads_past_a_large_exif_segment(self):
+        exif = Image.Exif()
+        exif[0x010E] = "x" * 6000  # ImageDescription, before the camera IFD
+        exif.get_ifd(ExifTags.IFD.Exif)[0x829D] = (56, 10)
+        output = io.BytesIO()
+        Image.new("RGB", (64, 48), "white").save(output, format="JPEG", exif=exif)
+        photo = Photo.objects.create(
+            title="Wordy",
+            description="",
+            image=SimpleUploadedFile("wordy.jpg", output.getvalue()),
+        )
+        reader = PrefixReader()
+
+        metadata = reader.read_metadata(photo.image.name, 1024)
+
+        self.assertEqual(metadata["aperture"], "f/5.6")
+        self.assertEqual((metadata["width"], metadata["height"]), (64, 48))
+        self.assertLess(reader.bytes_read, 3 * len(output.getvalue()))
+
+    def test_remote_storage_uses_http_range_requests(self):
+        data = image_upload(size=(80, 60), exif={34855: 800}).read()
+
+        class RemoteStorage:
+            def path(self, name):
+                raise NotImplementedError
+
+            def url(self, name):
+                return f"https://cdn.example.com/{name}"
+
+        requests = []
+
+        def fake_urlopen(request, timeout):
+            requests.append(request)
+            return io.BytesIO(data)
+
+        reader = PrefixReader(storage=RemoteStorage())
+        with patch("portfolio.storage_ranges.urlopen", side_effect=fake_urlopen):
+            metadata = reader.read_metadata("photos/remote.jpg", 4096)
+
+        self.assertEqual(metadata["iso_speed"], 800)
+        self.assertEqual(requests[0].full_url, "https://cdn.example.com/photos/remote.jpg")
+        self.assertEqual(requests[0].get_header("Range"), "bytes=0-4095")
+        self.assertEqual(reader.bytes_read, min(4096, len(data)))
+
+
+# Bodies are re-rendered right after each change instead of served stale.
+@override_settings(PHOTO_API_CACHE_STALE_SECONDS=-1)
+class PhotoApiPaginationTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.label = Label.objects.create(title="Walk", slug="walk")
+        hues = [3, None, 3, 0, None, 3, 0]
+        Photo.objects.bulk_create(
+            Photo(
+                title=f"Photo {index}",
+                description="",
+                image=f"photos/{index}.jpg",
+                label=self.label,
+                # Repeated orders make the id tie-breaker matter.
+                order=index // 2,
+                hue_bucket=hue,
+            )
+            for index, hue in enumerate(hues)
+        )
+
+    def walk(self, **params):
+        url = reverse("photo_list_api")
+        pages = []
+        cursor = None
+        while True:
+            query = {"limit": 3, **params}
+            if cursor:
+                query["cursor"] = cursor
+            body = self.client.get(url, query, secure=True).json()
+            pages.append([row["id"] for row in body["results"]])
+            cursor = body["meta"]["next_cursor"]
+            if cursor is None:
+                return pages, body["meta"]
+
+    def expected_ids(self, *ordering):
+        return list(Photo.objects.order_by(*ordering).values_list("id", flat=True))
+
+    def test_cursor_pages_follow_the_offset_order(self):
+        pages, _ = self.walk()
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), self.expected_ids("-order", "-id"))
+
+        hue_pages, _ = self.walk(sort="hue")
+        self.assertEqual(
+            sum(hue_pages, []),
+            self.expected_ids(
+                models.F("hue_bucket").asc(nulls_last=True), "-order", "-id"
+            ),
+        )
+
+    def test_prev_cursor_returns_the_previous_page(self):
+        url = reverse("photo_list_api")
+        first = self.client.get(url, {"limit": 3, "sort": "hue"}, secure=True).json()
+        self.assertIsNone(first["meta"]["prev_cursor"])
+        second = self.client.get(
+            url,
+            {"limit": 3, "sort": "hue", "cursor": first["meta"]["next_cursor"]},
+            secure=True,
+        ).json()
+
+        back = self.client.get(
+            url,
+            {"limit": 3, "sort": "hue", "cursor": second["meta"]["prev_cursor"]},
+            secure=True,
+        ).json()
+
+        self.assertEqual(back["results"], first["results"])
+        self.assertIsNone(back["meta"]["prev_cursor"])
+        self.assertEqual(back["meta"]["next_cursor"], first["meta"]["next_cursor"])
+
+    def test_count_is_opt_in_and_cached(self):
+        url = reverse("photo_list_api")
+        body = self.client.get(url, {"limit": 2}, secure=True).json()
+        self.assertNotIn("count", body["meta"])
+        self.assertNotIn("offset", body["meta"])
+
+        query = {"limit": 2, "count": 1, "label": "walk"}
+        body = self.client.get(url, query, secure=True).json()
+        self.assertEqual(body["meta"]["count"], 7)
+        first, second = (photo["id"] for photo in body["results"])
+        # update() skips the version bump, so the cached total stands ...
+        Photo.objects.filter(pk=first).update(label=None)
+        body = self.client.get(url, query, secure=True).json()
+        self.assertEqual(body["meta"]["count"], 7)
+        # ... until a tracked change moves the catalog version.
+        Photo.objects.filter(pk=second).delete()
+        body = self.client.get(url, query, secure=True).json()
+        self.assertEqual(body["meta"]["count"], 5)
+
+        legacy = self.client.get(url, {"limit": 2, "offset": 4}, secure=True).json()
+        self.assertEqual(legacy["meta"]["count"], 6)
+        self.assertEqual(legacy["meta"]["prev_offset"], 2)
+
+    def test_unchanged_catalog_is_answered_with_304_before_photo_queries(self):
+        url = reverse("photo_list_api")
+        first = self.client.get(url, {"limit": 2}, secure=True)
+        etag = first["ETag"]
+        self.assertTrue(etag.startswith('"') and not etag.startswith("W/"))
+        self.assertIn("Last-Modified", first)
+
+        with CaptureQueriesContext(connection) as queries:
+            cached = self.client.get(
+                url, {"limit": 2}, secure=True, HTTP_IF_NONE_MATCH=etag
+            )
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached["ETag"], etag)
+        self.assertIn("public", cached["Cache-Control"])
+        self.assertEqual(len(queries), 1)
+        self.assertIn("portfolio_catalogversion", queries[0]["sql"])
+
+        since = self.client.get(
+            url,
+            {"limit": 2},
+            secure=True,
+            HTTP_IF_MODIFIED_SINCE=first["Last-Modified"],
+        )
+        self.assertEqual(since.status_code, 304)
+
+    def test_renumbering_bumps_the_catalog_version_only_on_change(self):
+        _normalize_order(self.label)
+        orders = list(
+            Photo.objects.filter(label=self.label)
+            .order_by("-order")
+            .values_list("order", flat=True)
+        )
+        self.assertEqual(orders, list(range(len(orders), 0, -1)))
+        version = catalog_version()
+
+        with CaptureQueriesContext(connection) as queries:
+            _normalize_order(self.label)
+
+        self.assertEqual(catalog_version(), version)
+        self.assertFalse(
+            [query for query in queries if query["sql"].startswith("UPDATE")]
+        )
+
+    def test_writes_move_the_catalog_version(self):
+        url = reverse("photo_list_api")
+        etag = self.client.get(url, secure=True)["ETag"]
+        photos = list(Photo.objects.order_by("pk")[:2])
+
+        def refetch():
+            return self.client.get(url, secure=True, HTTP_IF_NONE_MATCH=etag)
+
+        self.label.title = "Renamed"
+        self.label.save()
+        response = refetch()
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        # Bulk paths that skip signals bump the version themselves.
+        photos[0].order, photos[1].order = photos[1].order, photos[0].order
+        with transaction.atomic():
+            Photo.objects.bulk_update(photos, ["order"])
+            bump_catalog_version()
+        response = refetch()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        etag = response["ETag"]
+
+        self.assertEqual(refetch().status_code, 304)
+
+    def test_rejects_malformed_or_mismatched_cursors(self):
+        url = reverse("photo_list_api")
+        cursor = self.client.get(url, {"limit": 2}, secure=True).json()["meta"][
+            "next_cursor"
+        ]
+
+        for params in (
+            {"cursor": "not-a-cursor"},
+            {"cursor": cursor, "sort": "hue"},
+        ):
+            response = self.client.get(url, params, secure=True)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()["detail"], "Invalid cursor.")
+
+class PhotoApiResponseCacheTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.label = Label.objects.create(title="Coast", slug="coast")
+        Photo.objects.bulk_create(
+            Photo(
+                title=f"Photo {index}",
+                description="",
+                image=f"photos/{index}.jpg",
+                label=self.label,
+                order=index,
+                hue_bucket=index,
+            )
+            for index in range(3)
+        )
+        self.url = reverse("photo_list_api")
+
+    def test_repeat_requests_are_served_from_the_cache(self):
+        first = self.client.get(self.url, {"limit": 2}, secure=True)
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url, {"limit": 2}, secure=True)
+
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertEqual(second["Content-Type"], "application/json")
+        self.assertEqual(len(queries), 1)
+        self.assertIn("portfolio_catalogversion", queries[0]["sql"])
+
+    def test_cache_key_covers_everything_the_body_depends_on(self):
+        def body(params=None, **headers):
+            return self.client.get(
+                self.url, {"limit": 2, **(params or {})}, secure=True, **headers
+            ).json()
+
+        self.assertEqual(len(body({"hue": "0"})["results"]), 1)
+        self.assertEqual(len(body()["results"]), 2)
+        self.assertIn("blur_data_url", body({"blur": "1"})["results"][0])
+        self.assertNotIn("blur_data_url", body()["results"][0])
+        self.assertTrue(
+            body(HTTP_HOST="localhost")["results"][0]["image_url"].startswith(
+                "https://localhost/"
+            )
+        )
+        self.assertTrue(
+            body()["results"][0]["image_url"].startswith("https://testserver/")
+        )
+
+    def test_cache_key_varies_by_path_query_and_fields(self):
+        def key(path="/api/photos/", query="limit=2", image_format="jpeg"):
+            request = Request(
+                RequestFactory().get(f"{path}?{query}", secure=True)
+            )
+            request.accepted_renderer = JSONRenderer()
+            return api_response_cache_key(request, image_format)
+
+        self.assertEqual(
+            key(query="limit=2&fields=id,title"),
+            key(query="fields=id,title&limit=2"),
+        )
+        variants = [
+            key(),
+            key(query="limit=3"),
+            key(query="limit=2&fields=id,title"),
+            key(query="limit=2&fields=id"),
+            key(path="/api/v2/photos/"),
+            key(image_format="webp"),
+        ]
+        self.assertEqual(len(set(variants)), len(variants))
+
+    def test_cache_key_includes_the_negotiated_image_format(self):
+        PhotoRendition.objects.bulk_create(
+            PhotoRendition(
+                photo=photo,
+                width=480,
+                height=320,
+                format=image_format,
+                size=1000,
+                file=f"renditions/{photo.pk}-480.{image_format}",
+            )
+            for photo in Photo.objects.all()
+            for image_format in ("jpeg", "webp")
+        )
+        bodies = {}
+        for accept in ("image/webp,*/*", "*/*", "image/webp,*/*"):
+            response = self.client.get(self.url, secure=True, HTTP_ACCEPT=accept)
+            bodies.setdefault(accept, response.content)
+            self.assertEqual(response.content, bodies[accept])
+
+        self.assertNotEqual(bodies["image/webp,*/*"], bodies["*/*"])
+
+    @patch("portfolio.response_cache.schedule_api_response_rebuild")
+    def test_serves_stale_body_while_revalidating_after_a_change(self, rebuild):
+        before = self.client.get(self.url, secure=True)
+        Photo.objects.filter(order=2).update(title="Renamed")
+        with transaction.atomic():
+            bump_catalog_version()
+
+        stale = self.client.get(self.url, secure=True)
+        self.assertEqual(stale.content, before.content)
+        self.assertEqual(stale["ETag"], before["ETag"])
+        rebuild.assert_called_once()
+        revalidated = self.client.get(
+            self.url, secure=True, HTTP_IF_NONE_MATCH=before["ETag"]
+        )
+        self.assertEqual(revalidated.status_code, 304)
+
+        rebuild_api_response(*rebuild.call_args.args)
+        fresh = self.client.get(self.url, secure=True)
+        self.assertNotEqual(fresh["ETag"], before["ETag"])
+        self.assertEqual(fresh.json()["results"][0]["title"], "Renamed")
+
+    @override_settings(PHOTO_API_CACHE_STALE_SECONDS=-1)
+    def test_renders_in_request_once_the_stale_window_has_passed(self):
+        self.client.get(self.url, secure=True)
+        self.label.title = "Harbour"
+        self.label.save()
+
+        fresh = self.client.get(self.url, secure=True).json()
+
+        self.assertEqual(fresh["results"][0]["label_title"], "Harbour")
+
+    def test_concurrent_misses_render_once(self):
+        builds = []
+        started = threading.Event()
+
+        def build():
+            builds.append(1)
+            started.set()
+            time.sleep(0.05)
+            return b"body"
+
+        results = []
+
+        def fetch():
+            results.append(cached_api_response("photo-api-body:test", 1, build))
+
+        threads = [threading.Thread(target=fetch) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(results, [(1, {"identity": b"body"})] * 4)
+
+class PhotoApiCompressionTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        Photo.objects.bulk_create(
+            Photo(
+                title=f"Photo {index}",
+                description="A long description " * 10,
+                image=f"photos/{index}.jpg",
+                order=index,
+            )
+            for index in range(10)
+        )
+        # bulk_create() skips the signal that records the catalog version.
+        with transaction.atomic():
+            bump_catalog_version()
+        self.url = reverse("photo_list_api")
+
+    def test_negotiates_the_best_stored_encoding(self):
+        best = "br" if brotli is not None else "gzip"
+        self.assertEqual(negotiate_content_encoding("gzip, deflate, br"), best)
+        self.assertEqual(negotiate_content_encoding("*"), best)
+        self.assertEqual(negotiate_content_encoding("gzip, br;q=0"), "gzip")
+        self.assertEqual(negotiate_content_encoding("br;q=0, *"), "gzip")
+        self.assertEqual(
+            negotiate_content_encoding("gzip;q=0, br;q=0, *"), "identity"
+        )
+        self.assertEqual(negotiate_content_encoding("deflate"), "identity")
+        self.assertEqual(negotiate_content_encoding(None), "identity")
+
+    def test_serves_gzip_with_its_own_etag(self):
+        plain = self.client.get(self.url, secure=True)
+        with CaptureQueriesContext(connection) as queries:
+            compressed = self.client.get(
+                self.url, secure=True, HTTP_ACCEPT_ENCODING="gzip"
+            )
+
+        # Same cache entry: the compressed variant was stored with the body.
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn("Content-Encoding", plain)
+        self.assertEqual(compressed["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(compressed.content), plain.content)
+        self.assertLess(len(compressed.content), len(plain.content))
+        self.assertEqual(compressed["ETag"], plain["ETag"][:-1] + '.gzip"')
+        for response in (plain, compressed):
+            vary = [header.strip() for header in response["Vary"].split(",")]
+            self.assertIn("Accept-Encoding", vary)
+
+        # Validators are per encoding: a gzip ETag does not match identity.
+        self.assertEqual(
+            self.client.get(
+                self.url,
+                secure=True,
+                HTTP_ACCEPT_ENCODING="gzip",
+                HTTP_IF_NONE_MATCH=compressed["ETag"],
+            ).status_code,
+            304,
+        )
+        self.assertEqual(
+            self.client.get(
+                self.url, secure=True, HTTP_IF_NONE_MATCH=compressed["ETag"]
+            ).status_code,
+            200,
+        )
+
+    @skipUnless(brotli, "brotli is not installed")
+    def test_serves_brotli_when_accepted(self):
+        plain = self.client.get(self.url, secure=True)
+        response = self.client.get(
+            self.url, secure=True, HTTP_ACCEPT_ENCODING="gzip, deflate, br"
+        )
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+        self.assertTrue(response["ETag"].endswith('.br"'))
+
+    @patch("portfolio.response_cache.brotli", None)
+    def test_without_brotli_br_clients_get_gzip(self):
+        response = self.client.get(
+            self.url, secure=True, HTTP_ACCEPT_ENCODING="br, gzip"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+
+    def test_small_bodies_are_served_uncompressed(self):
+        response = self.client.get(
+            self.url, {"fields": "id", "limit": 1}, secure=True,
+            HTTP_ACCEPT_ENCODING="gzip",
+        )
+        self.assertNotIn("Content-Encoding", response)
+        self.assertFalse(response["ETag"].endswith('.gzip"'))
+        self.assertEqual(
+            self.client.get(
+                self.url,
+                {"fields": "id", "limit": 1},
+                secure=True,
+                HTTP_ACCEPT_ENCODING="gzip",
+                HTTP_IF_NONE_MATCH=response["ETag"],
+            ).status_code,
+            304,
+        )
+
+class PhotoRowSerializerTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        walk = Label.objects.create(title="Walk ✓", slug="walk", order=3)
+        photos = Photo.objects.bulk_create(
+            [
+                Photo(
+                    title="Harbour",
+                    description="Line\u2028break and \"quotes\"",
+                    image="photos/walk/2024/05/harbour.jpg",
+                    thumb="photos/walk/2024/05/thumbs/harbour.jpg",
+                    preview="photos/walk/2024/05/previews/harbour.jpg",
+                    thumbhash="1QcSHQRnh493V4dIh4eXh1h4kJUI",
+                    blur_data_url="data:image/jpeg;base64,AAAA",
+                    dominant_color="#336699",
+                    palette="#336699,#ccbb88",
+                    hue_bucket=7,
+                    aperture="f/2.8",
+                    iso="200",
+                    shutter_speed="1/250",
+                    label=walk,
+                    order=3,
+                ),
+                Photo(
+                    title="Fjällstuga",
+                    description="",
+                    image="photos/2024/05/fjäll stuga (1).jpg",
+                    thumb="photos/2024/05/thumbs/fjäll stuga (1).jpg",
+                    order=2,
+                ),
+                # Still waiting for derivatives: on-demand variant URLs.
+                Photo(
+                    title="Pending",
+                    description="",
+                    image="photos/2024/05/pending.jpg",
+                    hue_bucket=99,
+                    order=1,
+                ),
+            ]
+        )
+        PhotoRendition.objects.bulk_create(
+            PhotoRendition(
+                photo=photo,
+                width=width,
+                height=width * 2 // 3,
+                format=image_format,
+                size=width * 10,
+                file=f"photos/2024/05/renditions/{name}-{width}w.{image_format}",
+            )
+            for photo, name, formats in (
+                (photos[0], "harbour", ("jpeg", "webp")),
+                (photos[1], "fjäll stuga", ("jpeg",)),
+            )
+            for image_format in formats
+            for width in (480, 800, 1600)
+        )
+
+    def render_both(self, image_format, blur=False, host="testserver"):
+        query = {"blur": "1"} if blur else {}
+        request = Request(
+            RequestFactory().get(
+                "/api/photos/", query, secure=True, HTTP_HOST=host
+            )
+        )
+        view = PhotoList()
+        context = {
+            "request": request,
+            "include_blur_data_url": blur,
+            "image_format": image_format,
+        }
+        expected = JSONRenderer().render(
+            PhotoSerializer(
+                view.get_queryset(request), many=True, context=context
+            ).data
+        )
+        actual = FastJSONRenderer().render(
+            PhotoRowSerializer(
+                list(view.get_row_queryset(request)), context=context
+            ).data
+        )
+        return expected, actual
+
+    def test_rows_render_the_same_json_as_photo_serializer(self):
+        for image_format in ("jpeg", "webp"):
+            for blur in (False, True):
+                with self.subTest(image_format=image_format, blur=blur):
+                    expected, actual = self.render_both(image_format, blur)
+                    self.assertEqual(actual, expected)
+        self.assertIn(b"\\u2028", actual)
+        self.assertIn(b"https://testserver/img/3/", actual)
+        self.assertNotIn(b'"label_title":null', actual)
+
+    def test_rows_match_with_public_s3_urls(self):
+        storages = {
+            **S3_TEST_STORAGES,
+            "default": {
+                **S3_TEST_STORAGES["default"],
+                "OPTIONS": {
+                    **S3_TEST_STORAGES["default"]["OPTIONS"],
+                    "querystring_auth": False,
+                },
+            },
+        }
+        with self.settings(STORAGES=storages):
+            expected, actual = self.render_both("webp", host="localhost")
+        self.assertEqual(actual, expected)
+        self.assertIn(b"https://portfolio-test.s3.amazonaws.com/photos/", actual)
+
+    def test_renderer_matches_without_orjson(self):
+        expected, actual = self.render_both("jpeg")
+        with patch("portfolio.renderers.orjson", None):
+            _, fallback = self.render_both("jpeg")
+        self.assertEqual(fallback, expected)
+        # Left to DRF's encoder: oversized integers and datetimes.
+        data = {"big": 2**70, "when": datetime(2024, 5, 1, 12, 30, 1, 123456)}
+        self.assertEqual(
+            FastJSONRenderer().render(data), JSONRenderer().render(data)
+        )
+
+    def test_benchmark_command_reports_matching_paths(self):
+        out = io.StringIO()
+        call_command(
+            "benchmark_photo_api", seed=5, rounds=1, host="testserver", stdout=out
+        )
+        self.assertIn("8 rows per page", out.getvalue())
+        self.assertIn("Speed-up", out.getvalue())
+        self.assertEqual(Photo.objects.count(), 3)
+
+class PhotoApiFieldsTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.label = Label.objects.create(title="Walk", slug="walk")
+        Photo.objects.bulk_create(
+            Photo(
+                title=f"Photo {index}",
+                description="A long description " * 20,
+                image=f"photos/{index}.jpg",
+                thumb=f"photos/thumbs/{index}.jpg",
+                label=self.label if index % 2 else None,
+                order=index,
+                hue_bucket=index % 3,
+            )
+            for index in range(5)
+        )
+        self.url = reverse("photo_list_api")
+        self.v2_url = reverse("photo_list_api_v2")
+
+    def test_fields_narrow_the_payload_and_the_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            body = self.client.get(
+                self.url, {"fields": "title, id", "limit": 2}, secure=True
+            ).json()
+
+        self.assertEqual(list(body["results"][0]), ["id", "title"])
+        photo_sql = [q["sql"] for q in queries if "portfolio_photo" in q["sql"]]
+        self.assertEqual(len(photo_sql), 1)
+        self.assertNotIn("description", photo_sql[0])
+        self.assertNotIn("JOIN", photo_sql[0])
+        self.assertFalse(any("portfolio_photorendition" in q["sql"] for q in queries))
+
+        # Cursors still work: the sort keys are loaded without being shown.
+        ids = [row["id"] for row in body["results"]]
+        while body["meta"]["next_cursor"]:
+            body = self.client.get(
+                self.url,
+                {
+                    "fields": "id,title",
+                    "limit": 2,
+                    "cursor": body["meta"]["next_cursor"],
+                },
+                secure=True,
+            ).json()
+            ids += [row["id"] for row in body["results"]]
+        self.assertEqual(len(set(ids)), 5)
+
+    def test_omit_and_explicit_blur_data_url(self):
+        row = self.client.get(
+            self.url, {"omit": "description,srcset", "sort": "hue"}, secure=True
+        ).json()["results"][0]
+        self.assertNotIn("description", row)
+        self.assertNotIn("srcset", row)
+        self.assertNotIn("blur_data_url", row)
+        self.assertIn("thumbnail_url", row)
+
+        row = self.client.get(
+            self.url, {"fields": "id,blur_data_url"}, secure=True
+        ).json()["results"][0]
+        self.assertEqual(list(row), ["id", "blur_data_url"])
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get(
+            self.url, {"fields": "id,secret", "omit": "nope"}, secure=True
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["detail"], "Unknown fields: secret.")
+
+        response = self.client.get(self.v2_url, {"omit": "folder"}, secure=True)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["detail"], "Unknown omit: folder.")
+
+    def test_v2_drops_the_folder_aliases(self):
+        v1 = self.client.get(self.url, {"label": "walk"}, secure=True).json()
+        v2 = self.client.get(self.v2_url, {"label": "walk"}, secure=True).json()
+
+        self.assertEqual(len(v2["results"]), 2)
+        self.assertEqual(
+            list(v2["results"][0]),
+            [name for name in v1["results"][0] if not name.startswith("folder")],
+        )
+        self.assertEqual(v2["results"][0]["label_slug"], "walk")
+        # The folder= query alias is gone as well.
+        everything = self.client.get(
+            self.v2_url, {"folder": "walk"}, secure=True
+        ).json()
+        self.assertEqual(len(everything["results"]), 5)
+
+    def test_photo_serializer_honours_fields(self):
+        photo = Photo.objects.select_related("label").get(order=1)
+        data = PhotoSerializer(
+            photo, context={"fields": ["id", "label_slug", "blur_data_url"]}
+        ).data
+        self.assertEqual(
+            dict(data), {"id": photo.pk, "label_slug": "walk", "blur_data_url": ""}
+        )
+
+class ResumableUploadTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.media_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            PHOTO_UPLOAD_SESSION_DIR=os.path.join(self.media_root, "uploads"),
+        )
+        self.media_override.enable()
+        self.addCleanup(self.media_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.user = get_user_model().objects.create_user(
+            username="staff",
+            password="test-password-123",
+            is_staff=True,
+        )
+        self.client.force_login(self.user)
+
+    def create_session(self, data, key="key-1", **body):
+        return self.client.post(
+            reverse("upload_session_create"),
+            data={"filename": "harbour_view.jpg", **body},
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY=key,
+            HTTP_UPLOAD_LENGTH=str(len(data)),
+        )
+
+    def patch_chunk(self, url, chunk, offset):
+        return self.client.generic(
+            "PATCH",
+            url,
+            chunk,
+            content_type="application/offset+octet-stream",
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+
+    def test_chunked_upload_resumes_and_finalizes_once(self):
+        Label.objects.create(title="Travel", slug="travel")
+        data = noisy_image_upload(size=(200, 150)).read()
+
+        created = self.create_session(data, label="travel")
+        self.assertEqual(created.status_code, 201)
+        url = created["Location"]
+        self.assertEqual(created["Upload-Offset"], "0")
+
+        # A retried create returns the same session.
+        retried = self.create_session(data, label="travel")
+        self.assertEqual(retried.status_code, 200)
+        self.assertEqual(retried.json()["id"], created.json()["id"])
+
+        half = len(data) // 2
+        response = self.patch_chunk(url, data[:half], 0)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response["Upload-Offset"], str(half))
+
+        # The client lost the acknowledgement and sends the chunk again.
+        conflict = self.patch_chunk(url, data[:half], 0)
+        self.assertEqual(conflict.status_code, 409)
+        resume_at = int(self.client.head(url)["Upload-Offset"])
+        self.assertEqual(resume_at, half)
+
+        early = self.client.post(reverse(
+            "upload_session_finalize", args=[created.json()["id"]]
+        ))
+        self.assertEqual(early.status_code, 409)
+
+        response = self.patch_chunk(url, data[resume_at:], resume_at)
+        self.assertEqual(response["Upload-Offset"], str(len(data)))
+
+        finalize_url = created.json()["finalize_url"]
+        with patch(
+            "portfolio.models.start_inline_derivative_worker"
+        ), self.captureOnCommitCallbacks(execute=True):
+            finalized = self.client.post(finalize_url)
+        self.assertEqual(finalized.status_code, 200)
+        again = self.client.post(finalize_url)
+        self.assertEqual(again.json()["photo_id"], finalized.json()["photo_id"])
+
+        photo = Photo.objects.get()
+        self.assertEqual(photo.pk, finalized.json()["photo_id"])
+        self.assertEqual(photo.title, "Harbour View")
+        self.assertEqual(photo.label.slug, "travel")
+        self.assertEqual(photo.content_sha256, hashlib.sha256(data).hexdigest())
+        with photo.image.open("rb") as stored:
+            self.assertEqual(stored.read(), data)
+        self.assertTrue(DerivativeJob.objects.filter(photo=photo).exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "uploads")), [])
+
+    def test_finalize_writes_the_original_outside_the_session_lock(self):
+        data = image_upload().read()
+        session = self.create_session(data).json()
+        self.patch_chunk(session["upload_url"], data, 0)
+        outer_blocks = len(connection.atomic_blocks)
+        seen = []
+        save = FileSystemStorage.save
+
+        def save_and_record(storage, name, content, max_length=None):
+            seen.append(
+                (
+                    len(connection.atomic_blocks),
+                    UploadSession.objects.get(pk=session["id"]).status,
+                )
+            )
+            return save(storage, name, content, max_length=max_length)
+
+        with patch.object(
+            FileSystemStorage, "save", new=save_and_record
+        ), patch("portfolio.models.start_inline_derivative_worker"):
+            finalized = self.client.post(session["finalize_url"])
+
+        self.assertEqual(finalized.json()["status"], "finalized")
+        self.assertEqual(seen, [(outer_blocks, "finalizing")])
+
+    def test_finalizing_session_is_claimed_once_until_its_lease_expires(self):
+        data = image_upload().read()
+        session = self.create_session(data).json()
+        self.patch_chunk(session["upload_url"], data, 0)
+        UploadSession.objects.update(status=UploadSession.Status.FINALIZING)
+
+        busy = self.client.post(session["finalize_url"])
+        self.assertEqual(busy.status_code, 409)
+        self.assertIn("Retry-After", busy)
+        cancel = self.client.delete(session["upload_url"])
+        self.assertEqual(cancel.status_code, 409)
+
+        UploadSession.objects.update(
+            updated_at=timezone.now() - timedelta(minutes=10)
+        )
+        with patch("portfolio.models.start_inline_derivative_worker"):
+            finalized = self.client.post(session["finalize_url"])
+        self.assertEqual(finalized.json()["status"], "finalized")
+        self.assertEqual(Photo.objects.count(), 1)
+
+    def test_storage_failure_reopens_the_session(self):
+        data = image_upload().read()
+        session = self.create_session(data).json()
+        self.patch_chunk(session["upload_url"], data, 0)
+
+        with patch.object(
+            FileSystemStorage, "save", side_effect=OSError("disk full")
+        ), self.assertLogs("portfolio.views", level="ERROR"):
+            failed = self.client.post(session["finalize_url"])
+
+        self.assertEqual(failed.status_code, 500)
+        self.assertEqual(
+            UploadSession.objects.get().status, UploadSession.Status.OPEN
+        )
+        self.assertFalse(Photo.objects.exists())
+
+    def test_same_file_under_a_new_key_reuses_the_existing_photo(self):
+        data = image_upload().read()
+        existing = Photo.objects.create(
+            title="Original",
+            description="",
+            image=SimpleUploadedFile("photo.jpg", data),
+        )
+
+        session = self.create_session(data, key="key-2").json()
+        self.patch_chunk(session["upload_url"], data, 0)
+        finalized = self.client.post(session["finalize_url"]).json()
+
+        self.assertTrue(finalized["duplicate"])
+        self.assertEqual(finalized["photo_id"], existing.pk)
+        self.assertEqual(Photo.objects.count(), 1)
+
+    def test_rejects_reused_keys_bad_chunks_and_invalid_images(self):
+        data = b"not an image" * 10
+        session = self.create_session(data).json()
+
+        mismatch = self.create_session(data + b"!")
+        self.assertEqual(mismatch.status_code, 422)
+
+        wrong_type = self.client.generic(
+            "PATCH",
+            session["upload_url"],
+            data,
+            content_type="application/octet-stream",
+            HTTP_UPLOAD_OFFSET="0",
+        )
+        self.assertEqual(wrong_type.status_code, 415)
+        overrun = self.patch_chunk(session["upload_url"], data + b"!", 0)
+        self.assertEqual(overrun.status_code, 400)
+
+        self.patch_chunk(session["upload_url"], data, 0)
+        invalid = self.client.post(session["finalize_url"])
+        self.assertEqual(invalid.status_code, 422)
+        self.assertFalse(Photo.objects.exists())
+
+    def test_requires_staff(self):
+        self.client.logout()
+        response = self.create_session(b"data")
+        self.assertIn(response.status_code, (401, 403))
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_prunes_expired_sessions(self):
+        data = b"x" * 10
+        session = self.create_session(data).json()
+        self.patch_chunk(session["upload_url"], data[:4], 0)
+        UploadSession.objects.update(
+            updated_at=timezone.now() - timedelta(days=2)
+        )
+
+        self.assertEqual(prune_upload_sessions(), 1)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "uploads")), [])
+
+
+S3_TEST_STORAGES = {
+    "default": {
+        "BACKEND": "storages.backends.s3boto3.S3Boto3Storage",
+        "OPTIONS": {
+            "bucket_name": "portfolio-test",
+            "access_key": "testing",
+            "secret_key": "testing",
+            "region_name": "us-east-1",
+            "signature_version": "s3v4",
+            "object_parameters": {"CacheControl": "max-age=31536000, public"},
+        },
+    },
+    "staticfiles": {
+        "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+    },
+}
+
+
+class DirectUploadTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.media_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_override.enable()
+        self.addCleanup(self.media_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.user = get_user_model().objects.create_user(
+            username="staff",
+            password="test-password-123",
+            is_staff=True,
+        )
+        self.client.force_login(self.user)
+
+    def create_direct_session(self, data, key="direct-1", **body):
+        return self.client.post(
+            reverse("direct_upload_session_create"),
+            data={"filename": "harbour_view.jpg", **body},
+            content_type="application/json",
+            HTTP_IDEMPOTENCY_KEY=key,
+            HTTP_UPLOAD_LENGTH=str(len(data)),
+        )
+
+    def test_requires_s3_storage(self):
+        response = self.create_direct_session(b"data")
+        self.assertEqual(response.status_code, 501)
+        self.assertFalse(UploadSession.objects.exists())
+
+    @override_settings(STORAGES=S3_TEST_STORAGES)
+    def test_presigns_put_and_post_under_the_upload_layout(self):
+        Label.objects.create(title="Travel", slug="travel")
+        data = image_upload().read()
+
+        created = self.create_direct_session(data, label="travel")
+        self.assertEqual(created.status_code, 201)
+        session = UploadSession.objects.get()
+        self.assertRegex(
+            session.storage_name,
+            rf"^photos/travel/{timezone.now():%Y/%m}/harbour_view_\w{{7}}\.jpg$",
+        )
+        upload = created.json()["upload"]
+        self.assertIn(session.storage_name, upload["put"]["url"])
+        self.assertIn("X-Amz-Signature=", upload["put"]["url"])
+        self.assertEqual(upload["put"]["headers"]["Content-Type"], "image/jpeg")
+        self.assertEqual(upload["post"]["fields"]["key"], session.storage_name)
+        self.assertIn("policy", upload["post"]["fields"])
+
+        retried = self.create_direct_session(data, label="travel")
+        self.assertEqual(retried.status_code, 200)
+        self.assertEqual(UploadSession.objects.get().storage_name, session.storage_name)
+
+        rejected = self.create_direct_session(data, key="direct-2", filename="notes.txt")
+        self.assertEqual(rejected.status_code, 415)
+
+    def test_finalize_keeps_the_object_written_to_storage(self):
+        data = noisy_image_upload(size=(120, 90)).read()
+        name = default_storage.save(
+            "photos/2026/10/harbour_view_abcdefg.jpg", io.BytesIO(data)
+        )
+        session = UploadSession.objects.create(
+            owner=self.user,
+            idempotency_key="direct-1",
+            filename="harbour_view.jpg",
+            length=len(data) + 1,
+            storage_name=name,
+        )
+        finalize_url = reverse("upload_session_finalize", args=[session.pk])
+
+        self.assertEqual(self.client.post(finalize_url).status_code, 409)
+        UploadSession.objects.filter(pk=session.pk).update(length=len(data))
+        with patch("portfolio.models.start_inline_derivative_worker"):
+            finalized = self.client.post(finalize_url)
+
+        self.assertEqual(finalized.status_code, 200)
+        photo = Photo.objects.get(pk=finalized.json()["photo_id"])
+        self.assertEqual(photo.image.name, name)
+        self.assertEqual(photo.title, "Harbour View")
+        self.assertEqual((photo.width, photo.height), (120, 90))
+        self.assertEqual(photo.content_sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual(
+            os.listdir(os.path.join(self.media_root, "photos", "2026", "10")),
+            ["harbour_view_abcdefg.jpg"],
+        )
+        self.assertTrue(DerivativeJob.objects.filter(photo=photo).exists())
+
+    @skipUnless(mock_aws, "moto is not installed")
+    def test_round_trip_against_s3_stand_in(self):
+        data = image_upload(size=(48, 32)).read()
+        with mock_aws(), override_settings(STORAGES=S3_TEST_STORAGES):
+            boto3.client("s3", region_name="us-east-1").create_bucket(
+                Bucket="portfolio-test"
+            )
+            session = self.create_direct_session(data).json()
+            put = session["upload"]["put"]
+            uploaded = requests.put(put["url"], data=data, headers=put["headers"])
+            self.assertEqual(uploaded.status_code, 200)
+
+            with patch("portfolio.models.start_inline_derivative_worker"):
+                finalized = self.client.post(session["finalize_url"]).json()
+
+            photo = Photo.objects.get(pk=finalized["photo_id"])
+            stored = UploadSession.objects.get().storage_name
+            self.assertEqual(photo.image.name, stored)
+            self.assertEqual(photo.content_sha256, hashlib.sha256(data).hexdigest())
+            self.assertEqual((photo.width, photo.height), (48, 32))
+
+class ImageAdmissionTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.media_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_override.enable()
+        self.addCleanup(self.media_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+    def login_staff(self):
+        user = get_user_model().objects.create_user(
+            username="staff",
+            password="test-password-123",
+            is_staff=True,
+        )
+        self.client.force_login(user)
+
+    def test_jpeg_estimate_accounts_for_draft_decoding(self):
+        self.assertEqual(jpeg_draft_size((8000, 5000), 1600), (4000, 2500))
+        jpeg_bytes = estimate_resize_bytes((8000, 5000), "RGB", "JPEG", 1600)
+        png_bytes = estimate_resize_bytes((8000, 5000), "RGB", "PNG", 1600)
+
+        self.assertLess(jpeg_bytes, png_bytes)
+        self.assertGreater(png_bytes, 8000 * 5000 * 4)
+
+    def test_budget_rejects_reservations_that_do_not_fit_in_time(self):
+        budget = MemoryBudget(limit=100)
+
+        with budget.reserve(80):
+            with self.assertRaises(ImageProcessingBusy):
+                with budget.reserve(30, timeout=0.01):
+                    pass
+            with budget.reserve(20, timeout=0):
+                self.assertEqual(budget.in_use, 100)
+
+        self.assertEqual(budget.in_use, 0)
+
+    def test_budget_admits_oversized_job_alone(self):
+        budget = MemoryBudget(limit=100)
+
+        with budget.reserve(10_000, timeout=0) as reserved:
+            self.assertEqual(reserved, 100)
+
+    @override_settings(PHOTO_DERIVATIVE_MAX_BACKLOG=1, IMAGE_PROCESSING_RETRY_AFTER=45)
+    def test_upload_returns_503_when_derivative_backlog_is_saturated(self):
+        photo = Photo(title="Waiting", description="", image=image_upload())
+        photo._defer_derivatives = True
+        photo.save()
+        schedule_photo_derivative_generation([photo.pk])
+        self.login_staff()
+
+        response = self.client.post(
+            reverse("upload_photo"),
+            data={"images": [image_upload("late.jpg")]},
+            secure=True,
+        )
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "45")
+        self.assertEqual(Photo.objects.count(), 1)
+
+    @override_settings(USE_CLOUDINARY=True)
+    @patch(
+        "portfolio.views.prepare_uploaded_image_for_storage",
+        side_effect=ImageProcessingBusy("Busy.", retry_after=20),
+    )
+    def test_upload_returns_503_when_memory_budget_is_exhausted(self, prepare):
+        self.login_staff()
+
+        response = self.client.post(
+            reverse("upload_photo"),
+            data={"images": [image_upload("one.jpg"), image_upload("two.jpg")]},
+            secure=True,
+        )
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "20")
+        self.assertContains(response, "uploaded 0 of 2 photos", status_code=503)
+        self.assertEqual(prepare.call_count, 1)
+
+
+class ResponsiveRenditionTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.media_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_override.enable()
+        self.addCleanup(self.media_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+
+    def rendered_photo(self, size=(2400, 1600)):
+        photo = Photo(title="Ladder", description="", image=image_upload(size=size))
+        photo._defer_derivatives = True
+        photo.save()
+        generate_photo_derivatives([photo.pk])
+        return photo
+
+    @override_settings(PHOTO_RENDITION_WIDTHS=[320, 640, 1920, 2560], PHOTO_RENDITION_FORMATS=["jpeg"])
+    def test_ladder_skips_widths_wider_than_the_original(self):
+        photo = self.rendered_photo()
+
+        renditions = list(photo.renditions.all())
+        self.assertEqual([rendition.width for rendition in renditions], [320, 640, 1920])
+        self.assertEqual(renditions[0].height, 213)
+        for rendition in renditions:
+            self.assertEqual(rendition.size, rendition.file.size)
+            rendition.file.open()
+            with Image.open(rendition.file) as stored:
+                self.assertEqual(stored.size, (rendition.width, rendition.height))
+            rendition.file.close()
+
+    @override_settings(PHOTO_RENDITION_WIDTHS=[320, 640], PHOTO_RENDITION_FORMATS=["jpeg"])
+    def test_api_exposes_srcset_smallest_first(self):
+        self.rendered_photo()
+
+        response = self.client.get(reverse("photo_list_api"), secure=True)
+        srcset = response.json()["results"][0]["srcset"]
+
+        self.assertEqual([entry["width"] for entry in srcset], [320, 640])
+        self.assertTrue(srcset[0]["url"].startswith("https://testserver/media/"))
+        self.assertGreater(srcset[0]["bytes"], 0)
+        self.assertEqual(srcset[1]["height"], 427)
+
+    @override_settings(PHOTO_RENDITION_WIDTHS=[320], PHOTO_RENDITION_FORMATS=["jpeg"])
+    def test_deleting_photo_removes_rendition_files(self):
+        photo = self.rendered_photo()
+        rendition_name = photo.renditions.get().file.name
+        storage = photo.image.storage
+        self.assertTrue(storage.exists(rendition_name))
+
+        photo.delete()
+
+        self.assertFalse(storage.exists(rendition_name))
+        self.assertFalse(PhotoRendition.objects.exists())
+
+    @override_settings(
+        PHOTO_RENDITION_WIDTHS=[320, 640],
+        PHOTO_RENDITION_FORMATS=["jpeg", "webp"],
+    )
+    def test_formats_are_stored_per_width_with_matching_extensions(self):
+        photo = self.rendered_photo()
+
+        stored = {
+            (rendition.width, rendition.format): rendition
+            for rendition in photo.renditions.all()
+        }
+        self.assertEqual(
+            set(stored),
+            {(320, "jpeg"), (640, "jpeg"), (320, "webp"), (640, "webp"),
+             (800, "webp"), (1600, "webp")},
+        )
+        webp = stored[(640, "webp")]
+        self.assertTrue(webp.file.name.endswith("-640w.webp"))
+        self.assertEqual(webp.content_type, "image/webp")
+        webp.file.open()
+        with Image.open(webp.file) as encoded:
+            self.assertEqual(encoded.format, "WEBP")
+            self.assertEqual(encoded.size, (640, 427))
+        webp.file.close()
+
+        # Regenerating only asks for the pairs that are still missing.
+        photo.refresh_from_db()
+        self.assertEqual(photo.derivative_task()["renditions"], [])
+
+    @override_settings(
+        PHOTO_RENDITION_WIDTHS=[320, 640],
+        PHOTO_RENDITION_FORMATS=["jpeg", "webp"],
+    )
+    def test_api_negotiates_rendition_format_from_accept(self):
+        self.rendered_photo()
+        url = reverse("photo_list_api")
+
+        response = self.client.get(
+            url, secure=True, HTTP_ACCEPT="image/avif,image/webp,*/*"
+        )
+        photo_data = response.json()["results"][0]
+        vary = [header.strip() for header in response["Vary"].split(",")]
+        self.assertEqual(vary.count("Accept"), 1)
+        self.assertEqual(
+            [(entry["width"], entry["format"]) for entry in photo_data["srcset"]],
+            [(320, "webp"), (640, "webp"), (800, "webp"), (1600, "webp")],
+        )
+        self.assertTrue(photo_data["thumbnail_url"].endswith("-800w.webp"))
+        self.assertTrue(photo_data["preview_url"].endswith("-1600w.webp"))
+
+        response = self.client.get(url, secure=True, HTTP_ACCEPT="application/json")
+        photo_data = response.json()["results"][0]
+        self.assertEqual(
+            {entry["format"] for entry in photo_data["srcset"]}, {"jpeg"}
+        )
+        self.assertIn("/thumbs/", photo_data["thumbnail_url"])
+
+    @override_settings(PHOTO_RENDITION_FORMATS=["jpeg", "webp", "avif"])
+    def test_negotiation_honours_preference_and_zero_quality(self):
+        self.assertEqual(negotiate_image_format(None), "jpeg")
+        self.assertEqual(negotiate_image_format("image/webp,*/*;q=0.8"), "webp")
+        self.assertEqual(
+            negotiate_image_format("image/webp, image/avif;q=0"), "webp"
+        )
+        self.assertEqual(negotiate_image_format("image/avif,image/webp"), "avif")
+
+
+@override_settings(
+    PHOTO_VARIANT_SIZES=["320x0", "640x0", "800x0", "1600x1600"],
+    PHOTO_RENDITION_FORMATS=["jpeg", "webp"],
+)
+class PhotoVariantTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.media_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            PHOTO_VARIANT_CACHE_DIR=self.cache_dir,
+        )
+        self.media_override.enable()
+        self.addCleanup(self.media_override.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+
+        self.photo = Photo(
+            title="Variant",
+            description="",
+            image=image_upload(size=(1200, 900)),
+        )
+        self.photo._defer_derivatives = True
+        self.photo.save()
+
+    def variant_url(self, size="320x0", extension="jpg"):
+        return reverse(
+            "photo_variant",
+            kwargs={
+                "photo_id": self.photo.pk,
+                "width": int(size.split("x")[0]),
+                "height": int(size.split("x")[1]),
+                "extension": extension,
+            },
+        )
+
+    def test_variant_is_rendered_once_then_served_from_cache(self):
+        with patch(
+            "portfolio.views.render_variant",
+            wraps=render_variant,
+        ) as render:
+            first = self.client.get(self.variant_url(extension="webp"))
+            second = self.client.get(self.variant_url(extension="webp"))
+
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first["Content-Type"], "image/webp")
+        self.assertIn("immutable", first["Cache-Control"])
+        self.assertIn("Save-Data", first["Vary"])
+        self.assertEqual(first.content, second.content)
+        with Image.open(io.BytesIO(first.content)) as variant:
+            self.assertEqual(variant.size, (320, 240))
+
+        not_modified = self.client.get(
+            self.variant_url(extension="webp"),
+            HTTP_IF_NONE_MATCH=first["ETag"],
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_unlisted_sizes_and_formats_are_not_rendered(self):
+        self.assertEqual(self.client.get(self.variant_url("321x0")).status_code, 404)
+        self.assertEqual(
+            self.client.get(self.variant_url(extension="avif")).status_code,
+            404,
+        )
+
+    def test_client_hints_pick_allow_listed_width(self):
+        response = self.client.get(self.variant_url(), HTTP_DPR="2")
+        with Image.open(io.BytesIO(response.content)) as variant:
+            self.assertEqual(variant.width, 640)
+
+        response = self.client.get(self.variant_url(), HTTP_SEC_CH_WIDTH="700")
+        with Image.open(io.BytesIO(response.content)) as variant:
+            self.assertEqual(variant.width, 800)
+
+        response = self.client.get(
+            self.variant_url(), HTTP_DPR="2", HTTP_SAVE_DATA="on"
+        )
+        with Image.open(io.BytesIO(response.content)) as variant:
+            self.assertEqual(variant.width, 320)
+
+    def test_box_variant_never_upscales(self):
+        response = self.client.get(self.variant_url("1600x1600"))
+        with Image.open(io.BytesIO(response.content)) as variant:
+            self.assertEqual(variant.size, (1200, 900))
+
+    def test_pending_photo_links_to_variants(self):
+        self.assertTrue(
+            self.photo.thumbnail_url.startswith(self.variant_url("800x0") + "?v=")
+        )
+        self.assertTrue(
+            self.photo.preview_url.startswith(self.variant_url("1600x1600") + "?v=")
+        )
+
+    def test_disk_cache_evicts_least_recently_used(self):
+        cache = DiskLRUCache(self.cache_dir, max_bytes=250)
+        cache.set("aa01", "jpg", b"x" * 100)
+        cache.set("aa02", "jpg", b"x" * 100)
+        old = time.time() - 60
+        os.utime(cache._path("aa01", "jpg"), (old, old))
+        os.utime(cache._path("aa02", "jpg"), (old - 60, old - 60))
+        self.assertIsNotNone(cache.get("aa01", "jpg"))
+
+        cache.set("aa03", "jpg", b"x" * 100)
+
+        self.assertIsNone(cache.get("aa02", "jpg"))
+        self.assertIsNotNone(cache.get("aa01", "jpg"))
+        self.assertIsNotNone(cache.get("aa03", "jpg"))
+        self.assertLessEqual(cache.total_bytes, 250)
+
+    def test_single_flight_runs_concurrent_misses_once(self):
+        flights = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def slow_render():
+            calls.append(1)
+            release.wait(5)
+            return b"rendered"
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(flights.do("key", slow_render))
+            )
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [b"rendered"] * 4)
@@ -0,0 +1,109 @@
+import hashlib
+import io
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+
+from .forms import MAX_BULK_UPLOAD_BYTES, MAX_UPLOAD_BYTES
+
+
+SNIFF_BYTES = 12
+
+
+def sniff_image_format(head):
+    """Pillow format name for a JPEG, PNG or WebP file's first bytes, else None."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+class StreamingImageUploadHandler(FileUploadHandler):
+    """
+    Receive uploaded images in a single pass over the request body.
+
+    Each file is hashed as it streams in and its format sniffed from the
+    first bytes. Non-images and files or batches over the size limits stop
+    the upload on the spot, without reading the rest of the request. The
+    reason is left on request.upload_rejection for the view to show.
+
+    Files stay in memory while the request's total is within
+    PHOTO_UPLOAD_MEMORY_CEILING and roll over to an anonymous temporary file
+    beyond that, so a 25-file batch never sits in RAM. The returned
+    UploadedFile carries content_sha256 and sniffed_format, so validation
+    does not read the bytes again to hash them.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.memory_left = settings.PHOTO_UPLOAD_MEMORY_CEILING
+        self.request_bytes = 0
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = io.BytesIO()
+        self.in_memory = True
+        self.digest = hashlib.sha256()
+        self.head = b""
+        self.sniffed_format = None
+
+    def _reject(self, message):
+        self.request.upload_rejection = f"{self.file_name}: {message}"
+        self.file.close()
+        raise StopUpload(connection_reset=True)
+
+    def _roll_over(self):
+        spooled = tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR)
+        spooled.write(self.file.getvalue())
+        self.file.close()
+        self.file = spooled
+        self.in_memory = False
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.sniffed_format is None and len(self.head) < SNIFF_BYTES:
+            self.head += raw_data[: SNIFF_BYTES - len(self.head)]
+            if len(self.head) == SNIFF_BYTES:
+                self._sniff()
+        if start + len(raw_data) > MAX_UPLOAD_BYTES:
+            self._reject("Images must be 20 MB or smaller.")
+        self.request_bytes += len(raw_data)
+        if self.request_bytes > MAX_BULK_UPLOAD_BYTES:
+            self._reject("Upload batches must be 300 MB or smaller.")
+
+        if self.in_memory and self.file.tell() + len(raw_data) > self.memory_left:
+            self._roll_over()
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+        return None
+
+    def _sniff(self):
+        self.sniffed_format = sniff_image_format(self.head)
+        if self.sniffed_format is None:
+            self._reject("Only JPEG, PNG, and WebP images are accepted.")
+
+    def file_complete(self, file_size):
+        if self.sniffed_format is None:
+            self._sniff()
+        if self.in_memory:
+            self.memory_left -= file_size
+        self.file.seek(0)
+        upload = UploadedFile(
+            file=self.file,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+        upload.content_sha256 = self.digest.hexdigest()
+        upload.sniffed_format = self.sniffed_format
+        return upload
+
+    def upload_interrupted(self):
+        if hasattr(self, "file"):
+            self.file.close()
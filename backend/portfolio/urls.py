@@ -17,6 +17,7 @@ urlpatterns = [
     path('bottom_order/<int:id>/', staff_member_required(views.bottom_order), name='bottom'),
     path('remove_label/<int:id>/', staff_member_required(views.remove_label), name='remove_label'),
     path('delete/<int:id>/', staff_member_required(views.delete_photo), name='delete_photo'),
+    path('processing/events/', views.processing_events, name='processing_events'),
     
     path(
         "label/<slug:slug>/",
@@ -25,6 +26,36 @@ urlpatterns = [
     ),
 
     path('api/photos/', views.PhotoList.as_view(), name='photo_list_api'),
+    path(
+        "api/v2/photos/",
+        views.PhotoListV2.as_view(),
+        name="photo_list_api_v2",
+    ),
+    path(
+        "api/uploads/",
+        views.UploadSessionCreate.as_view(),
+        name="upload_session_create",
+    ),
+    path(
+        "api/uploads/direct/",
+        views.DirectUploadSessionCreate.as_view(),
+        name="direct_upload_session_create",
+    ),
+    path(
+        "api/uploads/<uuid:session_id>/",
+        views.UploadSessionDetail.as_view(),
+        name="upload_session",
+    ),
+    path(
+        "api/uploads/<uuid:session_id>/finalize/",
+        views.UploadSessionFinalize.as_view(),
+        name="upload_session_finalize",
+    ),
+    path(
+        "img/<int:photo_id>/<int:width>x<int:height>.<str:extension>",
+        views.photo_variant,
+        name="photo_variant",
+    ),
 ]
 
 # Only serve local files if DEBUG=True
@@ -0,0 +1,297 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+from .derivatives import (
+    PREVIEW_QUALITY,
+    RENDITION_FORMATS,
+    THUMB_MAX_W,
+    THUMB_QUALITY,
+    available_rendition_formats,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# URL extensions accepted by the variant endpoint, mapped to rendition formats.
+VARIANT_EXTENSIONS = {"jpg": "jpeg", "jpeg": "jpeg", "webp": "webp", "avif": "avif"}
+MAX_DPR = 3.0
+SAVE_DATA_QUALITY_OFFSET = -20
+
+
+def parse_variant_sizes(values):
+    """Parse "WxH" strings (H may be 0 for "any height") into int pairs."""
+    sizes = set()
+    for value in values:
+        width, _, height = value.strip().lower().partition("x")
+        sizes.add((int(width), int(height or 0)))
+    return sizes
+
+
+def variant_sizes():
+    return parse_variant_sizes(settings.PHOTO_VARIANT_SIZES)
+
+
+def variant_format(extension):
+    """Rendition format for a URL extension, or None if it is not served."""
+    image_format = VARIANT_EXTENSIONS.get(extension.lower())
+    if image_format not in available_rendition_formats():
+        return None
+    return image_format
+
+
+def _hint(meta, *names):
+    for name in names:
+        value = meta.get(name)
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return None
+    return None
+
+
+def resolve_variant_size(size, meta, allowed=None):
+    """
+    Pick the allow-listed box to render for a requested one, honouring the
+    Width, DPR and Save-Data client hints found in a request's META.
+
+    Only boxes with the requested shape (width-only, or the same aspect
+    ratio) are candidates. Width is the display width in device pixels;
+    DPR scales the requested box. Save-Data ignores DPR so a data-saving
+    client gets the 1x image. Returns (box, save_data).
+    """
+    allowed = variant_sizes() if allowed is None else allowed
+    width, height = size
+    save_data = (meta.get("HTTP_SAVE_DATA") or "").strip().lower() == "on"
+
+    target_width = width
+    if not save_data:
+        hinted_width = _hint(meta, "HTTP_SEC_CH_WIDTH", "HTTP_WIDTH")
+        dpr = _hint(meta, "HTTP_SEC_CH_DPR", "HTTP_DPR")
+        if hinted_width:
+            target_width = hinted_width
+        elif dpr:
+            target_width = width * min(max(dpr, 1.0), MAX_DPR)
+
+    candidates = sorted(
+        (w, h)
+        for w, h in allowed
+        if (h == 0) == (height == 0) and (not height or w * height == h * width)
+    )
+    if target_width == width or not candidates:
+        return size, save_data
+    for candidate in candidates:
+        if candidate[0] >= target_width:
+            return candidate, save_data
+    return candidates[-1], save_data
+
+
+def variant_quality(width, save_data=False):
+    quality = THUMB_QUALITY if width <= THUMB_MAX_W else PREVIEW_QUALITY
+    if save_data:
+        quality += SAVE_DATA_QUALITY_OFFSET
+    return quality
+
+
+def variant_cache_key(storage_name, box, image_format, quality):
+    """
+    Content key for one rendered variant. The original's storage name is
+    part of it, so replacing a photo's image never serves the old pixels.
+    """
+    raw = f"{storage_name}|{box[0]}x{box[1]}|{image_format}|{quality}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def variant_version(storage_name):
+    """Short token that changes whenever a photo's original is replaced."""
+    return hashlib.sha256(storage_name.encode("utf-8")).hexdigest()[:12]
+
+
+class DiskLRUCache:
+    """
+    Size-capped file cache. Reads touch the file's mtime, and once the
+    total passes max_bytes the least recently used files are removed until
+    it is back under low_water of the cap. Several processes may share the
+    directory: writes are atomic renames and eviction rescans the disk.
+    """
+
+    def __init__(self, directory, max_bytes, low_water=0.9):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.low_water = low_water
+        self._lock = threading.Lock()
+        self._total = None
+
+    def _path(self, key, extension):
+        return self.directory / key[:2] / f"{key}.{extension}"
+
+    def get(self, key, extension):
+        path = self._path(key, extension)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def set(self, key, extension, data):
+        path = self._path(key, extension)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(data)
+            os.replace(tmp_name, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan_total()
+            else:
+                self._total += len(data)
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        if not self.directory.exists():
+            return []
+        entries = []
+        for path in self.directory.glob("*/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _scan_total(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.low_water
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._total = total
+
+    @property
+    def total_bytes(self):
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan_total()
+            return self._total
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls for the same key into one: the first caller
+    runs the function, the others wait for and share its result (or error).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"event": threading.Event()}
+        if not leader:
+            call["event"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except BaseException as exc:
+            call["error"] = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["event"].set()
+
+
+_variant_cache = None
+_variant_cache_lock = threading.Lock()
+variant_flights = SingleFlight()
+
+
+def get_variant_cache():
+    global _variant_cache
+    directory = Path(settings.PHOTO_VARIANT_CACHE_DIR)
+    max_bytes = settings.PHOTO_VARIANT_CACHE_MAX_BYTES
+    with _variant_cache_lock:
+        if (
+            _variant_cache is None
+            or _variant_cache.directory != directory
+            or _variant_cache.max_bytes != max_bytes
+        ):
+            _variant_cache = DiskLRUCache(directory, max_bytes)
+        return _variant_cache
+
+
+def variant_extension(image_format):
+    return RENDITION_FORMATS[image_format][2]
+
+
+def variant_content_type(image_format):
+    return RENDITION_FORMATS[image_format][1]
+
+
+def cached_variant(storage_name, box, image_format, quality, render):
+    """
+    Return (key, bytes) for a variant, rendering it through render() at most
+    once per process however many requests miss at the same time.
+    """
+    cache = get_variant_cache()
+    key = variant_cache_key(storage_name, box, image_format, quality)
+    extension = variant_extension(image_format)
+    data = cache.get(key, extension)
+    if data is not None:
+        return key, data
+
+    def fill():
+        cached = cache.get(key, extension)
+        if cached is not None:
+            return cached
+        started = time.monotonic()
+        rendered = render()
+        cache.set(key, extension, rendered)
+        logger.info(
+            "Rendered %s variant %sx%s of %s in %.0f ms",
+            image_format,
+            box[0],
+            box[1],
+            storage_name,
+            (time.monotonic() - started) * 1000,
+        )
+        return rendered
+
+    return key, variant_flights.do(key, fill)
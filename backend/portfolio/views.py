@@ -1,36 +1,122 @@
+import json
 import logging
 import os
+import time
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 
 from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import render, redirect, get_object_or_404
 from django.db import models, transaction
+from django.db.models import Prefetch
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
 from django.urls import reverse
 from django.utils.text import slugify
-from django.utils.cache import patch_cache_control
-from django.views.decorators.http import require_POST
-
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils import timezone
+from django.utils.http import http_date
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseNotModified,
+    StreamingHttpResponse,
+)
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_GET, require_POST
+
+from .admission import ImageProcessingBusy
+from .direct_uploads import (
+    direct_upload_content_type,
+    direct_upload_name,
+    direct_upload_supported,
+    presigned_upload_targets,
+)
+from .derivatives import (
+    available_rendition_formats,
+    negotiate_image_format,
+    render_variant,
+)
 from .models import (
     Label,
     Photo,
+    PhotoRendition,
+    UploadSession,
+    bump_catalog_version,
+    catalog_version,
+    cloudinary_variant_url,
+    PROCESSING_DONE,
+    PROCESSING_TERMINAL_STATES,
+    derivative_backlog_saturated,
+    photo_processing_states,
     schedule_photo_derivative_generation,
     schedule_storage_file_deletion,
 )
 from .forms import (
+    MAX_UPLOAD_BYTES,
     BulkPhotoUploadForm,
     FolderCreateForm,
     PhotoEditForm,
     prepare_uploaded_image_for_storage,
+    validate_uploaded_image,
 )
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework import status
-from rest_framework.permissions import AllowAny
-
-from .serializer import PhotoSerializer
+from rest_framework.exceptions import ParseError
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.renderers import BrowsableAPIRenderer
+
+from .fingerprints import PerceptualHashIndex
+from .pagination import (
+    InvalidCursor,
+    SortKey,
+    decode_cursor,
+    encode_cursor,
+    keyset_filter,
+    order_by_expressions,
+)
+from .palette import parse_hue_bucket
+from .response_cache import (
+    api_response_cache_key,
+    cached_api_response,
+    negotiate_content_encoding,
+)
+from .resumable import (
+    append_chunk,
+    discard_spool,
+    prune_upload_sessions,
+    session_spool_path,
+)
+from .renderers import FastJSONRenderer
+from .serializer import (
+    RENDITION_FIELDS,
+    PhotoRowSerializer,
+    PhotoSerializer,
+    default_photo_fields,
+    photo_columns,
+)
+from .upload_handlers import StreamingImageUploadHandler
+from .variants import (
+    cached_variant,
+    resolve_variant_size,
+    variant_cache_key,
+    variant_content_type,
+    variant_format,
+    variant_quality,
+    variant_sizes,
+)
 # ---------- Helpers ----------
 
 logger = logging.getLogger(__name__)
@@ -38,36 +124,132 @@ logger = logging.getLogger(__name__)
 
 class PhotoList(APIView):
     """
-    GET /api/photos/?label=<slug>&limit=50&offset=0
+    GET /api/photos/?label=<slug>&limit=50&cursor=<token>
 
     - label=<slug> filters by label
     - folder=<slug> remains a temporary query-string alias
-    - limit/offset are optional (default 50/0, hard-capped)
+    - limit is optional (default 50, hard-capped)
+    - pages are walked with the opaque meta.next_cursor/prev_cursor tokens,
+      which seek on the sort columns so every page costs the same;
+      count=1 adds the (cached) total as meta.count
+    - offset=<n> selects the older offset pagination, whose meta always
+      carries count/offset/next_offset/prev_offset
+    - blur=1 adds blur_data_url next to the default thumbhash placeholder
+    - hue=<name|bucket> filters by the dominant colour's hue bucket
+      (red, orange, ..., rose, neutral); sort=hue groups results by hue
+    - fields=<a,b,...> returns only those fields and omit=<a,b,...> drops
+      fields; only the columns (and renditions) they need are loaded
     """
     DEFAULT_LIMIT = 50
     MAX_LIMIT = 200
+    # Keyset orderings by ?sort=; the last key must be unique.
+    SORTS = {
+        "": (SortKey("order", True), SortKey("id", True)),
+        "hue": (
+            SortKey("hue_bucket", False, nulls_last=True),
+            SortKey("order", True),
+            SortKey("id", True),
+        ),
+    }
+    # Whether payloads carry the folder/folder_* aliases of label/label_*
+    # and folder= is accepted for label=.
+    LEGACY_ALIASES = True
     authentication_classes = []
     permission_classes = [AllowAny]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
 
     def get_queryset(self, request: Request):
-        qs = (
-            Photo.objects.select_related("label")
-            .only(
-                "id", "title", "description", "category",
-                "created_at", "order",
-                "aperture", "iso", "shutter_speed",
-                "image", "thumb", "preview", "blur_data_url",
-                "label", "label__title", "label__slug", "label__order",
-            )
-            .order_by("-order", "-id")
+        fields = self.selected_fields(request)
+        columns = self.columns(request, fields)
+        qs = Photo.objects.only(*columns)
+        if any(column.startswith("label__") for column in columns):
+            qs = qs.select_related("label")
+        if not RENDITION_FIELDS.isdisjoint(fields):
+            qs = qs.prefetch_related(
+                Prefetch(
+                    "renditions",
+                    queryset=PhotoRendition.objects.only(
+                        "id", "photo_id", "width", "height", "format",
+                        "size", "file",
+                    ),
+                )
+            )
+        return self.filter_queryset(request, qs)
+
+    def get_row_queryset(self, request: Request):
+        """values() rows for PhotoRowSerializer."""
+        columns = self.columns(request, self.selected_fields(request))
+        return self.filter_queryset(request, Photo.objects.values(*columns))
+
+    def columns(self, request: Request, fields):
+        """Columns for fields plus the sort keys the cursors are built from."""
+        columns = photo_columns(fields)
+        for key in self.SORTS[self.sort_name(request)]:
+            if key.field not in columns:
+                columns.append(key.field)
+        return columns
+
+    def selected_fields(self, request: Request):
+        """
+        Output fields in their usual order: ?fields= (default: every field,
+        blur_data_url only with blur=1) less ?omit=. Both take
+        comma-separated names; unknown names are a 400.
+        """
+        available = default_photo_fields(
+            include_blur_data_url=True, legacy_aliases=self.LEGACY_ALIASES
         )
+        requested = self.field_names(request, "fields", available)
+        if requested is None:
+            requested = default_photo_fields(
+                self.include_blur_data_url(request), self.LEGACY_ALIASES
+            )
+        omitted = self.field_names(request, "omit", available) or ()
+        return [
+            name for name in available if name in requested and name not in omitted
+        ]
+
+    @staticmethod
+    def field_names(request: Request, param, available):
+        if param not in request.GET:
+            return None
+        names = [
+            name.strip()
+            for value in request.GET.getlist(param)
+            for name in value.split(",")
+            if name.strip()
+        ]
+        unknown = [name for name in names if name not in available]
+        if unknown:
+            raise ParseError(f"Unknown {param}: {', '.join(unknown)}.")
+        return names
+
+    def label_slug(self, request: Request):
+        slug = request.GET.get("label")
+        if not slug and self.LEGACY_ALIASES:
+            slug = request.GET.get("folder")
+        return slug or ""
+
+    def filter_queryset(self, request: Request, qs):
+        qs = qs.order_by(*order_by_expressions(self.SORTS[self.sort_name(request)]))
 
-        label_slug = request.GET.get("label") or request.GET.get("folder")
+        label_slug = self.label_slug(request)
         if label_slug:
             qs = qs.filter(label__slug=label_slug)
 
+        if "hue" in request.GET:
+            bucket = parse_hue_bucket(request.GET["hue"])
+            qs = qs.filter(hue_bucket=bucket) if bucket is not None else qs.none()
+
         return qs
 
+    def sort_name(self, request: Request):
+        sort = request.GET.get("sort", "")
+        return sort if sort in self.SORTS else ""
+
+    @staticmethod
+    def include_blur_data_url(request: Request):
+        return request.GET.get("blur") in ("1", "true")
+
     def paginate(self, request: Request, qs):
         try:
             limit = min(
@@ -77,6 +259,11 @@ class PhotoList(APIView):
         except ValueError:
             limit = self.DEFAULT_LIMIT
 
+        if "offset" in request.GET:
+            return self.paginate_offset(request, qs, limit)
+        return self.paginate_cursor(request, qs, limit)
+
+    def paginate_offset(self, request: Request, qs, limit):
         try:
             offset = max(int(request.GET.get("offset", 0)), 0)
         except ValueError:
@@ -95,21 +282,780 @@ class PhotoList(APIView):
             "prev_offset": prev_offset,
         }
 
+    def paginate_cursor(self, request: Request, qs, limit):
+        sort = self.sort_name(request)
+        keys = self.SORTS[sort]
+        token = request.GET.get("cursor")
+        backwards = False
+        page = qs
+        if token:
+            try:
+                values, backwards = decode_cursor(token, sort, keys)
+            except InvalidCursor as error:
+                raise ParseError(str(error))
+            page = qs.filter(keyset_filter(keys, values, after=not backwards))
+            if backwards:
+                page = page.reverse()
+
+        # One extra row tells whether another page follows.
+        items = list(page[: limit + 1])
+        has_more = len(items) > limit
+        items = items[:limit]
+        if backwards:
+            items.reverse()
+
+        meta = {"limit": limit, "next_cursor": None, "prev_cursor": None}
+        if items:
+            if has_more or backwards:
+                meta["next_cursor"] = encode_cursor(sort, items[-1], keys)
+            if token and (has_more or not backwards):
+                meta["prev_cursor"] = encode_cursor(
+                    sort, items[0], keys, backwards=True
+                )
+        if request.GET.get("count") in ("1", "true"):
+            meta["count"] = self.cached_count(request, qs)
+        return items, meta
+
+    def cached_count(self, request: Request, qs):
+        """
+        The filtered total, cached per filter and catalog version for at
+        most PHOTO_API_COUNT_CACHE_SECONDS.
+        """
+        label_slug = self.label_slug(request)
+        key = "photo-api-count:" + urlencode(
+            [
+                ("version", self.catalog_version),
+                ("label", label_slug),
+                ("hue", request.GET.get("hue", "")),
+            ]
+        )
+        return cache.get_or_set(
+            key, qs.count, settings.PHOTO_API_COUNT_CACHE_SECONDS
+        )
+
+    def get_data(self, request: Request, image_format):
+        context = {
+            "request": request,
+            "fields": self.selected_fields(request),
+            "image_format": image_format,
+        }
+        if settings.USE_CLOUDINARY:
+            items, meta = self.paginate(request, self.get_queryset(request))
+            serializer = PhotoSerializer(items, many=True, context=context)
+        else:
+            # Same JSON as PhotoSerializer without its per-row overhead.
+            items, meta = self.paginate(request, self.get_row_queryset(request))
+            serializer = PhotoRowSerializer(items, context=context)
+        return {"results": serializer.data, "meta": meta}
+
+    def render_body(self, request: Request, image_format):
+        return request.accepted_renderer.render(
+            self.get_data(request, image_format),
+            request.accepted_media_type,
+            self.get_renderer_context(),
+        )
+
+    @staticmethod
+    def validators(
+        request: Request, version, modified_at, image_format, encoding="identity"
+    ):
+        etag = f"{version}.{request.accepted_renderer.format}.{image_format}"
+        # Each content coding is a different representation.
+        etag = f'"{etag}"' if encoding == "identity" else f'"{etag}.{encoding}"'
+        # HTTP dates have whole seconds; ETags carry the exact version.
+        last_modified = int(modified_at.timestamp()) if modified_at else None
+        return etag, last_modified
+
     def get(self, request: Request):
-        qs = self.get_queryset(request)
-        items, meta = self.paginate(request, qs)
-        serializer = PhotoSerializer(items, many=True, context={"request": request})
-        response = Response(
-            {"results": serializer.data, "meta": meta},
-            status=status.HTTP_200_OK,
+        # The catalog version is the only query an unchanged catalog costs.
+        self.catalog_version, modified_at = catalog_version()
+        image_format = negotiate_image_format(request.META.get("HTTP_ACCEPT"))
+        cacheable = (
+            request.accepted_renderer.format == "json" and modified_at is not None
+        )
+        # Cached bodies are stored compressed too (br, gzip).
+        encoding = "identity"
+        if cacheable:
+            encoding = negotiate_content_encoding(
+                request.META.get("HTTP_ACCEPT_ENCODING")
+            )
+        etag, last_modified = self.validators(
+            request, self.catalog_version, modified_at, image_format, encoding
+        )
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
         )
+        if response is None and cacheable:
+            # Rendered bodies are cached per query; the timestamp keeps
+            # versions from a reset database from matching old entries.
+            (version, modified_at), bodies = cached_api_response(
+                api_response_cache_key(request, image_format),
+                (self.catalog_version, modified_at),
+                lambda: self.render_body(request, image_format),
+                stale_for=(timezone.now() - modified_at).total_seconds(),
+            )
+            if encoding not in bodies:
+                # Too small to be worth compressing.
+                encoding = "identity"
+            etag, last_modified = self.validators(
+                request, version, modified_at, image_format, encoding
+            )
+            # A client may already hold the stale body being served.
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            if response is None:
+                response = HttpResponse(
+                    bodies[encoding],
+                    content_type=request.accepted_renderer.media_type,
+                )
+                if encoding != "identity":
+                    response["Content-Encoding"] = encoding
+        elif response is None:
+            response = Response(
+                self.get_data(request, image_format),
+                status=status.HTTP_200_OK,
+            )
+
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
         patch_cache_control(response, public=True, max_age=60)
+        # Image URLs depend on the negotiated format; Cloudinary negotiates
+        # per image request itself (f_auto), so its URLs never vary.
+        if not settings.USE_CLOUDINARY and len(available_rendition_formats()) > 1:
+            patch_vary_headers(response, ["Accept"])
+        if cacheable:
+            patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+
+class PhotoListV2(PhotoList):
+    """
+    GET /api/v2/photos/: PhotoList without the legacy folder aliases, in
+    the payload (folder, folder_title, folder_slug, folder_order) and in
+    the query string (folder=).
+    """
+    LEGACY_ALIASES = False
+
+
+UPLOAD_CHUNK_CONTENT_TYPE = "application/offset+octet-stream"
+
+
+def _upload_session_response(session, status_code=status.HTTP_200_OK):
+    response = Response(
+        {
+            "id": str(session.pk),
+            "filename": session.filename,
+            "length": session.length,
+            "offset": session.offset,
+            "status": session.status,
+            "photo_id": session.photo_id,
+            "duplicate": session.duplicate,
+            "error": session.error,
+            "upload_url": reverse("upload_session", args=[session.pk]),
+            "finalize_url": reverse("upload_session_finalize", args=[session.pk]),
+        },
+        status=status_code,
+    )
+    response["Upload-Offset"] = str(session.offset)
+    response["Upload-Length"] = str(session.length)
+    response["Cache-Control"] = "no-store"
+    return response
+
+
+def _upload_error(detail, status_code, session=None, retry_after=None):
+    response = Response({"detail": detail}, status=status_code)
+    if session is not None:
+        response["Upload-Offset"] = str(session.offset)
+    if retry_after is not None:
+        response["Retry-After"] = str(retry_after)
+    return response
+
+
+class UploadSessionCreate(APIView):
+    """
+    POST /api/uploads/  (staff only)
+
+    Opens a resumable upload of one image. Headers:
+
+    - Idempotency-Key: client-chosen id for this file; repeating the POST with
+      the same key returns the existing session instead of opening another
+    - Upload-Length: total size in bytes
+
+    JSON body: filename, and optionally label (slug), title_prefix and
+    description. Answers 201 with Location pointing at the session, which
+    takes the bytes as PATCH chunks; POST .../finalize/ then creates the
+    Photo.
+    """
+    permission_classes = [IsAdminUser]
+    direct = False
+
+    def post(self, request: Request):
+        if self.direct and not direct_upload_supported():
+            return _upload_error(
+                "Direct uploads need S3 storage; use the resumable upload API.",
+                status.HTTP_501_NOT_IMPLEMENTED,
+            )
+        key = request.headers.get("Idempotency-Key", "").strip()
+        if not key or len(key) > 128:
+            return _upload_error(
+                "An Idempotency-Key header of at most 128 characters is required.",
+                status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            length = int(request.headers.get("Upload-Length", ""))
+        except ValueError:
+            return _upload_error(
+                "Upload-Length must be the file size in bytes.",
+                status.HTTP_400_BAD_REQUEST,
+            )
+        if length < 1:
+            return _upload_error(
+                "Upload-Length must be the file size in bytes.",
+                status.HTTP_400_BAD_REQUEST,
+            )
+        if length > MAX_UPLOAD_BYTES:
+            return _upload_error(
+                "Images must be 20 MB or smaller.",
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+
+        filename = os.path.basename(str(request.data.get("filename") or ""))[:255]
+        if not filename:
+            return _upload_error(
+                "filename is required.", status.HTTP_400_BAD_REQUEST
+            )
+        content_type = direct_upload_content_type(filename)
+        if self.direct and content_type is None:
+            return _upload_error(
+                "Only JPEG, PNG, and WebP images are accepted.",
+                status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            )
+        label = None
+        label_slug = request.data.get("label")
+        if label_slug:
+            label = Label.objects.filter(slug=label_slug).first()
+            if label is None:
+                return _upload_error(
+                    f"Unknown label {label_slug!r}.", status.HTTP_400_BAD_REQUEST
+                )
+
+        prune_upload_sessions()
+        session, created = UploadSession.objects.get_or_create(
+            owner=request.user,
+            idempotency_key=key,
+            defaults={
+                "filename": filename,
+                "length": length,
+                "label": label,
+                "title_prefix": str(request.data.get("title_prefix") or "")[:80],
+                "description": str(request.data.get("description") or ""),
+                "storage_name": (
+                    direct_upload_name(filename, label) if self.direct else ""
+                ),
+            },
+        )
+        if not created and (
+            session.filename != filename
+            or session.length != length
+            or bool(session.storage_name) != self.direct
+        ):
+            return _upload_error(
+                "This Idempotency-Key was already used for a different file.",
+                status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+
+        response = _upload_session_response(
+            session,
+            status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+        if self.direct and session.status == UploadSession.Status.OPEN:
+            # Retries get fresh targets; earlier ones may have expired.
+            response.data["upload"] = presigned_upload_targets(
+                session.storage_name, content_type, session.length
+            )
+        response["Location"] = reverse("upload_session", args=[session.pk])
         return response
 
+
+class DirectUploadSessionCreate(UploadSessionCreate):
+    """
+    POST /api/uploads/direct/  (staff only, S3 storage)
+
+    Same request as POST /api/uploads/, but the answer carries presigned
+    targets under "upload" ("put": URL and headers for a single PUT, "post":
+    URL and form fields for a multipart POST) that write the original
+    straight to the bucket under the photo_upload_to layout, so its bytes
+    never pass through this server. POST .../finalize/ once the browser's
+    upload succeeded.
+    """
+    direct = True
+
+
+class UploadSessionDetail(APIView):
+    """
+    /api/uploads/<id>/  (staff only)
+
+    - GET/HEAD reports the session; Upload-Offset is where to resume
+    - PATCH appends a chunk: Content-Type application/offset+octet-stream,
+      Upload-Offset must equal the session's offset (409 with the current
+      offset otherwise), Content-Length at most PHOTO_UPLOAD_CHUNK_MAX_BYTES.
+      Answers 204 with the new Upload-Offset.
+    - DELETE abandons an unfinished session and its bytes
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request: Request, session_id):
+        session = get_object_or_404(
+            UploadSession, pk=session_id, owner=request.user
+        )
+        return _upload_session_response(session)
+
+    def patch(self, request: Request, session_id):
+        if request.content_type.split(";")[0].strip() != UPLOAD_CHUNK_CONTENT_TYPE:
+            return _upload_error(
+                f"Chunks must be sent as {UPLOAD_CHUNK_CONTENT_TYPE}.",
+                status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            )
+        try:
+            offset = int(request.headers.get("Upload-Offset", ""))
+            chunk_length = int(request.META.get("CONTENT_LENGTH") or "")
+        except ValueError:
+            return _upload_error(
+                "Upload-Offset and Content-Length headers are required.",
+                status.HTTP_400_BAD_REQUEST,
+            )
+        if chunk_length > settings.PHOTO_UPLOAD_CHUNK_MAX_BYTES:
+            return _upload_error(
+                "Chunks must be "
+                f"{settings.PHOTO_UPLOAD_CHUNK_MAX_BYTES} bytes or smaller.",
+                status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+
+        with transaction.atomic():
+            session = get_object_or_404(
+                UploadSession.objects.select_for_update(),
+                pk=session_id,
+                owner=request.user,
+            )
+            if session.status != UploadSession.Status.OPEN:
+                return _upload_error(
+                    f"This upload is {session.status}.",
+                    status.HTTP_409_CONFLICT,
+                    session,
+                )
+            if session.storage_name:
+                return _upload_error(
+                    "Direct uploads are written to storage, not PATCHed.",
+                    status.HTTP_409_CONFLICT,
+                    session,
+                )
+            if offset != session.offset:
+                return _upload_error(
+                    "Upload-Offset does not match; resume from the "
+                    "returned offset.",
+                    status.HTTP_409_CONFLICT,
+                    session,
+                )
+            if offset + chunk_length > session.length:
+                return _upload_error(
+                    "The chunk runs past Upload-Length.",
+                    status.HTTP_400_BAD_REQUEST,
+                    session,
+                )
+            if chunk_length:
+                session.offset = append_chunk(
+                    session, offset, request.stream, chunk_length
+                )
+                session.save(update_fields=["offset", "updated_at"])
+
+        response = Response(status=status.HTTP_204_NO_CONTENT)
+        response["Upload-Offset"] = str(session.offset)
+        return response
+
+    def delete(self, request: Request, session_id):
+        with transaction.atomic():
+            session = get_object_or_404(
+                UploadSession.objects.select_for_update(),
+                pk=session_id,
+                owner=request.user,
+            )
+            if session.status in (
+                UploadSession.Status.FINALIZED,
+                UploadSession.Status.FINALIZING,
+            ):
+                return _upload_error(
+                    f"{session.get_status_display()} uploads cannot be cancelled.",
+                    status.HTTP_409_CONFLICT,
+                    session,
+                )
+            discard_spool(session)
+            if session.storage_name:
+                name = session.storage_name
+                transaction.on_commit(
+                    lambda: schedule_storage_file_deletion([name])
+                )
+            session.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class UploadSessionFinalize(APIView):
+    """
+    POST /api/uploads/<id>/finalize/  (staff only)
+
+    Turns a complete session into a Photo and queues its derivatives.
+    Direct uploads are read back from storage and keep the object the
+    browser wrote. Finalizing again returns the same photo. A file whose
+    SHA-256 matches an existing photo is not stored twice: the session
+    points at that photo with duplicate=true. Invalid images answer 422 and
+    fail the session. While another request is finalizing the session, this
+    answers 409 with Retry-After.
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request: Request, session_id):
+        # The row lock is only held to claim the session. Reading the file
+        # back, validating it and writing the original (to storage or
+        # Cloudinary) happen outside any transaction, so a slow round trip
+        # does not block the row, or on SQLite every other writer.
+        with transaction.atomic():
+            session = get_object_or_404(
+                UploadSession.objects.select_for_update(),
+                pk=session_id,
+                owner=request.user,
+            )
+            if session.status == UploadSession.Status.FINALIZED:
+                return _upload_session_response(session)
+            if session.status == UploadSession.Status.FAILED:
+                return _upload_error(
+                    session.error, status.HTTP_422_UNPROCESSABLE_ENTITY, session
+                )
+            if (
+                session.status == UploadSession.Status.FINALIZING
+                and session.updated_at > self._finalize_lease_cutoff()
+            ):
+                return _upload_error(
+                    "This upload is already being finalized.",
+                    status.HTTP_409_CONFLICT,
+                    session,
+                    retry_after=settings.IMAGE_PROCESSING_RETRY_AFTER,
+                )
+            if not settings.USE_CLOUDINARY and derivative_backlog_saturated():
+                return _upload_error(
+                    "Previews for earlier uploads are still processing.",
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                    retry_after=settings.IMAGE_PROCESSING_RETRY_AFTER,
+                )
+            session.status = UploadSession.Status.FINALIZING
+            session.save(update_fields=["status", "updated_at"])
+
+        try:
+            return self._finalize(session)
+        except Exception:
+            self._release(session)
+            raise
+
+    def _finalize(self, session):
+        incomplete = self._incomplete(session)
+        if incomplete:
+            self._release(session)
+            return _upload_error(incomplete, status.HTTP_409_CONFLICT, session)
+
+        photo = None
+        with self._open_upload(session) as upload:
+            try:
+                validate_uploaded_image(upload)
+            except ValidationError as error:
+                self._release(session, error=" ".join(error.messages))
+                return _upload_error(
+                    session.error, status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+
+            existing = Photo.objects.filter(
+                content_sha256=upload.ingested.content_sha256
+            ).first()
+            if existing is None:
+                try:
+                    photo = self._prepare_photo(session, upload)
+                except ImageProcessingBusy as busy:
+                    self._release(session)
+                    return _upload_error(
+                        str(busy),
+                        status.HTTP_503_SERVICE_UNAVAILABLE,
+                        retry_after=busy.retry_after,
+                    )
+                except Exception:
+                    logger.exception("Unable to finalize upload %s", session.pk)
+                    self._release(session)
+                    return _upload_error(
+                        "The photo could not be stored; finalize again.",
+                        status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    )
+
+        # Only the rows are written while the session is locked again.
+        try:
+            with transaction.atomic():
+                if photo is not None:
+                    photo.save()
+                    _normalize_order(session.label)
+                    if not settings.USE_CLOUDINARY:
+                        schedule_photo_derivative_generation([photo.pk])
+                session.photo = photo or existing
+                session.duplicate = photo is None
+                session.status = UploadSession.Status.FINALIZED
+                session.save(
+                    update_fields=["status", "photo", "duplicate", "updated_at"]
+                )
+                self._discard_on_commit(
+                    session, keep_stored=not session.duplicate
+                )
+        except Exception:
+            logger.exception("Unable to finalize upload %s", session.pk)
+            if photo is not None and not session.storage_name:
+                # The original this request wrote has no row to keep it.
+                schedule_storage_file_deletion([photo.image.name])
+            self._release(session)
+            return _upload_error(
+                "The photo could not be stored; finalize again.",
+                status.HTTP_500_INTERNAL_SERVER_ERROR,
+            )
+        return _upload_session_response(session)
+
+    @staticmethod
+    def _finalize_lease_cutoff():
+        # A session left finalizing longer than this was abandoned by a
+        # crashed request and may be claimed again.
+        return timezone.now() - timedelta(
+            seconds=settings.PHOTO_UPLOAD_FINALIZE_LEASE_SECONDS
+        )
+
+    @classmethod
+    def _release(cls, session, error=""):
+        """Hand a finalizing session back: open for a retry, or failed."""
+        with transaction.atomic():
+            session.status = (
+                UploadSession.Status.FAILED if error else UploadSession.Status.OPEN
+            )
+            session.error = error
+            session.save(update_fields=["status", "error", "updated_at"])
+            if error:
+                cls._discard_on_commit(session, keep_stored=False)
+
+    @staticmethod
+    def _incomplete(session):
+        if not session.storage_name:
+            if session.offset != session.length:
+                return f"Only {session.offset} of {session.length} bytes arrived."
+            return ""
+        try:
+            stored_size = default_storage.size(session.storage_name)
+        except Exception:
+            # S3 raises ClientError for a missing key; local storage OSError.
+            stored_size = None
+        if stored_size != session.length:
+            return "The upload has not reached storage yet."
+        return ""
+
+    @staticmethod
+    def _open_upload(session):
+        if session.storage_name:
+            stored = default_storage.open(session.storage_name, "rb")
+        else:
+            stored = open(session_spool_path(session), "rb")
+        return File(stored, name=session.filename)
+
+    @staticmethod
+    def _discard_on_commit(session, keep_stored):
+        name = "" if keep_stored else session.storage_name
+        transaction.on_commit(lambda: discard_spool(session))
+        if name:
+            transaction.on_commit(lambda: schedule_storage_file_deletion([name]))
+
+    @staticmethod
+    def _prepare_photo(session, upload):
+        """
+        Build the session's Photo and write its original to storage (or
+        Cloudinary), without saving the row.
+        """
+        ingested = upload.ingested
+        stored_image = upload
+        metadata = {}
+        if settings.USE_CLOUDINARY:
+            stored_image, metadata, _ = prepare_uploaded_image_for_storage(
+                upload,
+                max_bytes=settings.CLOUDINARY_MAX_IMAGE_BYTES,
+                max_pixels=settings.CLOUDINARY_MAX_IMAGE_PIXELS,
+            )
+        try:
+            photo = Photo(
+                title=_photo_title_from_upload(upload, session.title_prefix),
+                description=session.description,
+                label=session.label,
+                # Direct uploads are already in place; nothing is written again.
+                image=session.storage_name or None,
+                content_sha256=ingested.content_sha256,
+                perceptual_hash=ingested.perceptual_hash,
+                **metadata,
+            )
+            photo._defer_derivatives = True
+            photo._ingested = ingested
+            if not session.storage_name:
+                photo.image.save(stored_image.name, stored_image, save=False)
+        finally:
+            if stored_image is not upload:
+                stored_image.close()
+        return photo
+
+
+# Client hints the variant endpoint asks browsers to send.
+VARIANT_CLIENT_HINTS = ["Sec-CH-Width", "Sec-CH-DPR", "Width", "DPR", "Save-Data"]
+
+
+@require_GET
+def photo_variant(request, photo_id, width, height, extension):
+    """
+    GET /img/<photo_id>/<w>x<h>.<fmt>
+
+    Render an allow-listed variant of a photo on first request and serve it
+    from the local variant cache afterwards. Width/DPR hints may pick a
+    larger allow-listed box of the same shape; Save-Data picks the 1x box at
+    lower quality.
+    """
+    size = (width, height)
+    image_format = variant_format(extension)
+    if image_format is None or size not in variant_sizes():
+        raise Http404("Unknown image variant.")
+    photo = get_object_or_404(Photo.objects.only("id", "image"), pk=photo_id)
+    if not photo.image:
+        raise Http404("Photo has no image.")
+    if settings.USE_CLOUDINARY:
+        return redirect(
+            cloudinary_variant_url(photo._field_url(photo.image), width)
+        )
+
+    box, save_data = resolve_variant_size(size, request.META)
+    quality = variant_quality(box[0], save_data)
+    storage_name = photo.image.name
+    etag = f'"{variant_cache_key(storage_name, box, image_format, quality)}"'
+    if etag in request.META.get("HTTP_IF_NONE_MATCH", ""):
+        response = HttpResponseNotModified()
+    else:
+        try:
+            _, content = cached_variant(
+                storage_name,
+                box,
+                image_format,
+                quality,
+                lambda: render_variant(
+                    storage_name,
+                    box,
+                    image_format,
+                    quality,
+                    admission_timeout=settings.IMAGE_PROCESSING_ADMISSION_TIMEOUT,
+                ),
+            )
+        except FileNotFoundError:
+            raise Http404("Original image is missing.")
+        except ImageProcessingBusy as busy:
+            response = HttpResponse(str(busy), status=503, content_type="text/plain")
+            response["Retry-After"] = str(busy.retry_after)
+            return response
+        response = HttpResponse(content, content_type=variant_content_type(image_format))
+
+    response["ETag"] = etag
+    response["Accept-CH"] = ", ".join(VARIANT_CLIENT_HINTS)
+    patch_cache_control(response, public=True, max_age=31536000, immutable=True)
+    patch_vary_headers(response, VARIANT_CLIENT_HINTS)
+    return response
+
+
+def _processing_event(photo_id, state, thumbnail_url=""):
+    payload = {
+        "id": photo_id,
+        "state": state["state"],
+        "attempts": state["attempts"],
+        "duration_ms": state["duration_ms"],
+        "thumbnail_url": thumbnail_url,
+    }
+    return f"event: photo\ndata: {json.dumps(payload)}\n\n"
+
+
+def _processing_event_stream(photo_ids):
+    """
+    Yield Server-Sent Events for photo processing state changes until every
+    photo is done or failed, or the stream's time budget runs out (the
+    browser then reconnects and receives the current states again).
+    """
+    deadline = time.monotonic() + settings.PHOTO_PROGRESS_STREAM_SECONDS
+    sent = {}
+    yield f"retry: {settings.PHOTO_PROGRESS_RETRY_MS}\n\n"
+    while True:
+        states = photo_processing_states(photo_ids)
+        changed = {
+            photo_id: state
+            for photo_id, state in states.items()
+            if sent.get(photo_id) != state
+        }
+        done_ids = [
+            photo_id
+            for photo_id, state in changed.items()
+            if state["state"] == PROCESSING_DONE
+        ]
+        thumbnails = {
+            photo.pk: photo.thumbnail_url
+            for photo in Photo.objects.filter(pk__in=done_ids).only(
+                "id", "image", "thumb"
+            )
+        }
+        for photo_id, state in changed.items():
+            sent[photo_id] = state
+            yield _processing_event(photo_id, state, thumbnails.get(photo_id, ""))
+
+        pending = [
+            photo_id
+            for photo_id in photo_ids
+            if photo_id in states
+            and states[photo_id]["state"] not in PROCESSING_TERMINAL_STATES
+        ]
+        if not pending:
+            yield "event: complete\ndata: {}\n\n"
+            return
+        if time.monotonic() >= deadline:
+            return
+        yield ": waiting\n\n"
+        time.sleep(settings.PHOTO_PROGRESS_POLL_SECONDS)
+
+
+@staff_member_required
+@require_GET
+def processing_events(request):
+    """
+    GET /processing/events/?ids=1,2,3
+
+    Server-Sent Events stream of derivative processing state for a batch of
+    photos: one "photo" event per state change and a final "complete".
+    """
+    photo_ids = []
+    for value in request.GET.get("ids", "").split(","):
+        if value.strip().isdigit():
+            photo_ids.append(int(value))
+    photo_ids = photo_ids[: settings.PHOTO_PROGRESS_MAX_BATCH]
+    response = StreamingHttpResponse(
+        _processing_event_stream(photo_ids),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # Stop nginx-style proxies from buffering the stream.
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 def _normalize_order(label: Label | None):
     """
     Keep contiguous ordering (n..1) inside a label, or among unlabeled photos.
-    Uses bulk_update to avoid n queries.
+    Only rows whose order changes are written, in one bulk_update, and the
+    catalog version moves only then.
     """
     with transaction.atomic():
         if label:
@@ -119,10 +1065,14 @@ def _normalize_order(label: Label | None):
 
         photos = list(qs.order_by("-order").only("id", "order"))
         n = len(photos)
+        changed = []
         for i, p in enumerate(photos):
-            p.order = n - i
-        if photos:
-            Photo.objects.bulk_update(photos, ["order"])
+            if p.order != n - i:
+                p.order = n - i
+                changed.append(p)
+        if changed:
+            Photo.objects.bulk_update(changed, ["order"])
+            bump_catalog_version()
 
 
 def _photo_title_from_upload(upload, title_prefix=""):
@@ -143,6 +1093,27 @@ def _next_order_for_label(label: Label | None, exclude_photo_id=None):
     return (qs.aggregate(models.Max("order"))["order__max"] or 0) + 1
 
 
+def _write_originals(photos_and_files):
+    """
+    Save each (photo, file) original to storage, at most
+    PHOTO_UPLOAD_STORAGE_CONCURRENCY at a time, without saving the rows.
+    Returns the exception raised for each pair, or None where it worked.
+    """
+    def write(item):
+        photo, upload = item
+        try:
+            photo.image.save(upload.name, upload, save=False)
+        except Exception as error:
+            return error
+        return None
+
+    if not photos_and_files:
+        return []
+    workers = min(settings.PHOTO_UPLOAD_STORAGE_CONCURRENCY, len(photos_and_files))
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        return list(pool.map(write, photos_and_files))
+
+
 def _unique_label_slug(title):
     base_slug = slugify(title) or "folder"
     candidate = base_slug
@@ -157,8 +1128,18 @@ def _manager_context(photos, active_label=None, folder_form=None, **extra):
     labels = Label.objects.annotate(photo_count=models.Count("photos")).order_by(
         "-order", "-id"
     )
+    photos = list(photos)
+    states = photo_processing_states(photo.pk for photo in photos)
+    processing_ids = []
+    for photo in photos:
+        photo.processing = states.get(photo.pk)
+        if photo.processing and (
+            photo.processing["state"] not in PROCESSING_TERMINAL_STATES
+        ):
+            processing_ids.append(photo.pk)
     context = {
         "photos": photos,
+        "processing_ids": ",".join(str(photo_id) for photo_id in processing_ids),
         "active_label": active_label,
         "labels": labels,
         "total_photo_count": Photo.objects.count(),
@@ -169,6 +1150,21 @@ def _manager_context(photos, active_label=None, folder_form=None, **extra):
     return context
 
 
+def _upload_busy_response(request, form, busy):
+    messages.warning(
+        request,
+        f"{busy} Try again in {busy.retry_after} seconds.",
+    )
+    response = render(
+        request,
+        "photos/upload_photo.html",
+        {"form": form},
+        status=503,
+    )
+    response["Retry-After"] = str(busy.retry_after)
+    return response
+
+
 def _manager_redirect(return_label_slug="", return_view=""):
     if return_label_slug and Label.objects.filter(slug=return_label_slug).exists():
         return redirect("label_detail", slug=return_label_slug)
@@ -218,9 +1214,29 @@ def photo_list(request):
 # ---------- Admin-only actions ----------
 
 @staff_member_required
+@csrf_exempt
 def upload_photo(request):
+    # The streaming handler has to be in place before anything reads the
+    # body, and CsrfViewMiddleware reads it; CSRF is checked just below.
+    request.upload_handlers = [StreamingImageUploadHandler(request)]
+    return _upload_photo(request)
+
+
+@csrf_protect
+def _upload_photo(request):
     if request.method == "POST":
-        form = BulkPhotoUploadForm(request.POST, request.FILES)
+        if not settings.USE_CLOUDINARY and derivative_backlog_saturated():
+            return _upload_busy_response(
+                request,
+                BulkPhotoUploadForm(),
+                ImageProcessingBusy("Previews for earlier uploads are still processing."),
+            )
+
+        form = BulkPhotoUploadForm(
+            request.POST,
+            request.FILES,
+            upload_rejection=getattr(request, "upload_rejection", None),
+        )
         if form.is_valid():
             label = form.cleaned_data["label"]
             title_prefix = form.cleaned_data["title_prefix"]
@@ -229,63 +1245,202 @@ def upload_photo(request):
 
             uploaded_photo_ids = []
             failed_names = []
+            duplicates = []
+            near_duplicates = []
             optimized_count = 0
+            busy = None
+            near_index = PerceptualHashIndex(
+                ((photo_id, title), phash)
+                for photo_id, title, phash in Photo.objects.exclude(
+                    perceptual_hash=None
+                ).values_list("id", "title", "perceptual_hash")
+            )
+
+            # The form fingerprinted each upload as received, before any
+            # storage write, so exact duplicates cost no storage or
+            # derivatives. Identical files within the batch are stored
+            # once: the next copy is only tried if the first one's write
+            # fails.
+            existing_titles = dict(
+                Photo.objects.filter(
+                    content_sha256__in={
+                        image.ingested.content_sha256 for image in images
+                    }
+                ).values_list("content_sha256", "title")
+            )
+            copies = {}
             for image in images:
-                original_name = image.name
-                stored_image = image
-                camera_settings = {}
-                was_optimized = False
-                if settings.USE_CLOUDINARY:
-                    try:
-                        (
-                            stored_image,
-                            camera_settings,
-                            was_optimized,
-                        ) = prepare_uploaded_image_for_storage(
-                            image,
-                            max_bytes=settings.CLOUDINARY_MAX_IMAGE_BYTES,
-                            max_pixels=settings.CLOUDINARY_MAX_IMAGE_PIXELS,
-                        )
-                    except Exception:
-                        logger.exception(
-                            "Unable to optimize photo %s",
-                            original_name,
-                        )
-                        failed_names.append(original_name)
-                        image.close()
+                content_sha256 = image.ingested.content_sha256
+                existing_title = existing_titles.get(content_sha256)
+                if content_sha256 and existing_title is not None:
+                    duplicates.append((image.name, existing_title))
+                    image.close()
+                    continue
+                copies.setdefault(content_sha256 or id(image), []).append(image)
+
+            def fail_copies(image, group):
+                for upload in [image, *group]:
+                    failed_names.append(upload.name)
+                    upload.close()
+                group.clear()
+
+            # Originals are written to storage concurrently, a round at a
+            # time; the rows follow in one INSERT.
+            stored = []
+            attempts = [(group, group.pop(0)) for group in copies.values()]
+            while attempts:
+                pending = []
+                for group, image in attempts:
+                    if busy is not None:
+                        fail_copies(image, group)
                         continue
 
-                photo = Photo(
-                    title=_photo_title_from_upload(image, title_prefix),
-                    description=description,
-                    label=label,
-                    image=stored_image,
-                    **camera_settings,
+                    stored_image = image
+                    metadata = {}
+                    was_optimized = False
+                    if settings.USE_CLOUDINARY:
+                        try:
+                            (
+                                stored_image,
+                                metadata,
+                                was_optimized,
+                            ) = prepare_uploaded_image_for_storage(
+                                image,
+                                max_bytes=settings.CLOUDINARY_MAX_IMAGE_BYTES,
+                                max_pixels=settings.CLOUDINARY_MAX_IMAGE_PIXELS,
+                            )
+                        except ImageProcessingBusy as error:
+                            busy = error
+                            fail_copies(image, group)
+                            continue
+                        except Exception:
+                            # Copies hold the same bytes and would fail too.
+                            logger.exception(
+                                "Unable to optimize photo %s",
+                                image.name,
+                            )
+                            fail_copies(image, group)
+                            continue
+
+                    ingested = image.ingested
+                    # Only uploads hashed during validation (JPEGs) can be
+                    # matched now; the rest get their dHash with derivatives.
+                    near_match = near_index.nearest(
+                        ingested.perceptual_hash,
+                        settings.PHOTO_NEAR_DUPLICATE_DISTANCE,
+                    )
+                    photo = Photo(
+                        title=_photo_title_from_upload(image, title_prefix),
+                        description=description,
+                        label=label,
+                        **metadata,
+                    )
+                    photo.apply_ingested(ingested)
+                    near_index.add((None, photo.title), ingested.perceptual_hash)
+                    pending.append(
+                        (group, photo, image, stored_image, was_optimized, near_match)
+                    )
+
+                write_errors = _write_originals(
+                    [(item[1], item[3]) for item in pending]
                 )
-                photo._defer_derivatives = True
+                attempts = []
+                for item, error in zip(pending, write_errors):
+                    group, photo, image, stored_image, was_optimized, near_match = item
+                    if stored_image is not image:
+                        stored_image.close()
+                    image.close()
+                    if error is not None:
+                        logger.error(
+                            "Unable to upload photo %s",
+                            image.name,
+                            exc_info=error,
+                        )
+                        failed_names.append(image.name)
+                        if group:
+                            attempts.append((group, group.pop(0)))
+                        continue
+                    stored.append((photo, image.name, was_optimized, near_match))
+                    for copy in group:
+                        duplicates.append((copy.name, photo.title))
+                        copy.close()
+                    group.clear()
+
+            if stored:
+                next_order = _next_order_for_label(label)
+                for index, (photo, _, _, _) in enumerate(stored):
+                    photo.order = next_order + index
                 try:
-                    photo.save()
+                    with transaction.atomic():
+                        Photo.objects.bulk_create(
+                            [photo for photo, _, _, _ in stored]
+                        )
+                        bump_catalog_version()
                 except Exception:
-                    logger.exception("Unable to upload photo %s", original_name)
-                    failed_names.append(original_name)
-                    if (
-                        photo.image
-                        and photo.image.name
-                        and getattr(photo.image, "_committed", False)
-                    ):
-                        schedule_storage_file_deletion([photo.image.name])
-                else:
-                    uploaded_photo_ids.append(photo.pk)
-                    optimized_count += int(was_optimized)
-
-                if stored_image is not image:
-                    stored_image.close()
-                image.close()
+                    logger.exception(
+                        "Unable to record %s uploaded photos", len(stored)
+                    )
+                    schedule_storage_file_deletion(
+                        [photo.image.name for photo, _, _, _ in stored]
+                    )
+                    failed_names.extend(name for _, name, _, _ in stored)
+                    stored = []
+
+            for photo, name, was_optimized, near_match in stored:
+                uploaded_photo_ids.append(photo.pk)
+                optimized_count += int(was_optimized)
+                if near_match is not None:
+                    near_duplicates.append((name, near_match[1]))
+
+            if uploaded_photo_ids and not settings.USE_CLOUDINARY:
+                schedule_photo_derivative_generation(uploaded_photo_ids)
+
+            if busy is not None:
+                uploaded_count = len(uploaded_photo_ids)
+                return _upload_busy_response(
+                    request,
+                    BulkPhotoUploadForm(),
+                    ImageProcessingBusy(
+                        "The server is busy processing images; uploaded "
+                        f"{uploaded_count} of {len(images)} "
+                        f"photo{'s' if len(images) != 1 else ''}. "
+                        "Upload the remaining files again.",
+                        retry_after=busy.retry_after,
+                    ),
+                )
+
+            if duplicates:
+                duplicate_summary = ", ".join(
+                    f'{name} (already uploaded as "{title}")'
+                    for name, title in duplicates[:3]
+                )
+                if len(duplicates) > 3:
+                    duplicate_summary += f" and {len(duplicates) - 3} more"
+                messages.info(
+                    request,
+                    f"Skipped {len(duplicates)} duplicate "
+                    f"file{'s' if len(duplicates) != 1 else ''}: "
+                    f"{duplicate_summary}.",
+                )
+            if near_duplicates:
+                near_summary = ", ".join(
+                    f'{name} looks like "{title}"'
+                    for name, title in near_duplicates[:3]
+                )
+                if len(near_duplicates) > 3:
+                    near_summary += f" and {len(near_duplicates) - 3} more"
+                messages.warning(
+                    request,
+                    f"Possible near-duplicate"
+                    f"{'s' if len(near_duplicates) != 1 else ''}: "
+                    f"{near_summary}.",
+                )
+            if duplicates and not uploaded_photo_ids and not failed_names:
+                if label:
+                    return redirect("label_detail", slug=label.slug)
+                return redirect("photo_list")
 
             if uploaded_photo_ids:
-                _normalize_order(label)
-                if not settings.USE_CLOUDINARY:
-                    schedule_photo_derivative_generation(uploaded_photo_ids)
                 uploaded_count = len(uploaded_photo_ids)
                 processing_message = (
                     ""
@@ -379,7 +1534,9 @@ def bulk_photos(request):
             continue
 
     photos = list(
-        Photo.objects.select_related("label").filter(id__in=set(selected_ids))
+        Photo.objects.select_related("label")
+        .prefetch_related("renditions")
+        .filter(id__in=set(selected_ids))
     )
     if not photos:
         messages.error(request, "Select at least one photo.")
@@ -390,12 +1547,7 @@ def bulk_photos(request):
 
     if action == "delete":
         affected_label_ids = {photo.label_id for photo in photos}
-        storage_names = [
-            field.name
-            for photo in photos
-            for field in (photo.image, photo.thumb, photo.preview)
-            if field and field.name
-        ]
+        storage_names = [name for photo in photos for name in photo.storage_names()]
 
         with transaction.atomic():
             for photo in photos:
@@ -453,6 +1605,7 @@ def bulk_photos(request):
 
     with transaction.atomic():
         Photo.objects.bulk_update(photos, changed_fields)
+        bump_catalog_version()
         for label_id in affected_label_ids:
             label = Label.objects.filter(id=label_id).first() if label_id else None
             _normalize_order(label)
@@ -473,6 +1626,7 @@ def edit_photo(request, id):
         form = PhotoEditForm(request.POST, request.FILES, instance=photo)
         if form.is_valid():
             updated = form.save(commit=False)
+            updated._ingested = getattr(form.cleaned_data["image"], "ingested", None)
             label_changed = previous_label != updated.label
             if label_changed:
                 updated.order = _next_order_for_label(updated.label, updated.id)